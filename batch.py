@@ -0,0 +1,427 @@
+#-----------------------------------------------------------------------
+#Module: batch
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Non-interactive driver. Instead of asking for one case with input() it
+## reads a sweep (potentials x L x N x states) from a JSON file, solves
+## every case in a process pool and writes the results to disk.
+##
+## Usage: python batch.py sweep.json [--workers 4]
+##
+## Example sweep file:
+## {"potentials": ["O", "G"], "L": [5, 10], "N": [100, 200],
+##  "states": [10], "method": "shift-invert", "output": "results",
+##  "cache": ".eigencache", "cache_size_mb": 2048, "symmetry": true,
+##  "bc": "dirichlet", "render": "png", "store": "npy"}
+## The "cache" entry is optional and puts the eigenpair cache in front of
+## every solve. "symmetry" solves each symmetry sector separately (see
+## symmetry.py), every built in potential has the symmetry of the square.
+## "bc" is the boundary condition of every grid, "dirichlet" (default),
+## "periodic" or "absorbing". "render" draws the potential and all the
+## densities of every case into PNG or SVG files next to the results, in a
+## separate process pool while the remaining cases are still being solved.
+##
+## Any registered potential can be swept, with its parameters set by giving
+## a dict instead of a name, e.g. {"name": "G", "width": 0.3}. "define"
+## registers new potentials for the sweep, from a formula or a .npy table
+## (see potentials.define_potential):
+## "define": {"ring": {"expression": "a*(r - r0)**2", "params": {"a": 1, "r0": 2}},
+##            "dft": {"file": "v.npy", "extent": 10}}
+## "profile": true records the time and peak memory of every stage of every
+## case (see profiling.py) in the summary.
+## "vectors": false solves for the eigenvalues only. No eigenvectors are
+## formed or written, so it cannot be combined with a store or rendering,
+## and the cache (which holds eigenpairs) is skipped.
+## "count_below": [E1, E2, ...] adds to the summary an estimate of how many
+## states lie below each energy, with its standard error (stochastic
+## Lanczos quadrature, see spectraldensity.py), to check that "states"
+## covers a window before solving bigger grids.
+## "observables": true rotates every degenerate level into its canonical
+## basis before the eigenvectors are written, so results of different
+## runs and solvers can be compared. It adds the symmetry sector, <x>,
+## <y>, <x**2>, <y**2>, <r>, <r**2> and the nodal domain count of every
+## state to the summary (see observables.py). The solve runs a couple of
+## guard states past "states" to keep the last level whole, "cut_level"
+## lists the states of a level that is still cut off (empty if none).
+## "threads": n runs the matvecs and the BLAS calls of every solve on n
+## threads (see parallel.py). It sets SCHRODINGER_THREADS in each worker,
+## so symmetry sectors and multigrid levels use the threads too. Without
+## --workers the pool then gets one process per n cores.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## read_sweep
+## case_name
+## shared_kinetic
+## run_case
+## run_sweep
+## main
+##
+#-----------------------------------------------------------------------
+
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from cache import cached_solve, DEFAULT_MAX_BYTES
+from linearalgebra import creategrid, create_2d_lap, eigen_solve, separable_solve, BOUNDARY_CONDITIONS
+from quantum import create_potential, separable_potential, create_hamiltonian
+from potentials import get_potential, define_potential
+from symmetry import symmetry_solve
+from rendering import Renderer, FORMATS
+from eigenstore import save_eigenpairs, stream_separable
+from multigrid import coarse_to_fine_solve
+from spectraldensity import count_states
+from observables import GUARD_STATES, canonical_basis, symmetry_labels, state_observables, trim_states
+import profiling
+from profiling import stage
+from parallel import THREADS_ENV
+
+# Laplacians already built in this process, keyed by N and whether the grid
+# is periodic. The Laplacian only depends on those so every case with the
+# same N reuses it, only the 1/dx**2 scaling differs with L.
+_lap_cache = {}
+
+#-----------------------------------------------------------------------
+## Function: read_sweep
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Reads a sweep file and expands it into the list of cases to run.
+##----------------------------------------------------------------------
+## Input:
+## path             path of the JSON sweep file
+##----------------------------------------------------------------------
+## Output:
+## cases            list of dicts with potential, params, definition, L, N,
+##                  states, method, symmetry, bc, store, profile, vectors,
+##                  count_below, observables and threads
+## output           directory the results go into
+## cache            dict with the cache directory and size limit, or None
+## render           image format to render every case in, or None
+##----------------------------------------------------------------------
+def read_sweep(path):
+    with open(path) as f:
+        spec = json.load(f)
+
+    definitions = spec.get('define', {})
+    for name, definition in definitions.items():
+        define_potential(name, definition)
+    potentials = []
+    for pot in spec['potentials']:
+        params = dict(pot) if isinstance(pot, dict) else dict(name=pot)
+        name = params.pop('name')
+        # Unknown names and parameters raise here, before anything is solved.
+        get_potential(name).parameters(**params)
+        potentials.append((name, params))
+    for key in ('L', 'N', 'states'):
+        if any(value <= 0 for value in spec[key]):
+            raise ValueError("All values of {} in the sweep must be positive.".format(key))
+
+    method = spec.get('method', 'shift-invert')
+    symmetry = bool(spec.get('symmetry', False))
+    bc = spec.get('bc', 'dirichlet')
+    if bc not in BOUNDARY_CONDITIONS:
+        raise ValueError("Invalid boundary condition {} in sweep. Use one of {}.".format(bc, BOUNDARY_CONDITIONS))
+    if symmetry and bc == 'periodic':
+        raise ValueError("Symmetry sectors need a grid symmetric about 0, not a periodic one.")
+    if method in ('lobpcg', 'coarse-to-fine') and bc == 'absorbing':
+        raise ValueError("LOBPCG needs a hermitian hamiltonian, absorbing boundaries make it complex.")
+    if method == 'coarse-to-fine' and symmetry:
+        raise ValueError("Coarse to fine solves do not use the symmetry sectors, pick one of the two.")
+    store = spec.get('store')
+    if store not in (None, 'npy', 'hdf5'):
+        raise ValueError("Invalid store format {} in sweep. Use npy or hdf5.".format(store))
+    render = spec.get('render')
+    if render is not None and render not in FORMATS:
+        raise ValueError("Invalid render format {} in sweep. Use one of {}.".format(render, FORMATS))
+    vectors = bool(spec.get('vectors', True))
+    if not vectors and (store is not None or render is not None):
+        raise ValueError("A store and rendering need the eigenvectors, they cannot be used with \"vectors\": false.")
+    count_below = [float(energy) for energy in spec.get('count_below', [])]
+    if count_below and bc == 'absorbing':
+        raise ValueError("Counting states needs a hermitian hamiltonian, absorbing boundaries make it complex.")
+    observables = bool(spec.get('observables', False))
+    threads = spec.get('threads')
+    # Only a JSON integer, 2.0 would end up as "2.0" in SCHRODINGER_THREADS.
+    if threads is not None and (type(threads) is not int or threads < 1):
+        raise ValueError("Invalid number of threads {} in sweep, it must be a positive integer.".format(threads))
+    if observables and (not vectors or bc == 'absorbing'):
+        raise ValueError("Observables need the orthonormal eigenvectors of a hermitian hamiltonian.")
+    # Sorting by N keeps cases that share a Laplacian next to each other so they
+    # tend to land on the same worker. The definition travels with the case so
+    # worker processes can register it too.
+    cases = [dict(potential=name, params=params, definition=definitions.get(name), L=float(L), N=int(N),
+                  states=int(states), method=method, symmetry=symmetry, bc=bc, store=store,
+                  profile=bool(spec.get('profile', False)), vectors=vectors, count_below=count_below,
+                  observables=observables, threads=threads)
+             for N, (name, params), L, states in itertools.product(sorted(spec['N']), potentials,
+                                                                   spec['L'], spec['states'])]
+    cache = None
+    if 'cache' in spec:
+        max_bytes = spec.get('cache_size_mb', DEFAULT_MAX_BYTES/1024**2)*1024**2
+        cache = dict(cache_dir=spec['cache'], max_bytes=int(max_bytes))
+    return cases, spec.get('output', 'results'), cache, render
+
+#-----------------------------------------------------------------------
+## Function: case_name
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## File name used for the results of one case. Parameters set in the
+## sweep are part of it so cases differing only in them do not collide.
+##----------------------------------------------------------------------
+## Input:
+## case             dict with potential, params, L, N and states
+##----------------------------------------------------------------------
+## Output:
+## name             file name without extension
+##----------------------------------------------------------------------
+def case_name(case):
+    params = ''.join("_{}{:g}".format(key, value) for key, value in sorted(case.get('params', {}).items()))
+    return "{}{}_L{:g}_N{}_k{}".format(case['potential'], params, case['L'], case['N'], case['states'])
+
+#-----------------------------------------------------------------------
+## Function: shared_kinetic
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Returns the kinetic energy matrix for a grid, building the Laplacian
+## only the first time its N is needed in this process.
+##----------------------------------------------------------------------
+## Input:
+## grid             Grid from creategrid
+##----------------------------------------------------------------------
+## Output:
+## T                kinetic energy matrix
+##----------------------------------------------------------------------
+def shared_kinetic(grid):
+    key = (grid.N, grid.periodic)
+    if key not in _lap_cache:
+        _lap_cache[key] = create_2d_lap(grid.N, periodic=grid.periodic)
+    # Same scaling as create_kinetic.
+    return -1/(2*grid.dx**2)*_lap_cache[key]
+
+#-----------------------------------------------------------------------
+## Function: run_case
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Solves one case of the sweep and writes it to <output>/<case_name>.npz,
+## with the eigenvectors in <case_name>.eig (or .h5) if the case has a store.
+##----------------------------------------------------------------------
+## Input:
+## case             dict with potential, params, definition, L, N, states,
+##                  method, symmetry, bc, store, profile, vectors,
+##                  count_below, observables and threads
+## output           directory the results go into
+## cache            dict with the cache directory and size limit, or None
+##----------------------------------------------------------------------
+## Output:
+## summary          the case plus the eigenvalues, solver stats and file,
+##                  the stage records if the case is profiled, the
+##                  estimated counts if count_below is set and the
+##                  observables of every state if asked for
+##----------------------------------------------------------------------
+def run_case(case, output, cache=None):
+    L, N, states = case['L'], case['N'], case['states']
+    if case.get('definition') is not None:
+        define_potential(case['potential'], case['definition'])
+    params = case.get('params', {})
+    if case.get('threads') is not None:
+        # Every eigen_solve in this worker takes its default from here.
+        os.environ[THREADS_ENV] = str(case['threads'])
+    if case.get('profile'):
+        profiling.enable()
+    with stage('creategrid', N=N):
+        grid = creategrid(L, N, case.get('bc', 'dirichlet'))
+    with stage('create_potential', potential=case['potential']):
+        potential = create_potential(grid.x, grid.y, L, case['potential'], **params)
+
+    counts = None
+    if case.get('count_below'):
+        count_stats = {}
+        with stage('count_states') as record:
+            hamiltonian = create_hamiltonian(potential, shared_kinetic(grid), grid)
+            estimate = count_states(hamiltonian, case['count_below'], method='lanczos', stats=count_stats)
+            record.update(matvecs=count_stats['matvecs'])
+        counts = dict(energies=case['count_below'], counts=estimate.tolist(), errors=count_stats['error'].tolist())
+
+    stats = {}
+    vectors = case.get('vectors', True)
+    # The canonical basis needs the last level whole, the guard states are dropped after it.
+    solved = states + GUARD_STATES if case.get('observables') else states
+    separable = separable_potential(grid, case['potential'], **params)
+    def solve(v0):
+        if separable is not None:
+            with stage('eigen_solve') as record:
+                result = separable_solve(*separable, solved, dx=grid.dx, stats=stats, periodic=grid.periodic,
+                                         vectors=vectors)
+        elif case['method'] == 'coarse-to-fine':
+            # Builds its own hamiltonian on every level, all of it counts as the solve.
+            # The levels need their eigenvectors to start the next one.
+            with stage('eigen_solve') as record:
+                result = coarse_to_fine_solve(case['potential'], L, N, solved, bc=grid.bc, stats=stats,
+                                              params=params)
+            if not vectors:
+                result = result[0], None
+        else:
+            with stage('create_kinetic'):
+                kinetic = shared_kinetic(grid)
+            with stage('create_hamiltonian'):
+                hamiltonian = create_hamiltonian(potential, kinetic, grid)
+            with stage('eigen_solve') as record:
+                if case.get('symmetry'):
+                    result = symmetry_solve(hamiltonian, potential, solved, method=case['method'], stats=stats,
+                                            vectors=vectors)
+                else:
+                    result = eigen_solve(hamiltonian, solved, method=case['method'], v0=v0, stats=stats,
+                                         vectors=vectors)
+        # The solver stats (matvecs, iterations) go into the stage record too.
+        record.update({key: stats[key] for key in ('method', 'iterations', 'matvecs') if key in stats})
+        return result
+
+    name = case_name(case)
+    store = case.get('store')
+    store_path = None
+    if store is not None:
+        store_path = os.path.join(output, name + ('.h5' if store == 'hdf5' else '.eig'))
+        metadata = dict(potential=case['potential'], params=params, L=L, N=N, bc=grid.bc)
+
+    if store is not None and separable is not None and cache is None and not case.get('observables'):
+        # The N**2 x states block is never built, each state goes to disk as it is formed.
+        start = time.perf_counter()
+        with stage('eigen_solve', method='separable-stream'):
+            e_values = stream_separable(store_path, *separable, states, dx=grid.dx, periodic=grid.periodic,
+                                        metadata=metadata)
+        stats.update(method='separable-stream', iterations=0, matvecs=0, time=time.perf_counter() - start)
+        e_vec = None
+    elif cache is None or not vectors:
+        e_values, e_vec = solve(None)
+    else:
+        # The fingerprint holds every parameter (and the formula or table file)
+        # so any registered potential is keyed correctly without changes here.
+        key = dict(potential=get_potential(case['potential']).fingerprint(**params), L=L, N=N, bc=grid.bc)
+        e_values, e_vec, hit = cached_solve(cache['cache_dir'], key, solved, solve, cache['max_bytes'])
+        if hit:
+            stats.update(method='cache', iterations=0, matvecs=0, time=0.0)
+
+    observables = None
+    if case.get('observables'):
+        # Before anything is written so the stored states are the canonical ones.
+        with stage('observables'):
+            e_vec, clusters = canonical_basis(e_values, e_vec, N, grid.x, grid.y)
+            e_values, e_vec, cut = trim_states(e_values, e_vec, states, clusters)
+            observables = {key: value.tolist() for key, value in state_observables(e_vec, N, grid.x, grid.y).items()}
+            observables.update(sector=symmetry_labels(e_vec, N), cut_level=cut)
+
+    path = os.path.join(output, name + '.npz')
+    arrays = dict(e_values=e_values, potential=potential, L=L, N=N, states=states,
+                  potential_inp=case['potential'], bc=grid.bc)
+    if store is None:
+        if e_vec is not None:
+            arrays.update(e_vec=e_vec)
+    else:
+        if e_vec is not None:
+            save_eigenpairs(store_path, e_values, e_vec, N, metadata)
+        arrays.update(store=store_path)
+    np.savez_compressed(path, **arrays)
+
+    summary = dict(case)
+    summary.update(e_values=e_values.real.tolist(), stats=stats, file=path, store=store_path)
+    profiler = profiling.disable()
+    if profiler is not None:
+        summary.update(profile=profiler.records)
+    if counts is not None:
+        summary.update(counts=counts)
+    if observables is not None:
+        summary.update(observables=observables)
+    if np.iscomplexobj(e_values):
+        # Absorbing boundaries, E = E_r - i*Gamma/2 with Gamma the decay rate.
+        summary.update(widths=(-2*e_values.imag).tolist())
+    return summary
+
+#-----------------------------------------------------------------------
+## Function: run_sweep
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Runs every case in a process pool and writes summary.json next to the
+## per case result files. With render set, each case is handed to the
+## rendering pool as soon as it is solved.
+##----------------------------------------------------------------------
+## Input:
+## cases            list of cases from read_sweep
+## output           directory the results go into
+## workers          number of processes (None uses every core)
+## cache            dict with the cache directory and size limit, or None
+## render           image format ('png' or 'svg') or None to skip plots
+## render_workers   number of rendering processes
+##----------------------------------------------------------------------
+## Output:
+## summaries        list of run_case summaries in the order of cases
+##----------------------------------------------------------------------
+def run_sweep(cases, output, workers=None, cache=None, render=None, render_workers=2):
+    os.makedirs(output, exist_ok=True)
+
+    renderer = Renderer(output, render, render_workers) if render else None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_case, case, output, cache): i for i, case in enumerate(cases)}
+        summaries = [None]*len(cases)
+        renders = {}
+        for future in as_completed(futures):
+            i = futures[future]
+            summaries[i] = future.result()
+            if renderer is not None:
+                renders[i] = renderer.case(summaries[i]['file'])
+    if renderer is not None:
+        renderer.close()
+        for i, render_future in renders.items():
+            summaries[i]['images'] = render_future.result()
+
+    with open(os.path.join(output, 'summary.json'), 'w') as f:
+        json.dump(summaries, f, indent=1)
+    return summaries
+
+#-----------------------------------------------------------------------
+## Function: main
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Command line entry point.
+##----------------------------------------------------------------------
+## Input:
+## argv             command line arguments (defaults to sys.argv)
+##----------------------------------------------------------------------
+## Output:
+## N/A
+##----------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve a sweep of 2D Schrodinger problems.")
+    parser.add_argument('sweep', help="JSON sweep file")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--render-workers', type=int, default=2, help="number of rendering processes")
+    args = parser.parse_args(argv)
+
+    cases, output, cache, render = read_sweep(args.sweep)
+    print("{} cases read".format(len(cases)))
+    workers = args.workers
+    threads = cases[0].get('threads') if cases else None
+    if workers is None and threads is not None:
+        # Processes times threads should not be more than the cores.
+        workers = max(1, (os.cpu_count() or 1)//threads)
+
+    for summary in run_sweep(cases, output, workers, cache, render, args.render_workers):
+        print("{} solved with {} in {:.3f} s{}{}".format(os.path.basename(summary['file']),
+                                                         summary['stats']['method'], summary['stats']['time'],
+                                                         '' if summary['stats'].get('converged', True) else ', NOT CONVERGED',
+                                                         ', last level cut' if summary.get('observables', {}).get('cut_level') else ''))
+    return
+
+if __name__ == '__main__':
+    main()
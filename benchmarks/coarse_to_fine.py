@@ -0,0 +1,88 @@
+#-----------------------------------------------------------------------
+#Program: coarse to fine benchmark
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Time to solution of multigrid.coarse_to_fine_solve against a direct
+## eigen_solve on the same grid, for every potential of create_potential.
+## The time of the direct solve includes building the hamiltonian, the
+## coarse to fine solve builds one per level itself. Both results are
+## checked against each other.
+##
+## Usage: python benchmarks/coarse_to_fine.py [--N 500 1000] [--states 10]
+##                                            [--method shift-invert]
+##                                            [--output coarse_to_fine.json]
+#-----------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from linearalgebra import creategrid, eigen_solve
+from quantum import create_potential, create_kinetic, create_hamiltonian
+from multigrid import coarse_to_fine_solve
+
+# Grid half widths that hold the lowest states of each potential.
+CASES = {'O': 8.0, 'I': 1.0, 'G': 5.0, 'H': 10.0}
+
+#-----------------------------------------------------------------------
+## Function: run_point
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Solves one (potential, N) point both ways.
+##----------------------------------------------------------------------
+## Output:
+## result           dict with both times, the speedup and the largest
+##                  eigenvalue difference
+##----------------------------------------------------------------------
+def run_point(potential_inp, N, states, method):
+    L = CASES[potential_inp]
+
+    start = time.perf_counter()
+    grid = creategrid(L, N)
+    potential = create_potential(grid.x, grid.y, L, potential_inp)
+    hamiltonian = create_hamiltonian(potential, create_kinetic(grid), grid)
+    direct_stats = {}
+    direct, _ = eigen_solve(hamiltonian, states, method=method, stats=direct_stats)
+    direct_time = time.perf_counter() - start
+
+    c2f_stats = {}
+    c2f, _ = coarse_to_fine_solve(potential_inp, L, N, states, stats=c2f_stats)
+
+    return dict(potential=potential_inp, N=N, method=method, direct_time=direct_time,
+                direct_iterations=direct_stats['iterations'], c2f_time=c2f_stats['time'],
+                levels=c2f_stats['levels'], speedup=direct_time/c2f_stats['time'],
+                max_diff=float(np.max(np.abs(direct - c2f))))
+
+#-----------------------------------------------------------------------
+## Function: main
+#-----------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coarse to fine against direct solves.")
+    parser.add_argument('--N', type=int, nargs='+', default=[500], help="grid sizes")
+    parser.add_argument('--states', type=int, default=10, help="number of states")
+    parser.add_argument('--method', default='shift-invert', help="eigen_solve strategy of the direct solve")
+    parser.add_argument('--output', default=None, help="write all points to this JSON file")
+    args = parser.parse_args(argv)
+
+    points = []
+    print("{:>3} {:>5} {:>10} {:>10} {:>8} {:>9}".format('V', 'N', 'direct s', 'c2f s', 'speedup', 'max diff'))
+    for N in args.N:
+        for potential_inp in CASES:
+            point = run_point(potential_inp, N, args.states, args.method)
+            points.append(point)
+            print("{potential:>3} {N:>5} {direct_time:10.2f} {c2f_time:10.2f} {speedup:8.2f} {max_diff:9.1e}".format(**point))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(dict(states=args.states, points=points), f, indent=1)
+    return
+
+if __name__ == '__main__':
+    main()
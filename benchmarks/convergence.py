@@ -0,0 +1,125 @@
+#-----------------------------------------------------------------------
+#Program: convergence benchmark
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Compares the kinetic energy schemes of create_kinetic (2nd, 4th, 6th
+## and 8th order finite differences and the sine basis pseudo-spectral
+## operator) against the analytic energies of the harmonic oscillator and
+## the infinite square well. For every scheme N is increased along a
+## ladder until the lowest states reach the target relative accuracy, and
+## the N, solve time and peak memory needed to get there are reported.
+##
+## Usage: python benchmarks/convergence.py [--target 1e-6] [--states 6]
+##                                         [--output convergence.json]
+#-----------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from linearalgebra import creategrid, eigen_solve
+from quantum import create_potential, create_kinetic, create_hamiltonian
+
+SCHEMES = [2, 4, 6, 8, 'spectral']
+LADDER = [12, 16, 24, 32, 48, 64, 96, 128, 192, 256, 384]
+
+# Grid half widths. The oscillator states are negligible well before x = 8.
+CASES = {'O': 8.0, 'I': 1.0}
+
+#-----------------------------------------------------------------------
+## Function: analytic_energies
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Exact lowest energies (hbar = m = omega = 1).
+##----------------------------------------------------------------------
+## Input:
+## potential_inp    'O' or 'I'
+## L                half width of the box
+## states           number of energies
+##----------------------------------------------------------------------
+## Output:
+## energies         sorted exact energies
+##----------------------------------------------------------------------
+def analytic_energies(potential_inp, L, states):
+    n = np.arange(states + 1)
+    if potential_inp == 'O':
+        levels = n[:, None] + n[None, :] + 1.0
+    else:
+        # The walls are at -L and L, the grid only holds the interior points.
+        width = 2*L
+        m = n + 1
+        levels = np.pi**2/(2*width**2)*(m[:, None]**2 + m[None, :]**2)
+    return np.sort(levels, axis=None)[:states]
+
+#-----------------------------------------------------------------------
+## Function: run_point
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Solves one (potential, scheme, N) point and measures it. Tracing
+## allocations slows NumPy down a lot so the peak memory is only measured
+## when asked for, in a run of its own.
+##----------------------------------------------------------------------
+## Output:
+## result           dict with error, time and peak memory (or None)
+##----------------------------------------------------------------------
+def run_point(potential_inp, scheme, N, states, memory=False):
+    L = CASES[potential_inp]
+
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    grid = creategrid(L, N)
+    potential = create_potential(grid.x, grid.y, L, potential_inp)
+    hamiltonian = create_hamiltonian(potential, create_kinetic(grid, scheme), grid)
+    method = 'lobpcg' if scheme == 'spectral' else 'shift-invert'
+    e_values, _ = eigen_solve(hamiltonian, states, method=method)
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]/1024**2
+        tracemalloc.stop()
+
+    exact = analytic_energies(potential_inp, L, states)
+    error = float(np.max(np.abs(e_values - exact)/exact))
+    return dict(potential=potential_inp, scheme=str(scheme), N=N, error=error,
+                time=elapsed, peak_mb=peak, method=method)
+
+#-----------------------------------------------------------------------
+## Function: main
+#-----------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convergence of the kinetic energy schemes.")
+    parser.add_argument('--target', type=float, default=1e-6, help="target relative error")
+    parser.add_argument('--states', type=int, default=6, help="number of states compared")
+    parser.add_argument('--output', default=None, help="write all points to this JSON file")
+    args = parser.parse_args(argv)
+
+    points = []
+    print("{:>3} {:>9} {:>5} {:>10} {:>9} {:>9}".format('V', 'scheme', 'N', 'rel err', 'time s', 'peak MB'))
+    for potential_inp in CASES:
+        for scheme in SCHEMES:
+            for N in LADDER:
+                point = run_point(potential_inp, scheme, N, args.states)
+                points.append(point)
+                if point['error'] < args.target:
+                    break
+            point['peak_mb'] = run_point(potential_inp, scheme, N, args.states, memory=True)['peak_mb']
+            reached = "" if point['error'] < args.target else "  (target not reached)"
+            print("{potential:>3} {scheme:>9} {N:>5} {error:10.2e} {time:9.3f} {peak_mb:9.1f}".format(**point) + reached)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(dict(target=args.target, states=args.states, points=points), f, indent=1)
+    return
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#-----------------------------------------------------------------------
+#Program: mapped grid benchmark
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Accuracy per unknown of the hydrogen-like potential on uniform grids,
+## on sinh and tan mapped grids (mapping.py) and on the polar grid,
+## against the exact 2D hydrogen levels E = -1/(2 (n + 1/2)**2), n = 0, 1, ...
+## with degeneracy 2n + 1. No grid used here has a point at the origin
+## (even N), so the potential is the bare -1/r (softening 0) and the
+## comparison with the exact levels is fair.
+##
+## Usage: python benchmarks/mapped_grid.py [--N 50 100 200] [--Nr 100 400]
+##                                         [--L 20] [--states 6]
+##                                         [--output mapped_grid.json]
+#-----------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from linearalgebra import creategrid, eigen_solve
+from quantum import create_potential, create_kinetic, create_hamiltonian
+from multigrid import ground_shift
+from mapping import create_mapped_grid, create_mapped_hamiltonian, mapped_solve, polar_solve
+
+#-----------------------------------------------------------------------
+## Function: hydrogen_levels
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Exact lowest levels of the 2D hydrogen atom with their degeneracies.
+##----------------------------------------------------------------------
+## Input:
+## states           number of levels
+##----------------------------------------------------------------------
+## Output:
+## energies         sorted energies
+##----------------------------------------------------------------------
+def hydrogen_levels(states):
+    energies = []
+    n = 0
+    while len(energies) < states:
+        energies += [-1/(2*(n + 0.5)**2)]*(2*n + 1)
+        n += 1
+    return np.array(energies[:states])
+
+#-----------------------------------------------------------------------
+## Function: run_point
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Solves hydrogen on one kind of grid.
+##----------------------------------------------------------------------
+## Output:
+## point            dict with the grid, unknowns, time and errors
+##----------------------------------------------------------------------
+def run_point(kind, N, L, states):
+    start = time.perf_counter()
+    if kind == 'polar':
+        e_values = polar_solve('H', L, N, states, softening=0.0)[0]
+        unknowns = N
+    elif kind == 'uniform':
+        grid = creategrid(L, N)
+        potential = create_potential(grid.x, grid.y, L, 'H', softening=0.0)
+        hamiltonian = create_hamiltonian(potential, create_kinetic(grid), grid)
+        e_values, _ = eigen_solve(hamiltonian, states, method='shift-invert', sigma=ground_shift(hamiltonian))
+        unknowns = N**2
+    else:
+        grid = create_mapped_grid(L, N, kind)
+        potential = create_potential(grid.x, grid.y, L, 'H', softening=0.0)
+        hamiltonian, mass = create_mapped_hamiltonian(potential, grid)
+        e_values, _ = mapped_solve(hamiltonian, mass, states)
+        unknowns = N**2
+    errors = np.abs(e_values - hydrogen_levels(states))
+    return dict(grid=kind, N=N, unknowns=unknowns, time=time.perf_counter() - start,
+                ground_error=float(errors[0]), max_error=float(errors.max()), e_values=e_values.tolist())
+
+#-----------------------------------------------------------------------
+## Function: main
+#-----------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hydrogen on uniform, mapped and polar grids.")
+    parser.add_argument('--N', type=int, nargs='+', default=[50, 100, 200], help="points per axis (even)")
+    parser.add_argument('--Nr', type=int, nargs='+', default=[100, 400, 1600], help="radial points of the polar grid")
+    parser.add_argument('--L', type=float, default=20.0, help="half width of the box, radius of the disk")
+    parser.add_argument('--states', type=int, default=6, help="number of states")
+    parser.add_argument('--output', default=None, help="write all points to this JSON file")
+    args = parser.parse_args(argv)
+
+    runs = [(kind, N) for kind in ('uniform', 'sinh', 'tan') for N in args.N] + [('polar', Nr) for Nr in args.Nr]
+    points = []
+    print("{:<8} {:>5} {:>9} {:>9} {:>12} {:>10}".format('grid', 'N', 'unknowns', 'time s', 'ground err', 'max err'))
+    for kind, N in runs:
+        point = run_point(kind, N, args.L, args.states)
+        points.append(point)
+        print("{grid:<8} {N:>5} {unknowns:>9} {time:9.2f} {ground_error:12.2e} {max_error:10.2e}".format(**point))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(dict(L=args.L, states=args.states, points=points), f, indent=1)
+    return
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+#-----------------------------------------------------------------------
+#Program: pipeline benchmark
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Times and memory profiles every stage of the solve pipeline (creategrid,
+## create_potential, create_kinetic, create_hamiltonian, eigen_solve and
+## rendering) for all four potentials over a ladder of N and states, with
+## the same profiling.Profiler main.py and batch.py switch on. The 2D
+## solve is used for every potential, also the separable ones, so the
+## stages are the same everywhere. Rendering is done in this process so it
+## is timed on its own.
+##
+## The results go to a JSON file together with the library versions, and
+## --compare checks a new run against an older file stage by stage so
+## regressions between versions show up.
+##
+## Usage: python benchmarks/pipeline.py [--N 50 100 200] [--states 4 10]
+##                                      [--method shift-invert] [--no-render]
+##                                      [--output pipeline.json]
+##                                      [--compare old.json] [--threshold 1.2]
+#-----------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+
+import numpy as np
+import scipy
+import matplotlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from linearalgebra import creategrid, eigen_solve
+from quantum import create_potential, create_kinetic, create_hamiltonian
+from rendering import render_potential, render_densities
+from profiling import Profiler
+
+# Grid half widths that hold the lowest states of each potential.
+CASES = {'O': 8.0, 'I': 1.0, 'G': 5.0, 'H': 10.0}
+
+#-----------------------------------------------------------------------
+## Function: run_point
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Runs the whole pipeline once for one (potential, N, states) point.
+##----------------------------------------------------------------------
+## Input:
+## potential_inp    name of the potential
+## N                number of points on each axis
+## states           number of states
+## method           eigen_solve strategy
+## render_dir       directory the figures go to, or None to skip rendering
+##----------------------------------------------------------------------
+## Output:
+## point            dict with the point and the record of every stage
+##----------------------------------------------------------------------
+def run_point(potential_inp, N, states, method, render_dir=None):
+    L = CASES[potential_inp]
+    profiler = Profiler()
+
+    with profiler.stage('creategrid'):
+        grid = creategrid(L, N)
+    with profiler.stage('create_potential'):
+        potential = create_potential(grid.x, grid.y, L, potential_inp)
+    with profiler.stage('create_kinetic'):
+        kinetic = create_kinetic(grid)
+    with profiler.stage('create_hamiltonian'):
+        hamiltonian = create_hamiltonian(potential, kinetic, grid)
+    with profiler.stage('eigen_solve') as record:
+        stats = {}
+        e_values, e_vec = eigen_solve(hamiltonian, states, method=method, stats=stats)
+        record.update(iterations=stats['iterations'], matvecs=stats['matvecs'])
+    if render_dir is not None:
+        with profiler.stage('rendering'):
+            stem = os.path.join(render_dir, '{}_N{}_k{}'.format(potential_inp, N, states))
+            render_potential(stem + '_potential.png', potential, grid.x_pts, grid.y_pts)
+            render_densities(stem + '_densities.png', e_vec, grid.x_pts, grid.y_pts, states, N, e_values)
+
+    return dict(potential=potential_inp, N=N, states=states, method=method, total=profiler.total(),
+                stages=profiler.records)
+
+#-----------------------------------------------------------------------
+## Function: environment
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## What the numbers were measured with, stored next to them.
+##----------------------------------------------------------------------
+## Output:
+## env              dict of versions and machine details
+##----------------------------------------------------------------------
+def environment():
+    return dict(python=platform.python_version(), numpy=np.__version__, scipy=scipy.__version__,
+                matplotlib=matplotlib.__version__, machine=platform.machine(), system=platform.system(),
+                cpus=os.cpu_count())
+
+#-----------------------------------------------------------------------
+## Function: compare
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Compares the stage times of two runs. Stages faster than min_time in
+## the old run are skipped, they are mostly timer noise.
+##----------------------------------------------------------------------
+## Input:
+## old, new         lists of points from run_point
+## threshold        ratio new/old above which a stage counts as slower
+## min_time         shortest old stage time in s that is compared
+##----------------------------------------------------------------------
+## Output:
+## regressions      list of (potential, N, states, stage, old, new) that
+##                  got slower than the threshold
+##----------------------------------------------------------------------
+def compare(old, new, threshold=1.2, min_time=0.01):
+    def key(point):
+        return point['potential'], point['N'], point['states'], point['method']
+    old_points = {key(point): point for point in old}
+
+    regressions = []
+    print("\n{:>3} {:>5} {:>4} {:<20} {:>10} {:>10} {:>7}".format('V', 'N', 'k', 'stage', 'old s', 'new s', 'ratio'))
+    for point in new:
+        if key(point) not in old_points:
+            continue
+        old_stages = {record['stage']: record for record in old_points[key(point)]['stages']}
+        for record in point['stages']:
+            before = old_stages.get(record['stage'])
+            if before is None or before['time'] < min_time:
+                continue
+            ratio = record['time']/before['time']
+            flag = ' slower' if ratio > threshold else ''
+            print("{:>3} {:>5} {:>4} {:<20} {:10.4f} {:10.4f} {:7.2f}{}".format(
+                point['potential'], point['N'], point['states'], record['stage'], before['time'], record['time'],
+                ratio, flag))
+            if ratio > threshold:
+                regressions.append((point['potential'], point['N'], point['states'], record['stage'],
+                                    before['time'], record['time']))
+    return regressions
+
+#-----------------------------------------------------------------------
+## Function: main
+#-----------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per stage timings and memory of the solve pipeline.")
+    parser.add_argument('--N', type=int, nargs='+', default=[50, 100, 200], help="grid sizes")
+    parser.add_argument('--states', type=int, nargs='+', default=[4, 10], help="numbers of states")
+    parser.add_argument('--potentials', nargs='+', default=list(CASES), help="potentials to run")
+    parser.add_argument('--method', default='shift-invert', help="eigen_solve strategy")
+    parser.add_argument('--no-render', action='store_true', help="skip the rendering stage")
+    parser.add_argument('--output', default=None, help="write all points to this JSON file")
+    parser.add_argument('--compare', default=None, help="JSON file of an older run to compare against")
+    parser.add_argument('--threshold', type=float, default=1.2, help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    points = []
+    with tempfile.TemporaryDirectory() as render_dir:
+        print("{:>3} {:>5} {:>4} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+            'V', 'N', 'k', 'grid', 'V', 'T', 'H', 'solve', 'render', 'peak MB'))
+        for N in args.N:
+            for states in args.states:
+                for potential_inp in args.potentials:
+                    point = run_point(potential_inp, N, states, args.method,
+                                      None if args.no_render else render_dir)
+                    points.append(point)
+                    times = {record['stage']: record['time'] for record in point['stages']}
+                    peak = max((record['peak_rss_mb'] or 0) for record in point['stages'])
+                    print("{:>3} {:>5} {:>4} {:9.4f} {:9.4f} {:9.4f} {:9.4f} {:9.4f} {:>9} {:9.1f}".format(
+                        potential_inp, N, states, times['creategrid'], times['create_potential'],
+                        times['create_kinetic'], times['create_hamiltonian'], times['eigen_solve'],
+                        '-' if 'rendering' not in times else '{:.4f}'.format(times['rendering']), peak))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(dict(environment=environment(), method=args.method, points=points), f, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = compare(old['points'], points, args.threshold)
+        print("\n{} stages slower than {}x".format(len(regressions), args.threshold))
+        if regressions:
+            sys.exit(1)
+    return
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#-----------------------------------------------------------------------
+#Program: propagation benchmark
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Steps per second of every propagator in propagation.py over a ladder of
+## N, for a gaussian packet moving through a potential. The error of the
+## final state is measured against the Krylov propagator over the whole
+## time in one call, which is exact up to its tolerance, so the cheapest
+## propagator that is accurate enough can be picked for each grid size.
+##
+## Usage: python benchmarks/propagation.py [--N 63 127 255] [--steps 200]
+##                                         [--dt 0.005] [--potential O]
+##                                         [--output propagation.json]
+#-----------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from linearalgebra import creategrid
+from quantum import create_potential
+from propagation import PROPAGATORS, gaussian_packet, make_propagator, propagate
+
+# Grid half widths that hold a packet started off centre.
+CASES = {'O': 8.0, 'I': 1.0, 'G': 5.0, 'H': 10.0}
+
+#-----------------------------------------------------------------------
+## Function: run_point
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Propagates the same packet with every propagator on one grid.
+##----------------------------------------------------------------------
+## Output:
+## points           list of dicts with the setup time, steps per second
+##                  and error of each propagator
+##----------------------------------------------------------------------
+def run_point(potential_inp, N, steps, dt):
+    L = CASES[potential_inp]
+    grid = creategrid(L, N)
+    potential = create_potential(grid.x, grid.y, L, potential_inp)
+    psi0 = gaussian_packet(grid, x0=L/4, kx=2.0, sigma=L/10)
+
+    exact = make_propagator('krylov', potential, grid, dt).advance(psi0, steps)
+    points = []
+    for method in PROPAGATORS:
+        start = time.perf_counter()
+        propagator = make_propagator(method, potential, grid, dt)
+        setup = time.perf_counter() - start
+        stats = {}
+        # A stride of 1 makes the Krylov propagator take every step on its own too.
+        psi = propagate(propagator, psi0, steps, stride=1, stats=stats)
+        points.append(dict(potential=potential_inp, N=N, method=method, steps=steps, dt=dt, setup_time=setup,
+                           time=stats['time'], steps_per_second=stats['steps_per_second'],
+                           error=float(np.linalg.norm(psi - exact))))
+    return points
+
+#-----------------------------------------------------------------------
+## Function: main
+#-----------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput and accuracy of the propagators.")
+    parser.add_argument('--N', type=int, nargs='+', default=[63, 127, 255], help="grid sizes")
+    parser.add_argument('--steps', type=int, default=200, help="time steps per run")
+    parser.add_argument('--dt', type=float, default=0.005, help="time step")
+    parser.add_argument('--potential', default='O', help="potential the packet moves in")
+    parser.add_argument('--output', default=None, help="write all points to this JSON file")
+    args = parser.parse_args(argv)
+
+    points = []
+    print("{:>5} {:<16} {:>9} {:>12} {:>9}".format('N', 'propagator', 'setup s', 'steps/s', 'error'))
+    for N in args.N:
+        for point in run_point(args.potential, N, args.steps, args.dt):
+            points.append(point)
+            print("{N:>5} {method:<16} {setup_time:9.3f} {steps_per_second:12.1f} {error:9.1e}".format(**point))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(dict(points=points), f, indent=1)
+    return
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#-----------------------------------------------------------------------
+#Program: thread scaling benchmark
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Speedup of the threaded matvecs (parallel.py, linearalgebra) from 1 to
+## n threads on large grids, for:
+##   csr        the assembled hamiltonian of create_hamiltonian as a
+##              ThreadedMatrix
+##   stencil    the matrix free StencilOperator (2nd order stencil)
+##   stencil8   the same with the 8th order stencil
+##   spectral   the pseudo-spectral operator, the transforms get the
+##              threads as workers
+## each on a single vector and on a block of vectors (what LOBPCG
+## applies). --solve N also times a whole LOBPCG eigen_solve on an NxN
+## grid, smaller than the matvec grids since it takes hundreds of block
+## products. Its BLAS calls are limited to the same number of threads.
+## That limit needs threadpoolctl, without it BLAS keeps its own default.
+##
+## A matvec streams the matrix and vectors through memory, so the speedup
+## levels off once memory bandwidth is saturated, usually well before
+## every core is busy.
+##
+## Usage: python benchmarks/threads.py [--N 1000 2000] [--threads 1 2 4 8]
+##                                     [--block 8] [--repeat 5] [--solve 200]
+##                                     [--output threads.json]
+#-----------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import scipy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from linearalgebra import creategrid, eigen_solve, threaded_operator
+from quantum import create_potential, create_kinetic, create_hamiltonian, create_hamiltonian_operator
+from parallel import blas_info
+
+# Grid half width of the gaussian well every operator is built for.
+L = 5.0
+
+#-----------------------------------------------------------------------
+## Function: operators
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## The single thread operators that are timed, all for the same potential.
+##----------------------------------------------------------------------
+## Input:
+## N                number of points on each axis
+##----------------------------------------------------------------------
+## Output:
+## ops              dict of name to operator
+##----------------------------------------------------------------------
+def operators(N):
+    grid = creategrid(L, N)
+    potential = create_potential(grid.x, grid.y, L, 'G')
+    return {'csr': create_hamiltonian(potential, create_kinetic(grid), grid),
+            'stencil': create_hamiltonian_operator(potential, grid),
+            'stencil8': create_hamiltonian_operator(potential, grid, order=8),
+            'spectral': create_hamiltonian_operator(potential, grid, order='spectral')}
+
+#-----------------------------------------------------------------------
+## Function: time_matvec
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Best time of repeated products, the least disturbed by other load.
+##----------------------------------------------------------------------
+## Input:
+## op               operator
+## V                vector or block of vectors
+## repeat           number of timed products
+##----------------------------------------------------------------------
+## Output:
+## seconds          shortest time of one product
+##----------------------------------------------------------------------
+def time_matvec(op, V, repeat):
+    # The first product starts the thread pool, it is not timed.
+    op @ V
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        op @ V
+        best = min(best, time.perf_counter() - start)
+    return best
+
+#-----------------------------------------------------------------------
+## Function: run_point
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Times every operator with every thread count on one grid.
+##----------------------------------------------------------------------
+## Input:
+## N                number of points on each axis
+## thread_counts    list of thread counts, the first one is the reference
+## block            number of vectors in the block product
+## repeat           number of timed products
+##----------------------------------------------------------------------
+## Output:
+## points           list of dicts with the kernel, threads, time and
+##                  speedup over the first thread count
+##----------------------------------------------------------------------
+def run_point(N, thread_counts, block, repeat):
+    rng = np.random.default_rng(0)
+    v = rng.standard_normal(N**2)
+    V = rng.standard_normal((N**2, block))
+    points = []
+    for name, op in operators(N).items():
+        for shape, vectors in (('vector', v), ('block', V)):
+            reference = None
+            for threads in thread_counts:
+                seconds = time_matvec(threaded_operator(op, threads), vectors, repeat)
+                reference = reference or seconds
+                points.append(dict(N=N, kernel=name, shape=shape, threads=threads, time=seconds,
+                                   speedup=reference/seconds))
+    return points
+
+#-----------------------------------------------------------------------
+## Function: run_solve
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Times a LOBPCG solve of 6 states with every thread count.
+##----------------------------------------------------------------------
+## Input:
+## N                number of points on each axis
+## thread_counts    list of thread counts, the first one is the reference
+##----------------------------------------------------------------------
+## Output:
+## points           list of dicts like run_point, kernel 'lobpcg'
+##----------------------------------------------------------------------
+def run_solve(N, thread_counts):
+    hamiltonian = operators(N)['csr']
+    points = []
+    reference = None
+    for threads in thread_counts:
+        stats = {}
+        # eigen_solve limits the BLAS threads to the same number.
+        eigen_solve(hamiltonian, 6, method='lobpcg', stats=stats, threads=threads)
+        reference = reference or stats['time']
+        points.append(dict(N=N, kernel='lobpcg', shape='solve', threads=threads, time=stats['time'],
+                           speedup=reference/stats['time']))
+    return points
+
+#-----------------------------------------------------------------------
+## Function: main
+#-----------------------------------------------------------------------
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    ladder = [t for t in (1, 2, 4, 8, 16, 32, 64) if t <= cpus]
+    if ladder[-1] != cpus:
+        ladder.append(cpus)
+    parser = argparse.ArgumentParser(description="Thread scaling of the threaded matvecs.")
+    parser.add_argument('--N', type=int, nargs='+', default=[1000, 2000], help="grid sizes")
+    parser.add_argument('--threads', type=int, nargs='+', default=ladder, help="thread counts, first is the reference")
+    parser.add_argument('--block', type=int, default=8, help="vectors in the block product")
+    parser.add_argument('--repeat', type=int, default=5, help="timed products per point")
+    parser.add_argument('--solve', type=int, default=None, help="also time a LOBPCG solve on this grid size")
+    parser.add_argument('--output', default=None, help="write all points to this JSON file")
+    args = parser.parse_args(argv)
+
+    print("{} cores, BLAS: {}".format(cpus, blas_info() or 'threadpoolctl not installed'))
+    points = []
+    print("{:>5} {:<9} {:<7} {:>7} {:>10} {:>8}".format('N', 'kernel', 'shape', 'threads', 'time s', 'speedup'))
+    runs = [lambda N=N: run_point(N, args.threads, args.block, args.repeat) for N in args.N]
+    if args.solve is not None:
+        runs.append(lambda: run_solve(args.solve, args.threads))
+    for run in runs:
+        for point in run():
+            points.append(point)
+            print("{N:>5} {kernel:<9} {shape:<7} {threads:>7} {time:10.5f} {speedup:8.2f}".format(**point))
+
+    if args.output is not None:
+        environment = dict(python=platform.python_version(), numpy=np.__version__, scipy=scipy.__version__,
+                           machine=platform.machine(), cpus=cpus, blas=blas_info())
+        with open(args.output, 'w') as f:
+            json.dump(dict(environment=environment, points=points), f, indent=1)
+    return
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+#-----------------------------------------------------------------------
+#Module: cache
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## On-disk cache of solved eigenpairs. Entries are compressed .npz files
+## named by a hash of the problem parameters (potential, L, N, ...) so the
+## same problem is never solved twice. The number of states is not part of
+## the key: a request for fewer states than an entry holds is served from
+## that entry. When the cache grows past its size limit the least recently
+## used entries are deleted. Entries with close but not equal parameters
+## can still provide a starting vector for the solver.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## cache_key
+## load_cached
+## store_cached
+## evict
+## nearest_start
+## cached_solve
+##
+#-----------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# 2 GB by default, eigenvector blocks of big grids add up quickly.
+DEFAULT_MAX_BYTES = 2*1024**3
+
+# Part of every key. Bumped whenever the meaning of a stored result changes
+# (e.g. the switch from units of m*dx**2 to physical units, or N counting
+# only the interior points) so stale entries are never served.
+CACHE_VERSION = 3
+
+#-----------------------------------------------------------------------
+## Function: cache_key
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Content address of a problem.
+##----------------------------------------------------------------------
+## Input:
+## params           dict of the problem parameters, e.g. potential, L, N
+##----------------------------------------------------------------------
+## Output:
+## key              hex digest identifying the problem
+##----------------------------------------------------------------------
+def cache_key(params):
+    # sort_keys makes the key independent of the order the dict was built in.
+    text = json.dumps(dict(params, cache_version=CACHE_VERSION), sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+#-----------------------------------------------------------------------
+## Function: load_cached
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Looks a problem up in the cache.
+##----------------------------------------------------------------------
+## Input:
+## cache_dir        cache directory
+## params           dict of the problem parameters
+## states           number of e-values and e-vectors wanted
+##----------------------------------------------------------------------
+## Output:
+## e_values         lowest `states` eigenvalues, or None on a miss
+## e_vec            matching eigenvectors, or None on a miss
+##----------------------------------------------------------------------
+def load_cached(cache_dir, params, states):
+    path = os.path.join(cache_dir, cache_key(params) + '.npz')
+    if not os.path.exists(path):
+        return None, None
+
+    with np.load(path) as entry:
+        if len(entry['e_values']) < states:
+            return None, None
+        e_values = entry['e_values'][:states]
+        e_vec = entry['e_vec'][:, :states]
+
+    # The modification time doubles as the last access time for LRU eviction.
+    os.utime(path)
+    return e_values, e_vec
+
+#-----------------------------------------------------------------------
+## Function: store_cached
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Adds a solved problem to the cache and evicts old entries if the cache
+## is over its size limit. An existing entry is only replaced if the new
+## one holds more states.
+##----------------------------------------------------------------------
+## Input:
+## cache_dir        cache directory
+## params           dict of the problem parameters
+## e_values         eigenvalues
+## e_vec            eigenvectors, one per column
+## max_bytes        size limit of the whole cache
+##----------------------------------------------------------------------
+## Output:
+## N/A
+##----------------------------------------------------------------------
+def store_cached(cache_dir, params, e_values, e_vec, max_bytes=DEFAULT_MAX_BYTES):
+    os.makedirs(cache_dir, exist_ok=True)
+    key = cache_key(params)
+    path = os.path.join(cache_dir, key + '.npz')
+
+    if os.path.exists(path):
+        with np.load(path) as entry:
+            if len(entry['e_values']) >= len(e_values):
+                return
+
+    # Write to a temporary file first so a crash or a second process never
+    # leaves a half written entry behind.
+    tmp = os.path.join(cache_dir, '{}.{}.tmp.npz'.format(key, os.getpid()))
+    np.savez_compressed(tmp, e_values=e_values, e_vec=e_vec, params=json.dumps(params, sort_keys=True))
+    os.replace(tmp, path)
+
+    evict(cache_dir, max_bytes)
+    return
+
+#-----------------------------------------------------------------------
+## Function: evict
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Deletes the least recently used entries until the cache fits.
+##----------------------------------------------------------------------
+## Input:
+## cache_dir        cache directory
+## max_bytes        size limit of the whole cache
+##----------------------------------------------------------------------
+## Output:
+## N/A
+##----------------------------------------------------------------------
+def evict(cache_dir, max_bytes):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npz') and '.tmp' not in name:
+            stat = os.stat(os.path.join(cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            # Another process got there first.
+            pass
+        total -= size
+    return
+
+#-----------------------------------------------------------------------
+## Function: nearest_start
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Finds the cached entry closest to a problem that is not in the cache and
+## returns its eigenvectors as a starting block for the solver. Only
+## entries with the same value for every parameter except `vary` are
+## considered since the vectors have to live on the same grid.
+##----------------------------------------------------------------------
+## Input:
+## cache_dir        cache directory
+## params           dict of the problem parameters
+## vary             name of the numeric parameter allowed to differ
+##----------------------------------------------------------------------
+## Output:
+## v0               eigenvectors of the nearest entry, or None
+##----------------------------------------------------------------------
+def nearest_start(cache_dir, params, vary='L'):
+    if not os.path.isdir(cache_dir):
+        return None
+
+    fixed = {k: v for k, v in params.items() if k != vary}
+    best_path, best_distance = None, np.inf
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.npz') or '.tmp' in name:
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            with np.load(path) as entry:
+                other = json.loads(str(entry['params']))
+        except (OSError, ValueError, KeyError):
+            # Evicted or being replaced by another process.
+            continue
+        if {k: v for k, v in other.items() if k != vary} != fixed:
+            continue
+        distance = abs(other[vary] - params[vary])
+        if distance < best_distance:
+            best_path, best_distance = path, distance
+
+    if best_path is None:
+        return None
+    with np.load(best_path) as entry:
+        return entry['e_vec']
+
+#-----------------------------------------------------------------------
+## Function: cached_solve
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Puts the cache in front of a solver. On a hit the stored eigenpairs are
+## returned. On a miss the solver is called with the nearest cached
+## eigenvectors as a starting block and the result is stored.
+##----------------------------------------------------------------------
+## Input:
+## cache_dir        cache directory
+## params           dict of the problem parameters
+## states           number of e-values and e-vectors
+## solve            function taking v0 (or None) and returning
+##                  e_values, e_vec
+## max_bytes        size limit of the whole cache
+##----------------------------------------------------------------------
+## Output:
+## e_values         eigenvalues
+## e_vec            eigenvectors
+## hit              True if the result came from the cache
+##----------------------------------------------------------------------
+def cached_solve(cache_dir, params, states, solve, max_bytes=DEFAULT_MAX_BYTES):
+    e_values, e_vec = load_cached(cache_dir, params, states)
+    if e_values is not None:
+        return e_values, e_vec, True
+
+    e_values, e_vec = solve(nearest_start(cache_dir, params))
+    store_cached(cache_dir, params, e_values, e_vec, max_bytes)
+    return e_values, e_vec, False
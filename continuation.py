@@ -0,0 +1,149 @@
+#-----------------------------------------------------------------------
+#Module: continuation
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Warm started solves along a parameter sweep. Each step of the sweep
+## starts the eigensolver from the eigenvector subspace of the previous
+## step (interpolated onto the new grid if L or N changed) instead of a
+## random vector, and the states are relabelled by overlap with the
+## previous step so a label follows the same state through level
+## crossings.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## interpolate_evec
+## track_states
+## continuation_sweep
+##
+#-----------------------------------------------------------------------
+
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+from scipy.optimize import linear_sum_assignment
+from linearalgebra import creategrid, eigen_solve
+from quantum import create_potential, create_kinetic, create_hamiltonian
+
+#-----------------------------------------------------------------------
+## Function: interpolate_evec
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Moves a block of eigenvectors from one grid onto another with linear
+## interpolation. Points of the new grid outside the old box get 0, the
+## same as the wall of the box.
+##----------------------------------------------------------------------
+## Input:
+## e_vec            eigenvectors on the old grid, one per column
+## old_grid         Grid the eigenvectors live on
+## new_grid         Grid to move them onto
+##----------------------------------------------------------------------
+## Output:
+## new_vec          eigenvectors on the new grid, normalized
+##----------------------------------------------------------------------
+def interpolate_evec(e_vec, old_grid, new_grid):
+    k = e_vec.shape[1]
+    N_old = old_grid.N
+    psi = e_vec.reshape(N_old, N_old, k)
+
+    # Add the walls (where psi is 0) or, on a periodic grid, the point at L
+    # (the same as the one at -L) so new points between the outermost old
+    # point and the edge are interpolated instead of set to 0.
+    if old_grid.periodic:
+        pts = np.append(old_grid.x_pts, old_grid.L)
+        psi = np.pad(psi, ((0, 1), (0, 1), (0, 0)), mode='wrap')
+    else:
+        pts = np.concatenate([[-old_grid.L], old_grid.x_pts, [old_grid.L]])
+        psi = np.pad(psi, ((1, 1), (1, 1), (0, 0)))
+
+    # All k states are interpolated in one call by keeping them on the last axis.
+    interp = RegularGridInterpolator((pts, pts), psi, bounds_error=False, fill_value=0.0)
+    yy, xx = np.meshgrid(new_grid.y_pts, new_grid.x_pts, indexing='ij')
+    new_vec = interp(np.stack([yy.ravel(), xx.ravel()], axis=-1))
+
+    norms = np.linalg.norm(new_vec, axis=0)
+    norms[norms == 0] = 1
+    return new_vec/norms
+
+#-----------------------------------------------------------------------
+## Function: track_states
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Reorders the states of a new solve so that state n is the one with the
+## biggest overlap with state n of the previous step. Matching by overlap
+## instead of by energy keeps labels consistent when levels cross.
+##----------------------------------------------------------------------
+## Input:
+## prev_vec         eigenvectors of the previous step (on the new grid)
+## e_values         eigenvalues of the new step
+## e_vec            eigenvectors of the new step
+##----------------------------------------------------------------------
+## Output:
+## e_values         reordered eigenvalues
+## e_vec            reordered eigenvectors with the sign of each chosen to
+##                  have positive overlap with the previous step
+##----------------------------------------------------------------------
+def track_states(prev_vec, e_values, e_vec):
+    overlap = prev_vec.T @ e_vec
+    # Hungarian assignment maximizing the total |overlap|.
+    rows, cols = linear_sum_assignment(-np.abs(overlap))
+
+    # States that could not be matched (e.g. a new state entering the window)
+    # keep their energy order after the matched ones.
+    unmatched = [c for c in np.argsort(e_values) if c not in set(cols)]
+    order = np.concatenate([cols[np.argsort(rows)], unmatched]).astype(int)
+
+    signs = np.ones(len(order))
+    matched = len(rows)
+    signs[:matched] = np.sign(overlap[np.sort(rows), order[:matched]])
+    signs[signs == 0] = 1
+    return e_values[order], e_vec[:, order]*signs
+
+#-----------------------------------------------------------------------
+## Function: continuation_sweep
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Solves a sequence of problems, warm starting each one from the previous.
+## It is a generator so a sweep of hundreds of points never has to keep
+## more than two eigenvector blocks in memory.
+##----------------------------------------------------------------------
+## Input:
+## potential_inp    character representing which potential to use
+## steps            list of dicts with L, N and optionally bc for each point
+##                  of the sweep. Any other entry is a parameter of the
+##                  potential, e.g. width for the gaussian.
+## states           number of e-values and e-vectors
+## method           eigen_solve strategy, LOBPCG uses the whole subspace
+##                  as its starting block, ARPACK gets it summed into v0
+##----------------------------------------------------------------------
+## Output (yielded for every step):
+## step             the step dict
+## e_values         eigenvalues, ordered by tracked state label
+## e_vec            eigenvectors, ordered by tracked state label
+## stats            solver stats from eigen_solve
+##----------------------------------------------------------------------
+def continuation_sweep(potential_inp, steps, states, method='lobpcg'):
+    prev = None
+    for step in steps:
+        L, N = step['L'], step['N']
+        grid = creategrid(L, N, step.get('bc', 'dirichlet'))
+        params = {key: value for key, value in step.items() if key not in ('L', 'N', 'bc')}
+        potential = create_potential(grid.x, grid.y, L, potential_inp, **params)
+        hamiltonian = create_hamiltonian(potential, create_kinetic(grid), grid)
+
+        v0 = None
+        if prev is not None:
+            prev_grid, prev_vec = prev
+            if (prev_grid.L, prev_grid.N, prev_grid.bc) != (L, N, grid.bc):
+                prev_vec = interpolate_evec(prev_vec, prev_grid, grid)
+            v0 = prev_vec
+
+        stats = {}
+        e_values, e_vec = eigen_solve(hamiltonian, states, method=method, v0=v0, stats=stats)
+        if v0 is not None:
+            e_values, e_vec = track_states(v0, e_values, e_vec)
+
+        prev = (grid, e_vec)
+        yield step, e_values, e_vec, stats
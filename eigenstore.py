@@ -0,0 +1,284 @@
+#-----------------------------------------------------------------------
+#Module: eigenstore
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## On-disk format for big sets of eigenvectors. Each state is written to
+## disk as soon as it is available instead of being kept in one
+## N**2 x states block in RAM, and a reader opens a single state without
+## touching the others.
+##
+## Two layouts, picked by the path:
+##   <name>.h5 / .hdf5   one HDF5 file (needs h5py) with an 'e_vec'
+##                       dataset of shape (states, N, N) chunked one state
+##                       per chunk, 'e_values', and the metadata as
+##                       attributes.
+##   anything else       a directory holding e_vec.npy, a (states, N, N)
+##                       array read through a memory map, and meta.json
+##                       with the metadata and the eigenvalues.
+## State n is stored as the NxN array reshape_evec would give, row index y
+## and column index x. The metadata always has N, states and e_values plus
+## whatever the writer was given (potential, L, bc, ...).
+##----------------------------------------------------------------------
+##
+## Included functions:
+## is_hdf5
+## EigenWriter
+## EigenReader
+## save_eigenpairs
+## open_eigenpairs
+## stream_separable
+##
+#-----------------------------------------------------------------------
+
+import json
+import os
+
+import numpy as np
+from linearalgebra import separable_factors, separable_levels
+
+# HDF5 output is optional, the .npy layout needs nothing beyond NumPy.
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+#-----------------------------------------------------------------------
+## Function: is_hdf5
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Whether a path uses the HDF5 layout.
+##----------------------------------------------------------------------
+## Input:
+## path             store path
+##----------------------------------------------------------------------
+## Output:
+## hdf5             True for .h5 and .hdf5 files
+##----------------------------------------------------------------------
+def is_hdf5(path):
+    if os.path.splitext(path)[1] not in ('.h5', '.hdf5'):
+        return False
+    if h5py is None:
+        raise ValueError("Writing or reading {} needs h5py. Install it or use a directory path for the .npy layout.".format(path))
+    return True
+
+#-----------------------------------------------------------------------
+## Class: EigenWriter
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Writes states one at a time. Space for all of them is allocated on
+## disk up front, write() puts one state in its slot and only that state
+## is ever in memory. The eigenvalues and metadata are finalized on
+## close(). abort() removes a store that was not finished, which is what
+## leaving a with block on an exception does.
+##----------------------------------------------------------------------
+## Input:
+## path             store path, see the module header for the layouts
+## N                number of points on each axis
+## states           number of states that will be written
+## metadata         dict of JSON serializable problem parameters (optional)
+## dtype            float, or complex for absorbing boundaries
+##----------------------------------------------------------------------
+class EigenWriter:
+
+    def __init__(self, path, N, states, metadata=None, dtype=float):
+        self.path = path
+        self.N = N
+        self.states = states
+        self.metadata = dict(metadata or {}, N=N, states=states)
+        self.e_values = np.full(states, np.nan, dtype=dtype)
+        self.hdf5 = is_hdf5(path)
+
+        if self.hdf5:
+            self.file = h5py.File(path, 'w')
+            self.e_vec = self.file.create_dataset('e_vec', shape=(states, N, N), dtype=dtype, chunks=(1, N, N))
+        else:
+            os.makedirs(path, exist_ok=True)
+            # A meta.json left from an earlier store would make this one look finished.
+            if os.path.exists(os.path.join(path, 'meta.json')):
+                os.remove(os.path.join(path, 'meta.json'))
+            self.e_vec = np.lib.format.open_memmap(os.path.join(path, 'e_vec.npy'), mode='w+',
+                                                   dtype=dtype, shape=(states, N, N))
+
+    def write(self, n, e_value, vector):
+        # Same layout as reshape_evec.
+        self.e_vec[n] = np.asarray(vector).reshape(self.N, self.N)
+        self.e_values[n] = e_value
+
+    def close(self):
+        values = self.e_values
+        if self.hdf5:
+            self.file.create_dataset('e_values', data=values)
+            for key, value in self.metadata.items():
+                self.file.attrs[key] = json.dumps(value)
+            self.file.close()
+        else:
+            self.e_vec.flush()
+            del self.e_vec
+            meta = dict(self.metadata, e_values=values.real.tolist())
+            if np.iscomplexobj(values):
+                meta['e_values_imag'] = values.imag.tolist()
+            # Written last, a store without meta.json was never finished.
+            tmp = os.path.join(self.path, 'meta.json.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(meta, f, indent=1)
+            os.replace(tmp, os.path.join(self.path, 'meta.json'))
+        return
+
+    def abort(self):
+        # States that were never written hold NaN eigenvalues, nothing of the
+        # store is kept so it cannot be mistaken for a finished one.
+        if self.hdf5:
+            self.file.close()
+            os.remove(self.path)
+        else:
+            del self.e_vec
+            os.remove(os.path.join(self.path, 'e_vec.npy'))
+            if not os.listdir(self.path):
+                os.rmdir(self.path)
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
+
+#-----------------------------------------------------------------------
+## Class: EigenReader
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Lazy access to a store. Nothing but the metadata is read when it is
+## opened, state(n) reads one state from disk.
+##----------------------------------------------------------------------
+## Input:
+## path             store path
+##----------------------------------------------------------------------
+## Attributes:
+## metadata         dict of the problem parameters
+## e_values         eigenvalues
+## N                number of points on each axis
+##----------------------------------------------------------------------
+class EigenReader:
+
+    def __init__(self, path):
+        self.path = path
+        self.hdf5 = is_hdf5(path)
+
+        if self.hdf5:
+            self.file = h5py.File(path, 'r')
+            self.metadata = {key: json.loads(value) for key, value in self.file.attrs.items()}
+            self.e_values = self.file['e_values'][()]
+            self.e_vec = self.file['e_vec']
+        else:
+            with open(os.path.join(path, 'meta.json')) as f:
+                self.metadata = json.load(f)
+            self.e_values = np.array(self.metadata.pop('e_values'))
+            if 'e_values_imag' in self.metadata:
+                self.e_values = self.e_values + 1j*np.array(self.metadata.pop('e_values_imag'))
+            # mmap_mode='r' only maps the file, pages are read when a state is used.
+            self.e_vec = np.load(os.path.join(path, 'e_vec.npy'), mmap_mode='r')
+        self.N = self.metadata['N']
+
+    def __len__(self):
+        return len(self.e_values)
+
+    def state(self, n):
+        # The NxN array of reshape_evec. For the .npy layout this is a view
+        # into the memory map, use np.array() on it to get a copy in RAM.
+        return self.e_vec[n]
+
+    def vector(self, n):
+        # State n as a column of the e_vec block eigen_solve returns.
+        return np.asarray(self.state(n)).reshape(self.N**2)
+
+    def close(self):
+        if self.hdf5:
+            self.file.close()
+        self.e_vec = None
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+#-----------------------------------------------------------------------
+## Function: save_eigenpairs
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Writes the result of eigen_solve to a store, one column at a time.
+##----------------------------------------------------------------------
+## Input:
+## path             store path
+## e_values         eigenvalues
+## e_vec            eigenvectors, one per column
+## N                number of points on each axis
+## metadata         dict of problem parameters (optional)
+##----------------------------------------------------------------------
+## Output:
+## path             the store written
+##----------------------------------------------------------------------
+def save_eigenpairs(path, e_values, e_vec, N, metadata=None):
+    with EigenWriter(path, N, len(e_values), metadata, dtype=e_vec.dtype) as writer:
+        for n, e_value in enumerate(e_values):
+            writer.write(n, e_value, e_vec[:, n])
+    return path
+
+#-----------------------------------------------------------------------
+## Function: open_eigenpairs
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Opens a store for reading.
+##----------------------------------------------------------------------
+## Input:
+## path             store path
+##----------------------------------------------------------------------
+## Output:
+## reader           EigenReader
+##----------------------------------------------------------------------
+def open_eigenpairs(path):
+    return EigenReader(path)
+
+#-----------------------------------------------------------------------
+## Function: stream_separable
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Separable solve that never builds the N**2 x states block. Each 2D
+## state is the outer product of two 1D states, so it is formed and
+## written one state at a time. Memory stays at a few NxN arrays no
+## matter how many states are asked for.
+##----------------------------------------------------------------------
+## Input:
+## path             store path
+## vx, vy           potentials along the x and y axis
+## states           number of states
+## dx               grid spacing
+## order            stencil order 2, 4, 6, 8 or 'spectral'
+## periodic         wrap the laplacian around instead of stopping at walls
+## metadata         dict of problem parameters (optional)
+##----------------------------------------------------------------------
+## Output:
+## e_values         eigenvalues from smallest to largest
+##----------------------------------------------------------------------
+def stream_separable(path, vx, vy, states, dx=1.0, order=2, periodic=False, metadata=None):
+    N = len(vx)
+    ex, phi_x, ey, phi_y = separable_factors(vx, vy, states, dx, order, periodic)
+    e_values, iy, ix = separable_levels(ex, ey, states)
+
+    with EigenWriter(path, N, len(e_values), metadata) as writer:
+        for n, e_value in enumerate(e_values):
+            writer.write(n, e_value, np.outer(phi_y[:, iy[n]], phi_x[:, ix[n]]))
+    return e_values
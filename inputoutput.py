@@ -19,6 +19,8 @@
 #----------------------------------------------------------------------- 
 
 import matplotlib.pyplot as plt 
+from quantum import potential_names 
+from linearalgebra import grid_axes 
 
 def read_input(): 
     
@@ -67,19 +69,19 @@ def read_input():
 ##----------------------------------------------------------------------
 def check_input_pot():
     
-    # Options are the potentials or to stop the program. 
-    allowed_characters = {'O', 'I', 'G', 'H', 'S'}
+    # Options are the registered potentials or to stop the program. 
+    allowed_characters = set(potential_names()) | {'S'}
     
     pot_inp = input() 
 
     #If input is incorrect then just exit, otherwise return it. 
-    if pot_inp in allowed_characters and len(pot_inp) == 1:
+    if pot_inp in allowed_characters:
         if pot_inp == 'S': 
             SystemExit 
         else: 
             return pot_inp 
     else:
-        raise ValueError("Invalid input. Please enter exactly one character from the set {O, I, G, H or S}.") 
+        raise ValueError("Invalid input. Please enter one of {} or S.".format(", ".join(potential_names()))) 
         
 #-----------------------------------------------------------------------
 ## Function: check_input_pos_int
@@ -148,11 +150,14 @@ def check_inp_pos_real():
 ## v                 potential energy matrix 
 ## x                 array containing x coordinates 
 ## y                 array containing y coordinates 
+##                   (the open grid Grid.x, Grid.y or the 1D axes) 
 ##----------------------------------------------------------------------
 ## Output: 
 ## N/A    
 ##----------------------------------------------------------------------
 def plot_potential(v, x, y): 
+    # contourf needs the 1D axes or full NxN arrays, not the open grid. 
+    x, y = grid_axes(x, y) 
     plot0 = plt.figure(0,figsize=(8,6))
     plt.contourf(x,y,v,100)
     plt.colorbar()
@@ -173,6 +178,7 @@ def plot_potential(v, x, y):
 ## e_vec             eigenvectors of the Hamiltonian
 ## x                 array containing x coordinates
 ## y                 array containing y coordinates 
+##                   (the open grid Grid.x, Grid.y or the 1D axes) 
 ## states            user inputted number of excited states 
 ## N                 user inputted number of discretized steps 
 ##----------------------------------------------------------------------
@@ -180,6 +186,7 @@ def plot_potential(v, x, y):
 ## N/A    
 ##----------------------------------------------------------------------
 def plot_densities(e_vec, x, y, states, N): 
+    x, y = grid_axes(x, y) 
     # Loop to create a contour plot for each excited state 
     for n in range (0,states): 
         plot2 = plt.figure(2, figsize=(8,6)) 
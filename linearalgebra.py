@@ -8,38 +8,201 @@
 ##---------------------------------------------------------------------- 
 ##
 ## Included functions:
+## Grid 
 ## creategrid
+## grid_axes 
+## create_1d_lap 
 ## create_2d_lap 
+## apply_2d_lap 
+## stencil_rows 
+## spectral_symbol 
+## stencil_symbol 
+## apply_spectral_lap 
+## spectral_lap_1d 
+## spectral_lap_diagonal 
+## StencilOperator 
+## ThreadedMatrix 
+## threaded_operator 
 ## eigen_solve
+## separable_solve 
+## separable_factors 
+## separable_levels 
+## counted_operator 
+## spectrum_lower_bound 
+## spectrum_norm_bound 
 ##
 #----------------------------------------------------------------------- 
 
+import time 
+import warnings 
 import numpy as np 
 from scipy import sparse 
+from scipy.fft import dstn, fft, ifft, fftn, ifftn 
+from scipy.linalg import eigh, eigh_tridiagonal 
 from scipy.sparse.linalg import eigsh 
 from scipy.sparse.linalg import eigs
+from scipy.sparse.linalg import lobpcg 
+from scipy.sparse.linalg import splu, spilu 
+from scipy.sparse.linalg import LinearOperator, aslinearoperator 
+from parallel import blas_threads, default_threads, row_chunks, parallel_map 
+
+# Boundary conditions a Grid can have. 
+#   'dirichlet'  infinite walls at -L and L. The wavefunction is zero there so 
+#                the walls are not unknowns, only the N interior points are. 
+#   'periodic'   the grid wraps around, -L and L are the same point. 
+#   'absorbing'  Dirichlet walls plus a complex absorbing potential near them 
+#                (see quantum.absorbing_potential) so outgoing waves do not 
+#                reflect. The hamiltonian is then complex and not hermitian. 
+BOUNDARY_CONDITIONS = ('dirichlet', 'periodic', 'absorbing') 
+
+# LOBPCG residual tolerance relative to the norm of the hamiltonian, sqrt of the 
+# double precision machine epsilon, the most iterations it gets and how often 
+# it is restarted when it stops early. 
+LOBPCG_TOLERANCE = float(np.sqrt(np.finfo(float).eps)) 
+LOBPCG_MAXITER = 1000 
+LOBPCG_RESTARTS = 3 
+
+#-----------------------------------------------------------------------
+## Class: Grid
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Everything about the discretization in one place so the kinetic energy 
+## and the hamiltonian are built in physical units and results at 
+## different N can be compared. 
+##----------------------------------------------------------------------
+## Attributes: 
+## L                grid goes from -L to L on both axes 
+## N                number of unknowns on each axis 
+## bc               boundary condition, one of BOUNDARY_CONDITIONS 
+## periodic         True if the grid wraps around 
+## dx               grid spacing, same on both axes 
+## x_pts, y_pts     1D arrays of the points on each axis 
+## x, y             open grid of the coordinates, x is 1xN and y is Nx1. They 
+##                  broadcast to NxN in any expression, e.g. x**2 + y**2, so 
+##                  only 2N numbers are stored instead of two NxN arrays. 
+##----------------------------------------------------------------------
+class Grid: 
+
+    def __init__(self, L, N, bc='dirichlet'): 
+        if bc not in BOUNDARY_CONDITIONS: 
+            raise ValueError("Unknown boundary condition {}. Use one of {}.".format(bc, BOUNDARY_CONDITIONS)) 
+        self.L = L 
+        self.N = N 
+        self.bc = bc 
+        self.periodic = bc == 'periodic' 
+        if self.periodic: 
+            # N points cover the period, the point at L is the one at -L again. 
+            self.dx = 2*L/N 
+            pts = -L + self.dx*np.arange(N) 
+        else: 
+            # The walls at -L and L are left out, psi is known to be zero there. 
+            self.dx = 2*L/(N + 1) 
+            pts = np.linspace(-L, L, N + 2, dtype = float)[1:-1] 
+        self.x_pts = pts 
+        self.y_pts = pts.copy() 
+        # Same as np.meshgrid(x_pts, y_pts, sparse=True), views of the 1D points. 
+        self.x = self.x_pts[np.newaxis, :] 
+        self.y = self.y_pts[:, np.newaxis] 
+
+    def __repr__(self): 
+        return "Grid(L={}, N={}, bc={!r}, dx={})".format(self.L, self.N, self.bc, self.dx) 
 
 #-----------------------------------------------------------------------
 ## Function: creategrid
 #-----------------------------------------------------------------------
 ## By: Nathan Crawford
 ##
-## Creates kinetic energy operator matrix. Refer to README on how this is 
-## defined. 
+## Creates the 2D grid the problem is discretized on. 
 ##----------------------------------------------------------------------
 ## Input: 
 ## L                length and width of 2d grid. 
-## N                discretized points from -L to L. 
+## N                number of unknowns on each axis 
+## bc               boundary condition, 'dirichlet', 'periodic' or 'absorbing' 
+##----------------------------------------------------------------------
+## Output: 
+## grid             Grid with the spacing and the x and y coordinates 
+##----------------------------------------------------------------------
+def creategrid(L, N, bc='dirichlet'): 
+    grid = Grid(L, N, bc) 
+    return grid 
+
+#-----------------------------------------------------------------------
+## Function: grid_axes
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## 1D points along each axis from any form of the coordinates: 1D axes, 
+## an open grid (1xN and Nx1) or full NxN meshgrid arrays. 
+##----------------------------------------------------------------------
+## Input: 
+## x                x coordinates 
+## y                y coordinates 
+##----------------------------------------------------------------------
+## Output: 
+## x_pts, y_pts     1D arrays of the points on each axis 
+##----------------------------------------------------------------------
+def grid_axes(x, y): 
+    x = np.asarray(x) 
+    y = np.asarray(y) 
+    # x varies along the columns (rows are y), as in np.meshgrid. 
+    x_pts = x if x.ndim == 1 else x[0, :] 
+    y_pts = y if y.ndim == 1 else y[:, 0] 
+    return x_pts, y_pts 
+
+# Central difference coefficients of the second derivative for each order of 
+# accuracy, from the centre point outwards. Order 2 is the 3 point stencil in 
+# the README, 4, 6 and 8 are the 5, 7 and 9 point stencils. 
+STENCILS = { 
+    2: [-2, 1], 
+    4: [-5/2, 4/3, -1/12], 
+    6: [-49/18, 3/2, -3/20, 1/90], 
+    8: [-205/72, 8/5, -1/5, 8/315, -1/560], 
+} 
+
+#-----------------------------------------------------------------------
+## Function: create_1d_lap
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Creates the 1D second derivative matrix D. 
+##----------------------------------------------------------------------
+## Input: 
+## N                number of unknowns 
+## order            order of accuracy of the stencil, 2, 4, 6 or 8 
+## periodic         wrap the stencil around instead of stopping at walls 
 ##----------------------------------------------------------------------
 ## Output: 
-## x                array containing points on x axis
-## y                array containing points on y axis   
+## D                NxN sparse banded matrix 
 ##----------------------------------------------------------------------
-def creategrid(L, N): 
-    x_pts = np.linspace(-L, L, N, dtype = float) 
-    y_pts = np.linspace(-L, L, N, dtype = float) 
-    x, y = np.meshgrid(x_pts, y_pts) 
-    return x, y 
+def create_1d_lap(N, order=2, periodic=False): 
+    if order not in STENCILS: 
+        raise ValueError("Unknown stencil order {}. Use 2, 4, 6 or 8.".format(order)) 
+    coeffs = STENCILS[order] 
+
+    if periodic: 
+        # Every row is the full stencil with column indices taken modulo N. 
+        # Duplicates (on very small grids) are summed by the COO conversion. 
+        rows = np.repeat(np.arange(N), 2*len(coeffs) - 1) 
+        shifts = np.tile(np.arange(-len(coeffs) + 1, len(coeffs)), N) 
+        vals = np.tile([coeffs[abs(s)] for s in range(-len(coeffs) + 1, len(coeffs))], N) 
+        D = sparse.coo_matrix((vals, (rows, (rows + shifts) % N)), shape=(N, N)) 
+        return D.tocsr() 
+
+    # Band s (and -s) holds coefficient s of the stencil. 
+    offsets = [s for s in range(-len(coeffs) + 1, len(coeffs))] 
+    bands = [coeffs[abs(s)]*np.ones(N - abs(s)) for s in offsets] 
+    D = sparse.diags(bands, offsets, shape=(N, N), format='lil') 
+
+    # The wall is one step outside the grid. Stencils wider than 3 points reach 
+    # past it, and the wavefunction continues there as an odd reflection, so 
+    # the point m steps beyond the wall is minus the point m steps inside it. 
+    p = len(coeffs) - 1 
+    for i in range(min(p - 1, N)): 
+        for j in range(min(p - 1 - i, N)): 
+            D[i, j] -= coeffs[i + j + 2] 
+            D[N - 1 - i, N - 1 - j] -= coeffs[i + j + 2] 
+    return D.tocsr() 
 
 #-----------------------------------------------------------------------
 ## Function: create_2d_lap
@@ -49,44 +212,745 @@ def creategrid(L, N):
 ## Creates the 2D laplacian as defined in the README.  
 ##----------------------------------------------------------------------
 ## Input: 
-## N                discretized points from -L to L. 
+## N                number of unknowns on each axis 
+## order            order of accuracy of the stencil, 2, 4, 6 or 8 
+## periodic         wrap the stencil around instead of stopping at walls 
 ##----------------------------------------------------------------------
 ## Output: 
 ## lap              2D laplacian  
 ##----------------------------------------------------------------------
-def create_2d_lap(N): 
-    # Use an array of ones to create the diagonals of D. 
-    one = np.ones([N])
-    diags = np.array([one, -2*one, one]) 
-    # spdiags conveniently lets us create a sparse matrix and lets us place the diagonals. 
-    D = sparse.spdiags(diags, np.array([-1,0,1]), N, N) 
+def create_2d_lap(N, order=2, periodic=False): 
+    D = create_1d_lap(N, order, periodic) 
 
     # This sum creates an N**2 x N**2 matrix. Even for simple systems this is computationally 
     # expensive to solve.
     lap = sparse.kronsum(D,D)
     return lap  
 
+#-----------------------------------------------------------------------
+## Function: apply_2d_lap
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Applies the same laplacian as create_2d_lap directly to the 
+## wavefunction on the NxN grid without building any matrix. 
+##----------------------------------------------------------------------
+## Input: 
+## psi              array of shape (N, N) or (N, N, k) for a block of k 
+##                  wavefunctions 
+## order            order of accuracy of the stencil, 2, 4, 6 or 8 
+## periodic         wrap the stencil around instead of stopping at walls 
+##----------------------------------------------------------------------
+## Output: 
+## lap_psi          laplacian of psi with the same shape as psi 
+##----------------------------------------------------------------------
+def apply_2d_lap(psi, order=2, periodic=False): 
+    coeffs = STENCILS[order] 
+    lap_psi = 2*coeffs[0]*psi 
+
+    if periodic: 
+        for s, c in enumerate(coeffs[1:], start=1): 
+            for axis in (0, 1): 
+                lap_psi += c*np.roll(psi, s, axis=axis) 
+                lap_psi += c*np.roll(psi, -s, axis=axis) 
+        return lap_psi 
+
+    # Each neighbour is just a shifted slice. The point right outside the grid 
+    # is the wall where psi is zero, and further out psi is the odd reflection 
+    # of the inside, same as create_1d_lap. 
+    for s, c in enumerate(coeffs[1:], start=1): 
+        lap_psi[s:, :] += c*psi[:-s, :] 
+        lap_psi[:-s, :] += c*psi[s:, :] 
+        lap_psi[:, s:] += c*psi[:, :-s] 
+        lap_psi[:, :-s] += c*psi[:, s:] 
+        if s > 1: 
+            lap_psi[:s - 1, :] -= c*psi[s - 2::-1, :] 
+            lap_psi[-(s - 1):, :] -= c*psi[:-s:-1, :] 
+            lap_psi[:, :s - 1] -= c*psi[:, s - 2::-1] 
+            lap_psi[:, -(s - 1):] -= c*psi[:, :-s:-1] 
+    return lap_psi 
+
+#-----------------------------------------------------------------------
+## Function: stencil_rows
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Rows start to stop of apply_2d_lap(psi), computed from those rows and 
+## the order/2 rows around them only, so blocks of rows can be done in 
+## separate threads. apply_2d_lap treats the cut edges of the block as 
+## walls, but that only changes the halo rows, which are dropped. 
+##----------------------------------------------------------------------
+## Input: 
+## psi              array of shape (N, N) or (N, N, k) 
+## start, stop      rows (y index) of the laplacian wanted 
+## order            order of accuracy of the stencil, 2, 4, 6 or 8 
+## periodic         wrap the stencil around instead of stopping at walls 
+##----------------------------------------------------------------------
+## Output: 
+## lap_rows         rows start to stop of the laplacian of psi 
+##----------------------------------------------------------------------
+def stencil_rows(psi, start, stop, order=2, periodic=False): 
+    halo = len(STENCILS[order]) - 1 
+    N = psi.shape[0] 
+    if periodic: 
+        # The halo wraps around, a copy of the block and its halo rows. 
+        block = np.take(psi, np.arange(start - halo, stop + halo) % N, axis=0) 
+        first = halo 
+    else: 
+        # At a wall the block ends where the grid does and the wall is handled as usual. 
+        low = max(start - halo, 0) 
+        block = psi[low:min(stop + halo, N)] 
+        first = start - low 
+    return apply_2d_lap(block, order, periodic)[first:first + stop - start] 
+
+#-----------------------------------------------------------------------
+## Function: spectral_symbol
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Eigenvalues of the 1D pseudo-spectral second derivative (grid units) in 
+## the order the transform returns its modes. With walls these are the 
+## sine modes sin(pi*m*(j+1)/(N+1)), with a periodic grid the plane waves. 
+##----------------------------------------------------------------------
+## Input: 
+## N                number of unknowns 
+## periodic         plane waves instead of sine modes 
+##----------------------------------------------------------------------
+## Output: 
+## lam              N eigenvalues 
+##----------------------------------------------------------------------
+def spectral_symbol(N, periodic=False): 
+    if periodic: 
+        return -(2*np.pi*np.fft.fftfreq(N))**2 
+    return -(np.pi*np.arange(1, N + 1)/(N + 1))**2 
+
+#-----------------------------------------------------------------------
+## Function: stencil_symbol
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Eigenvalues of the 1D second derivative of create_1d_lap (grid units) in 
+## the same mode order as spectral_symbol, c0 + 2*sum_s c_s*cos(s*theta). 
+## The plane waves diagonalize every periodic stencil, and since the wider 
+## stencils continue the wavefunction past a wall as an odd reflection the 
+## sine modes diagonalize every stencil with walls too. 
+##----------------------------------------------------------------------
+## Input: 
+## N                number of unknowns 
+## order            2, 4, 6, 8 or 'spectral' 
+## periodic         plane waves instead of sine modes 
+##----------------------------------------------------------------------
+## Output: 
+## lam              N eigenvalues 
+##----------------------------------------------------------------------
+def stencil_symbol(N, order=2, periodic=False): 
+    if order == 'spectral': 
+        return spectral_symbol(N, periodic) 
+    if periodic: 
+        theta = 2*np.pi*np.fft.fftfreq(N) 
+    else: 
+        theta = np.pi*np.arange(1, N + 1)/(N + 1) 
+    coeffs = STENCILS[order] 
+    lam = np.full(N, float(coeffs[0])) 
+    for s, c in enumerate(coeffs[1:], start=1): 
+        lam += 2*c*np.cos(s*theta) 
+    return lam 
+
+#-----------------------------------------------------------------------
+## Function: apply_spectral_lap
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Pseudo-spectral laplacian. With walls the wavefunction is zero at -L and 
+## L, one step outside the grid, so a type 1 DST (sine basis) diagonalizes 
+## the laplacian exactly. A periodic grid uses the FFT instead. 
+##----------------------------------------------------------------------
+## Input: 
+## psi              array of shape (N, N) or (N, N, k) 
+## periodic         use the FFT (plane waves) instead of the DST 
+## workers          number of threads of the transforms (optional) 
+##----------------------------------------------------------------------
+## Output: 
+## lap_psi          laplacian of psi with the same shape as psi 
+##----------------------------------------------------------------------
+def apply_spectral_lap(psi, periodic=False, workers=None): 
+    lam = spectral_symbol(psi.shape[0], periodic) 
+    # Second derivative of mode m in x and n in y is lam_m + lam_n. 
+    symbol = lam[:, None] + lam[None, :] 
+    if psi.ndim == 3: 
+        symbol = symbol[:, :, None] 
+
+    if periodic: 
+        lap_psi = ifftn(fftn(psi, axes=(0, 1), workers=workers)*symbol, axes=(0, 1), workers=workers) 
+        return lap_psi if np.iscomplexobj(psi) else lap_psi.real 
+
+    # With norm='ortho' the type 1 DST is its own inverse. 
+    coeffs = dstn(psi, type=1, axes=(0, 1), norm='ortho', workers=workers) 
+    coeffs *= symbol 
+    return dstn(coeffs, type=1, axes=(0, 1), norm='ortho', workers=workers) 
+
+#-----------------------------------------------------------------------
+## Function: spectral_lap_1d
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Dense 1D pseudo-spectral second derivative matrix, for the separable 
+## solver where N is small enough to build it. 
+##----------------------------------------------------------------------
+## Input: 
+## N                number of unknowns 
+## periodic         plane waves instead of sine modes 
+##----------------------------------------------------------------------
+## Output: 
+## D                dense NxN matrix 
+##----------------------------------------------------------------------
+def spectral_lap_1d(N, periodic=False): 
+    lam = spectral_symbol(N, periodic) 
+    eye = np.identity(N) 
+    if periodic: 
+        return ifft(lam[:, None]*fft(eye, axis=0), axis=0).real 
+    return dstn(lam[:, None]*dstn(eye, type=1, axes=(0,), norm='ortho'), type=1, axes=(0,), norm='ortho') 
+
+#-----------------------------------------------------------------------
+## Function: spectral_lap_diagonal
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Diagonal of the 1D pseudo-spectral second derivative matrix. Needed for 
+## preconditioners since the matrix itself is dense and never built. 
+##----------------------------------------------------------------------
+## Input: 
+## N                number of unknowns 
+## periodic         plane waves instead of sine modes 
+##----------------------------------------------------------------------
+## Output: 
+## diag             N diagonal entries 
+##----------------------------------------------------------------------
+def spectral_lap_diagonal(N, periodic=False): 
+    if periodic: 
+        # A circulant matrix has the mean of its eigenvalues on the diagonal. 
+        return np.full(N, spectral_symbol(N, True).mean()) 
+    lam = np.zeros(N + 1) 
+    lam[1:] = spectral_symbol(N) 
+    # diag_j = sum_m (2/(N+1)) sin(theta_jm)**2 lam_m and 2 sin**2 = 1 - cos(2 theta), 
+    # the cosine sum is the real part of an FFT of the eigenvalues. 
+    cos_sum = np.fft.fft(lam).real 
+    return (lam.sum() - cos_sum[1:])/(N + 1) 
+
+#-----------------------------------------------------------------------
+## Class: StencilOperator
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Matrix free version of scale * lap + diag(diagonal). Only the diagonal 
+## (N**2 numbers) is stored, the laplacian is applied on the fly with 
+## apply_2d_lap (or apply_spectral_lap) so peak memory is a few N**2 vectors. 
+## A complex diagonal (absorbing boundaries) gives a complex operator. 
+## With threads > 1 the rows of the grid are split into one block per 
+## thread (stencil_rows) and the blocks are applied in a thread pool, the 
+## spectral transforms use that many workers. 
+##----------------------------------------------------------------------
+## Input: 
+## N                number of unknowns on each axis 
+## diagonal         NxN array added on the diagonal (the potential) 
+## scale            factor in front of the laplacian 
+## order            stencil order 2, 4, 6, 8 or 'spectral' 
+## periodic         wrap the laplacian around instead of stopping at walls 
+## threads          number of threads of a matvec 
+##----------------------------------------------------------------------
+class StencilOperator(LinearOperator): 
+
+    def __init__(self, N, diagonal, scale, order=2, periodic=False, threads=1): 
+        if order != 'spectral' and order not in STENCILS: 
+            raise ValueError("Unknown stencil order {}. Use 2, 4, 6, 8 or 'spectral'.".format(order)) 
+        self.N = N 
+        diagonal = np.asarray(diagonal) 
+        dtype = np.result_type(diagonal.dtype, float) 
+        self.potential = diagonal.astype(dtype, copy=False).reshape(N, N) 
+        self.scale = scale 
+        self.order = order 
+        self.periodic = periodic 
+        self.threads = threads 
+        super().__init__(dtype=dtype, shape=(N**2, N**2)) 
+
+    def _lap(self, psi): 
+        if self.order == 'spectral': 
+            return apply_spectral_lap(psi, self.periodic, workers=self.threads) 
+        return apply_2d_lap(psi, self.order, self.periodic) 
+
+    def _apply(self, psi): 
+        potential = self.potential if psi.ndim == 2 else self.potential[:, :, None] 
+        if self.threads == 1 or self.order == 'spectral': 
+            # Not in place, a real psi times a complex potential gives a complex result. 
+            return self.scale*self._lap(psi) + potential*psi 
+        out = np.empty(psi.shape, dtype=np.result_type(psi, potential)) 
+        def rows(bounds): 
+            start, stop = bounds 
+            out[start:stop] = (self.scale*stencil_rows(psi, start, stop, self.order, self.periodic) 
+                               + potential[start:stop]*psi[start:stop]) 
+        parallel_map(rows, row_chunks(self.N, self.threads), self.threads) 
+        return out 
+
+    def _matvec(self, v): 
+        return self._apply(v.reshape(self.N, self.N)).reshape(v.shape) 
+
+    def _matmat(self, V): 
+        k = V.shape[1] 
+        return self._apply(V.reshape(self.N, self.N, k)).reshape(self.N**2, k) 
+
+    def _adjoint(self): 
+        # The laplacian is real symmetric, so only the diagonal gets conjugated. 
+        if np.iscomplexobj(self.potential): 
+            return StencilOperator(self.N, self.potential.conj(), self.scale, self.order, self.periodic, self.threads) 
+        return self 
+
+    def diagonal(self): 
+        if self.order == 'spectral': 
+            d = spectral_lap_diagonal(self.N, self.periodic) 
+        else: 
+            d = create_1d_lap(self.N, self.order, self.periodic).diagonal() 
+        lap_diag = d[:, None] + d[None, :] 
+        return (self.potential + self.scale*lap_diag).ravel() 
+
+    def lower_bound(self): 
+        # For a complex diagonal this bounds the real part of the eigenvalues. 
+        v_min = float(np.min(self.potential.real)) 
+        if self.order == 'spectral': 
+            # The pseudo-spectral laplacian is negative semi-definite with eigenvalues 
+            # above -2*pi**2, so with a negative scale the kinetic part only raises the energy. 
+            return v_min - max(self.scale, 0)*2*np.pi**2 
+        # Gershgorin: the off diagonal stencil entries in both directions, plus 
+        # at most one more sum of |c| per direction for the reflected points. 
+        coeffs = STENCILS[self.order] 
+        radius = 6*abs(self.scale)*sum(abs(c) for c in coeffs[1:]) 
+        if self.order == 2 or self.periodic: 
+            radius = 4*abs(self.scale)*sum(abs(c) for c in coeffs[1:]) 
+        return v_min + 2*self.scale*coeffs[0] - radius 
+
+    def norm_bound(self): 
+        v_max = float(np.max(np.abs(self.potential))) 
+        if self.order == 'spectral': 
+            return v_max + abs(self.scale)*2*np.pi**2 
+        # Row sums of |stencil| in both directions, reflected points included. 
+        coeffs = STENCILS[self.order] 
+        return v_max + 2*abs(self.scale)*(abs(coeffs[0]) + 3*sum(abs(c) for c in coeffs[1:])) 
+
+#-----------------------------------------------------------------------
+## Class: ThreadedMatrix
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## A sparse matrix applied by blocks of rows in a thread pool. The blocks 
+## are CSR matrices that share the data and column indices of the matrix, 
+## only the row pointers are copied, so no memory is added. SciPy's CSR 
+## product releases the GIL and the blocks run on separate cores. 
+##----------------------------------------------------------------------
+## Input: 
+## matrix           sparse matrix, converted to CSR if it is not 
+## threads          number of threads (and blocks) 
+##----------------------------------------------------------------------
+class ThreadedMatrix(LinearOperator): 
+
+    def __init__(self, matrix, threads): 
+        matrix = sparse.csr_matrix(matrix) 
+        self.matrix = matrix 
+        self.threads = threads 
+        self.blocks = [] 
+        for start, stop in row_chunks(matrix.shape[0], threads): 
+            low, high = matrix.indptr[start], matrix.indptr[stop] 
+            block = sparse.csr_matrix((matrix.data[low:high], matrix.indices[low:high], 
+                                       matrix.indptr[start:stop + 1] - low), shape=(stop - start, matrix.shape[1])) 
+            self.blocks.append((start, stop, block)) 
+        super().__init__(dtype=matrix.dtype, shape=matrix.shape) 
+
+    def _apply(self, V): 
+        out = np.empty((self.shape[0],) + V.shape[1:], dtype=np.result_type(self.dtype, V.dtype)) 
+        def rows(block): 
+            start, stop, B = block 
+            out[start:stop] = B @ V 
+        parallel_map(rows, self.blocks, self.threads) 
+        return out 
+
+    def _matvec(self, v): 
+        return self._apply(v.ravel()).reshape(v.shape) 
+
+    def _matmat(self, V): 
+        return self._apply(V) 
+
+    def _adjoint(self): 
+        return ThreadedMatrix(self.matrix.conj().T, self.threads) 
+
+#-----------------------------------------------------------------------
+## Function: threaded_operator
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Version of a hamiltonian whose matvecs run in a number of threads. 
+##----------------------------------------------------------------------
+## Input: 
+## hamiltonian      sparse matrix, StencilOperator or LinearOperator 
+## threads          number of threads, None or 1 for a single thread 
+##----------------------------------------------------------------------
+## Output: 
+## op               ThreadedMatrix for a sparse matrix, a StencilOperator 
+##                  with that many threads, anything else unchanged 
+##----------------------------------------------------------------------
+def threaded_operator(hamiltonian, threads): 
+    if threads is None or threads <= 1: 
+        return hamiltonian 
+    if isinstance(hamiltonian, StencilOperator): 
+        return StencilOperator(hamiltonian.N, hamiltonian.potential, hamiltonian.scale, hamiltonian.order, 
+                               hamiltonian.periodic, threads) 
+    if sparse.issparse(hamiltonian): 
+        return ThreadedMatrix(hamiltonian, threads) 
+    return hamiltonian 
+
 #-----------------------------------------------------------------------
 ## Function: eigen_solve
 #-----------------------------------------------------------------------
 ## By: Nathan Crawford
 ##
-## Finds eigenvalues and eigenvectors of a matrix.   
+## Finds eigenvalues and eigenvectors of a matrix. Three strategies are 
+## available: 
+##   'arpack'        plain ARPACK with which='SA', the smallest algebraic 
+##                   eigenvalues
+##   'shift-invert'  ARPACK in shift-invert mode around sigma using a 
+##                   sparse LU factorization of (H - sigma*I) 
+##   'lobpcg'        LOBPCG with an incomplete LU preconditioner 
+## If sigma is not given the Gershgorin lower bound of the spectrum is used 
+## so the states closest to sigma are the lowest ones. 
+## A complex hamiltonian (absorbing boundaries) is not hermitian, ARPACK's 
+## general eigs is used instead and the states are the ones with the 
+## smallest real part. LOBPCG only works for hermitian problems. 
 ##----------------------------------------------------------------------
 ## Input: 
 ## hamiltonian      matrix to find e-values and e-vectors for
 ## states           number of e-values and e-vectors
+## method           solver strategy, 'arpack', 'shift-invert' or 'lobpcg' 
+## sigma            target energy for shift-invert (optional) 
+## v0               starting vector for the iteration, or a block of 
+##                  starting vectors (one per column) (optional) 
+## stats            dict that gets filled with method, iterations, 
+##                  matvecs and time, for LOBPCG also converged and the 
+##                  largest final residual. ARPACK raises if it does not 
+##                  converge (optional) 
+## preconditioner   LinearOperator approximating the inverse of H for 
+##                  LOBPCG, replaces the default ILU/Jacobi (optional) 
+## vectors          False skips the eigenvectors. ARPACK then never forms 
+##                  the N**2 x states block of Ritz vectors, LOBPCG needs its 
+##                  block to iterate and only drops it at the end 
+## threads          number of threads of the matvecs (threaded_operator) and 
+##                  of the BLAS/LAPACK calls (blas_threads). Defaults to 
+##                  SCHRODINGER_THREADS, if neither is set nothing changes. 
+##                  The LU solves of shift-invert and of the ILU 
+##                  preconditioner stay on one thread 
 ##----------------------------------------------------------------------
 ## Output: 
-## e_vec            eigenvectors 
-## e_values         eigenvalues   
+## e_values         eigenvalues from smallest to largest (real part) 
+## e_vec            eigenvectors, one per column, None if vectors is False 
 ##----------------------------------------------------------------------
-def eigen_solve(hamiltonian, states): 
+def eigen_solve(hamiltonian, states, method='arpack', sigma=None, v0=None, stats=None, preconditioner=None, 
+                vectors=True, threads=None): 
+
+    # Everything is timed and every application of the operator (or of its inverse 
+    # for shift-invert) is counted so different strategies can be compared. 
+    counts = {'matvecs': 0, 'iterations': 0}
+    start = time.perf_counter() 
+
+    # ARPACK only takes one starting vector so a block is summed into one that 
+    # has weight in every direction of the block. 
+    if v0 is not None and method != 'lobpcg' and np.ndim(v0) == 2: 
+        v0 = np.asarray(v0).sum(axis=1) 
+
+    hermitian = not np.issubdtype(hamiltonian.dtype, np.complexfloating) 
+    if not hermitian and method == 'lobpcg': 
+        raise ValueError("LOBPCG needs a hermitian hamiltonian. Use 'arpack' or 'shift-invert' for absorbing boundaries.") 
+
+    # eigsh and eigs hand back only the eigenvalues when the vectors are not wanted. 
+    def unpack(result): 
+        return result if vectors else (result, None) 
+
+    # Only the matvecs are threaded, factorizations and preconditioners use the original matrix. 
+    if threads is None: 
+        threads = default_threads() 
+    matrix = threaded_operator(hamiltonian, threads) 
 
-    # eigsh is the e-vector/e-value solver from ARPACK which is a linear algebra 
-    # package written in FORTRAN77. It returns k eigenvectors and k eigenvalues. 
-    # 'which' is a string input. SM means smallest because I want them from smallest to largest. 
-    # Note this is likely to create degenerate eigenvalues. 
-    
-    e_vec, e_values = eigsh(hamiltonian, k= states , which='SM')
-    return e_vec, e_values 
\ No newline at end of file
+    with blas_threads(threads): 
+        if method == 'arpack': 
+            # eigsh is the e-vector/e-value solver from ARPACK which is a linear algebra 
+            # package written in FORTRAN77. It returns k eigenvectors and k eigenvalues. 
+            # 'which' is a string input. SA means smallest algebraic, the lowest states. SM would be the 
+            # smallest magnitude, the ones closest to zero, which are not the lowest for a bound potential. 
+            # Note this is likely to create degenerate eigenvalues. 
+            op = counted_operator(matrix, counts) 
+            if hermitian: 
+                e_values, e_vec = unpack(eigsh(op, k=states, which='SA', v0=v0, return_eigenvectors=vectors)) 
+            else: 
+                e_values, e_vec = unpack(eigs(op, k=states, which='SR', v0=v0, return_eigenvectors=vectors)) 
+            # ARPACK does one matvec per Lanczos step so this is the iteration count. 
+            counts['iterations'] = counts['matvecs'] 
+
+        elif method == 'shift-invert': 
+            if not sparse.issparse(hamiltonian): 
+                raise ValueError("Shift-invert needs an assembled sparse Hamiltonian to factorize.") 
+            if sigma is None: 
+                sigma = spectrum_lower_bound(hamiltonian) 
+            # Factorize once, then every ARPACK iteration is just a pair of triangular solves. 
+            shifted = sparse.csc_matrix(hamiltonian - sigma*sparse.identity(hamiltonian.shape[0])) 
+            lu = splu(shifted) 
+            # ARPACK only ever applies the inverse here, so each solve counts as the 
+            # operator application it replaces as well as an iteration. 
+            def solve(b): 
+                counts['iterations'] += 1 
+                counts['matvecs'] += 1 
+                return lu.solve(b) 
+            OPinv = LinearOperator(hamiltonian.shape, matvec=solve, dtype=hamiltonian.dtype) 
+            op = counted_operator(matrix, counts) 
+            if hermitian: 
+                e_values, e_vec = unpack(eigsh(op, k=states, sigma=sigma, which='LM', OPinv=OPinv, v0=v0, 
+                                              return_eigenvectors=vectors)) 
+            else: 
+                e_values, e_vec = unpack(eigs(op, k=states, sigma=sigma, which='LM', OPinv=OPinv, v0=v0, 
+                                             return_eigenvectors=vectors)) 
+
+        elif method == 'lobpcg': 
+            n = hamiltonian.shape[0] 
+            if v0 is None: 
+                X = np.random.default_rng(0).standard_normal((n, states)) 
+            else: 
+                X = np.asarray(v0, dtype=float).reshape(n, -1)[:, :states] 
+                # Pad with random vectors if fewer starting vectors than states were given. 
+                if X.shape[1] < states: 
+                    pad = np.random.default_rng(0).standard_normal((n, states - X.shape[1])) 
+                    X = np.hstack([X, pad]) 
+            # Shifting by the lower bound makes the matrix positive definite so the 
+            # incomplete factorization is a sensible preconditioner. 
+            # A matrix free operator has nothing to factorize so it gets a Jacobi preconditioner, 
+            # and a general LinearOperator that does not know its diagonal gets none. 
+            M = preconditioner 
+            if M is None and sparse.issparse(hamiltonian): 
+                shift = spectrum_lower_bound(hamiltonian) - 1 
+                ilu = spilu(sparse.csc_matrix(hamiltonian - shift*sparse.identity(n))) 
+                M = LinearOperator(hamiltonian.shape, matvec=ilu.solve, matmat=ilu.solve, dtype=float) 
+            elif M is None and isinstance(hamiltonian, StencilOperator): 
+                shift = spectrum_lower_bound(hamiltonian) - 1 
+                inv_diag = 1/(hamiltonian.diagonal() - shift) 
+                M = LinearOperator(hamiltonian.shape, matvec=lambda v: inv_diag*v.ravel(), 
+                                   matmat=lambda V: inv_diag[:, None]*V, dtype=float) 
+            op = counted_operator(matrix, counts) 
+            # The Rayleigh-Ritz step of LOBPCG limits the residuals to around sqrt(machine 
+            # precision) times the norm of H, which grows like 1/dx**2, so the tolerance is 
+            # relative to it. Anything tighter is never reached and only makes every solve 
+            # run to maxiter. The eigenvalue error goes with the square of the residual. 
+            tol = LOBPCG_TOLERANCE*max(spectrum_norm_bound(hamiltonian), 100) 
+            # SciPy stops early when its search directions become too dependent, often just above 
+            # tol. Restarting from the block it returned then converges in a few iterations, so 
+            # its own warnings are silenced and one warning is given if the restarts do not help. 
+            for restart in range(LOBPCG_RESTARTS + 1): 
+                with warnings.catch_warnings(): 
+                    warnings.filterwarnings('ignore', message='Exited', category=UserWarning) 
+                    e_values, X, history = lobpcg(op, X, M=M, tol=tol, maxiter=LOBPCG_MAXITER - counts['iterations'], 
+                                                  largest=False, retResidualNormsHistory=True) 
+                counts['iterations'] += len(history) 
+                counts['residual'] = float(np.max(history[-1])) 
+                counts['converged'] = counts['residual'] <= tol 
+                if counts['converged'] or counts['iterations'] >= LOBPCG_MAXITER: 
+                    break 
+            if not counts['converged']: 
+                warnings.warn("LOBPCG did not converge in {} iterations, largest residual {:.3g} (tolerance {:.3g})." 
+                              .format(counts['iterations'], counts['residual'], tol)) 
+            e_vec = X 
+            if not vectors: 
+                e_vec = None 
+
+        else: 
+            raise ValueError("Unknown eigensolver method {}. Use 'arpack', 'shift-invert' or 'lobpcg'.".format(method)) 
+
+    # Not every strategy hands them back in order so sort from smallest to largest. 
+    order = np.argsort(e_values.real) 
+    e_values = e_values[order] 
+    if e_vec is not None: 
+        e_vec = e_vec[:, order] 
+
+    if stats is not None: 
+        stats.update(method=method, iterations=counts['iterations'], matvecs=counts['matvecs'], 
+                     time=time.perf_counter() - start, threads=threads or 1) 
+        if 'converged' in counts: 
+            stats.update(converged=counts['converged'], residual=counts['residual']) 
+    return e_values, e_vec 
+
+#-----------------------------------------------------------------------
+## Function: separable_solve
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Fast path for separable potentials V(x,y) = Vx(x) + Vy(y). The hamiltonian 
+## is then a Kronecker sum of two tridiagonal NxN hamiltonians so the 2D 
+## eigenvalues are sums of 1D eigenvalues and the 2D eigenvectors are outer 
+## products of 1D eigenvectors. 
+##----------------------------------------------------------------------
+## Input: 
+## vx               potential along the x axis (N points) 
+## vy               potential along the y axis (N points) 
+## states           number of e-values and e-vectors
+## dx               grid spacing, 1 gives energies in units of m*dx**2 
+## stats            dict that gets filled like in eigen_solve (optional) 
+## order            stencil order 2, 4, 6, 8 or 'spectral' 
+## periodic         wrap the laplacian around instead of stopping at walls 
+## vectors          False skips building the 2D eigenvectors 
+##----------------------------------------------------------------------
+## Output: 
+## e_values         eigenvalues from smallest to largest 
+## e_vec            eigenvectors, one per column, None if vectors is False 
+##----------------------------------------------------------------------
+def separable_solve(vx, vy, states, dx=1.0, stats=None, order=2, periodic=False, vectors=True): 
+    start = time.perf_counter() 
+    N = len(vx) 
+
+    ex, phi_x, ey, phi_y = separable_factors(vx, vy, states, dx, order, periodic) 
+    e_values, iy, ix = separable_levels(ex, ey, states) 
+    e_vec = None 
+    if vectors: 
+        # Row index is y and column index is x, same as meshgrid and reshape_evec. 
+        e_vec = (phi_y[:, None, iy] * phi_x[None, :, ix]).reshape(N**2, len(e_values)) 
+
+    if stats is not None: 
+        stats.update(method='separable', iterations=0, matvecs=0, time=time.perf_counter() - start) 
+    return e_values, e_vec 
+
+#-----------------------------------------------------------------------
+## Function: separable_factors
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Solves the two 1D problems of a separable potential. 
+##----------------------------------------------------------------------
+## Input: 
+## vx, vy           potentials along the x and y axis (N points each) 
+## states           number of 2D states that will be built from them 
+## dx               grid spacing 
+## order            stencil order 2, 4, 6, 8 or 'spectral' 
+## periodic         wrap the laplacian around instead of stopping at walls 
+##----------------------------------------------------------------------
+## Output: 
+## ex, phi_x        lowest 1D eigenvalues and eigenvectors along x 
+## ey, phi_y        lowest 1D eigenvalues and eigenvectors along y 
+##----------------------------------------------------------------------
+def separable_factors(vx, vy, states, dx=1.0, order=2, periodic=False): 
+    N = len(vx) 
+
+    # The lowest `states` 2D levels can never need more than `states` levels per axis. 
+    k = min(states, N) 
+    if order == 2 and not periodic: 
+        # -1/(2 dx**2) times the 3 point stencil puts 1/dx**2 on the diagonal and 
+        # -1/(2 dx**2) off it. 
+        off = -0.5/dx**2*np.ones(N - 1) 
+        ex, phi_x = eigh_tridiagonal(1/dx**2 + np.asarray(vx, dtype=float), off, select='i', select_range=(0, k - 1)) 
+        ey, phi_y = eigh_tridiagonal(1/dx**2 + np.asarray(vy, dtype=float), off, select='i', select_range=(0, k - 1)) 
+    else: 
+        # Wider stencils, the spectral basis and periodic grids (corner entries) are 
+        # not tridiagonal, but an NxN dense solve is still tiny next to the 
+        # N**2 x N**2 problem. 
+        if order == 'spectral': 
+            D = spectral_lap_1d(N, periodic) 
+        else: 
+            D = create_1d_lap(N, order, periodic).toarray() 
+        ex, phi_x = eigh(-0.5/dx**2*D + np.diag(vx), subset_by_index=[0, k - 1]) 
+        ey, phi_y = eigh(-0.5/dx**2*D + np.diag(vy), subset_by_index=[0, k - 1]) 
+    return ex, phi_x, ey, phi_y 
+
+#-----------------------------------------------------------------------
+## Function: separable_levels
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Picks the lowest 2D levels out of all sums of 1D levels. 
+##----------------------------------------------------------------------
+## Input: 
+## ex, ey           1D eigenvalues along x and y 
+## states           number of 2D levels 
+##----------------------------------------------------------------------
+## Output: 
+## e_values         lowest 2D eigenvalues from smallest to largest 
+## iy, ix           index of the y and x factor of each level 
+##----------------------------------------------------------------------
+def separable_levels(ex, ey, states): 
+    sums = ey[:, None] + ex[None, :] 
+    lowest = np.argsort(sums, axis=None, kind='stable')[:states] 
+    iy, ix = np.unravel_index(lowest, sums.shape) 
+    return sums[iy, ix], iy, ix 
+
+#-----------------------------------------------------------------------
+## Function: counted_operator
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Wraps a matrix in a LinearOperator that counts how many times it is 
+## applied. 
+##----------------------------------------------------------------------
+## Input: 
+## matrix           sparse matrix or LinearOperator 
+## counts           dict with a 'matvecs' entry that gets incremented 
+##----------------------------------------------------------------------
+## Output: 
+## op               counting LinearOperator 
+##----------------------------------------------------------------------
+def counted_operator(matrix, counts): 
+    A = aslinearoperator(matrix) 
+    def matvec(v): 
+        counts['matvecs'] += 1 
+        return A.matvec(v) 
+    def matmat(V): 
+        # A block of vectors counts as one matvec per column. 
+        counts['matvecs'] += V.shape[1] 
+        return A.matmat(V) 
+    return LinearOperator(A.shape, matvec=matvec, matmat=matmat, dtype=A.dtype) 
+
+#-----------------------------------------------------------------------
+## Function: spectrum_lower_bound
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Gershgorin lower bound on the eigenvalues of a symmetric matrix. 
+##----------------------------------------------------------------------
+## Input: 
+## matrix           sparse matrix, StencilOperator or ThreadedMatrix 
+##----------------------------------------------------------------------
+## Output: 
+## bound            number below every eigenvalue 
+##----------------------------------------------------------------------
+def spectrum_lower_bound(matrix): 
+    if isinstance(matrix, StencilOperator): 
+        return matrix.lower_bound() 
+    if isinstance(matrix, ThreadedMatrix): 
+        matrix = matrix.matrix 
+    matrix = sparse.csr_matrix(matrix) 
+    # For a complex (absorbing) hamiltonian this bounds the real part. 
+    diag = matrix.diagonal().real 
+    # Row sums of the absolute off diagonal entries are the Gershgorin radii. 
+    radii = np.asarray(abs(matrix).sum(axis=1)).ravel() - abs(diag) 
+    return float(np.min(diag - radii))
+
+#-----------------------------------------------------------------------
+## Function: spectrum_norm_bound
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Upper bound on the largest |eigenvalue|, the largest absolute row sum. 
+##----------------------------------------------------------------------
+## Input: 
+## matrix           sparse matrix, StencilOperator, ThreadedMatrix or 
+##                  LinearOperator 
+##----------------------------------------------------------------------
+## Output: 
+## bound            number above every |eigenvalue|, 1 for a general 
+##                  LinearOperator whose entries are not known 
+##----------------------------------------------------------------------
+def spectrum_norm_bound(matrix): 
+    if isinstance(matrix, StencilOperator): 
+        return matrix.norm_bound() 
+    if isinstance(matrix, ThreadedMatrix): 
+        matrix = matrix.matrix 
+    if not sparse.issparse(matrix): 
+        return 1.0 
+    return float(np.max(abs(sparse.csr_matrix(matrix)).sum(axis=1))) 
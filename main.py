@@ -6,9 +6,28 @@
 # 2D grid, constructing the Hamiltonian matrix and solving the eigenvalue 
 # problem and plotting the potentials and probability densities. 
 #-----------------------------------------------------------------------------
-from inputoutput import read_input, plot_potential, plot_densities 
-from linearalgebra import creategrid, eigen_solve 
-from quantum import create_potential, create_kinetic, create_hamiltonian
+import os 
+import json 
+from inputoutput import read_input 
+from linearalgebra import creategrid, eigen_solve, separable_solve 
+from quantum import create_potential, separable_potential, create_kinetic, create_hamiltonian, get_potential
+from cache import cached_solve 
+from rendering import Renderer 
+from observables import GUARD_STATES, canonical_basis, symmetry_labels, state_observables, trim_states 
+import profiling 
+from profiling import stage 
+
+#Where solved eigenpairs are cached between runs. 
+CACHE_DIR = '.eigencache' 
+
+#Where the plots are written. They are drawn headless in the background instead of in windows that block the program. 
+PLOT_DIR = 'plots' 
+PLOT_FORMAT = 'png' 
+
+#Set SCHRODINGER_PROFILE=1 to time every stage and record its peak memory, or to a .json path to also write the records there. 
+profile_setting = os.environ.get(profiling.PROFILE_ENV) 
+if profile_setting: 
+    profiling.enable() 
 
 # Take input from the user. TODO: maybe make a namelist instead? 
 potential_inp, states, L, N  = read_input() 
@@ -16,35 +35,95 @@ potential_inp, states, L, N  = read_input()
 print("input read ") #Print statements to track progress of the program. 
 
 #Create a 2 dimensional grid 
-x, y = creategrid(L, N) 
+with stage('creategrid', N=N): 
+    grid = creategrid(L, N) 
+x, y = grid.x, grid.y 
  
 print("xy grid created")
 
 #Create the potential energy matrix. Note that since 0s are everywhere, it's really just an array. 
 #Refer to the README for clarification on how the operators are constructed. 
-potential = create_potential(x, y, L, potential_inp) 
+with stage('create_potential', potential=potential_inp): 
+    potential = create_potential(x, y, L, potential_inp) 
 
 print("potential made") 
 
-#Create the kinetic energy matrix. 
-kinetic = create_kinetic(N) 
+#The potential plot is drawn in a background process while the system is solved. 
+renderer = Renderer(PLOT_DIR, PLOT_FORMAT) 
+renderer.potential('potential', potential, x, y) 
+
+#Solved eigenpairs are kept in an on-disk cache so the same potential, L and N is never solved twice. 
+#A few guard states past the ones asked for keep the last degenerate level whole, they are dropped after the rotation below. 
+solved = states + GUARD_STATES 
+solve_stats = {} 
+def solve(v0): 
+    separable = separable_potential(grid, potential_inp) 
+    if separable is not None: 
+        #Separable potentials factor into two 1D problems which solve in milliseconds, no 2D Hamiltonian needed. 
+        with stage('eigen_solve') as record: 
+            result = separable_solve(*separable, solved, dx=grid.dx, stats=solve_stats) 
+            record.update(method=solve_stats['method'], matvecs=solve_stats['matvecs']) 
+        return result 
 
-print("kinetic made")
+    #Create the kinetic energy matrix. 
+    with stage('create_kinetic'): 
+        kinetic = create_kinetic(grid) 
+    print("kinetic made")
 
-#Create the Hamiltonian. This is easy because we're just adding the potential energy and kinetic energy operators. 
-hamiltonian = create_hamiltonian(potential, kinetic, N) 
-print("H made")
+    #Create the Hamiltonian. This is easy because we're just adding the potential energy and kinetic energy operators. 
+    with stage('create_hamiltonian'): 
+        hamiltonian = create_hamiltonian(potential, kinetic, grid) 
+    print("H made")
 
-#Solve system. e_values are the eigenvalues and e_vec are the eigenvectors. 
-#Note for a hydrogen like potential my machine(which isn't very good) had some trouble. 
-e_values, e_vec = eigen_solve(hamiltonian, states) 
-print("system solved")
+    #Solve system. e_values are the eigenvalues and e_vec are the eigenvectors. 
+    #Note for a hydrogen like potential my machine(which isn't very good) had some trouble with plain ARPACK. 
+    #Shift-invert around the bottom of the spectrum finds the lowest states in a few iterations. 
+    #The stats hold the ARPACK matvec count, they go into the profile record too. 
+    with stage('eigen_solve') as record: 
+        result = eigen_solve(hamiltonian, solved, method='shift-invert', v0=v0, stats=solve_stats) 
+        record.update(method=solve_stats['method'], matvecs=solve_stats['matvecs']) 
+    return result 
 
-#We can really do this part earlier but we should have some idea of what potentials should look like already. 
-#This is mainly to make sure everything is setup right prior to solving the system. 
-plot_potential(potential, x, y)
-print("potential plotted")
+#The potential is keyed by its fingerprint (name and parameters) so changing a default never loads stale states. 
+cache_params = dict(potential=get_potential(potential_inp).fingerprint(), L=L, N=N, bc=grid.bc) 
+e_values, e_vec, hit = cached_solve(CACHE_DIR, cache_params, solved, solve) 
+if hit: 
+    solve_stats.update(method='cache', iterations=0, time=0.0) 
+print("system solved with {method} in {iterations} iterations and {time:.3f} s".format(**solve_stats))
+#LOBPCG reports its largest residual. Eigenvalues of a solve that did not converge should not be trusted. 
+if solve_stats.get('residual') is not None: 
+    print("largest residual {:.3g}, {}".format(solve_stats['residual'], 
+                                               'converged' if solve_stats['converged'] else 'NOT CONVERGED')) 
+
+#ARPACK hands back any rotation of a degenerate level, so each level is rotated into one fixed basis first. That way the 
+#densities are the same every run. The observables of all states come out of one pass over the whole block. 
+with stage('observables'): 
+    e_vec, clusters = canonical_basis(e_values, e_vec, N, x, y) 
+    e_values, e_vec, cut = trim_states(e_values, e_vec, states, clusters) 
+    labels = symmetry_labels(e_vec, N) 
+    observables = state_observables(e_vec, N, x, y) 
+print("{:>5} {:>14} {:>6} {:>10} {:>10} {:>6}".format('state', 'E', 'sector', '<x^2>', '<r>', 'nodal')) 
+for n in range(len(e_values)): 
+    print("{:>5} {:14.6g} {:>6} {:10.4g} {:10.4g} {:>6}".format(n, e_values[n], labels[n] or '-', observables['x2'][n], 
+                                                               observables['r'][n], observables['nodal_domains'][n])) 
+#Only if the last level has more partners than the guard states, its states are then in an arbitrary rotation. 
+if cut: 
+    print("states {} to {} are part of a level that reaches the last of the {} states solved, their basis and sector may not be " 
+          "canonical. Ask for more states.".format(cut[0], cut[-1], solved)) 
 
 #Now the important results. When solving these systems, the probability densities and the eigenvalues are the 
-#main results of interest. TODO: find a way to represent the eigenvalues on a graph. 
-plot_densities(e_vec, x, y, states, N)
\ No newline at end of file
+#main results of interest. All states go into one figure with the eigenvalue in each title. 
+renderer.densities('densities', e_vec, x, y, states, N, e_values) 
+#The plots are drawn in the background, this stage is the time spent waiting for them. 
+with stage('rendering'): 
+    paths = renderer.close() 
+for path in paths: 
+    print("plot written to {}".format(path)) 
+
+profiler = profiling.disable() 
+if profiler is not None: 
+    print(profiler.report()) 
+    if profile_setting.endswith('.json'): 
+        with open(profile_setting, 'w') as f: 
+            json.dump(profiler.records, f, indent=1) 
+ 
@@ -0,0 +1,332 @@
+#-----------------------------------------------------------------------
+#Module: mapping
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Non-uniform grids for potentials with a sharp feature, like the cusp
+## of hydrogen at the origin. A uniform grid needs a small spacing
+## everywhere to resolve it. Here the points are x = L*g(xi) with xi
+## uniform in (-1, 1) and g a stretching map (sinh or tan) that packs
+## them around the origin and spreads them out where the wavefunctions
+## are smooth.
+##
+## On uneven points the kinetic energy is discretized in its weak form,
+## which keeps the matrices symmetric:
+##   -1/2 d2/dx2  ->  1/2 S psi = E W psi
+## S is the stiffness matrix, with 1/h on the edges between neighbouring
+## points, and W is the diagonal (lumped) mass matrix of the cell widths.
+## In 2D, K = (S_x (x) W_y + W_x (x) S_y)/2 and the mass is W_x (x) W_y.
+## The result is the generalized eigenproblem H psi = E M psi with
+## H = K + M V. Because M is diagonal, scaling with M^-1/2 turns it into an
+## ordinary symmetric one, which eigen_solve handles with every strategy.
+## On a uniform map this is exactly the 5 point stencil of create_kinetic.
+##
+## For radially symmetric potentials polar_solve goes further. With
+## psi = R(r) exp(i m phi) the problem splits into a 1D radial problem for
+## every m, each solved on a mapped radial grid. Each problem is only Nr
+## points long instead of N**2.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## stretch
+## MappedGrid
+## create_mapped_grid
+## mapped_lap_1d
+## create_mapped_hamiltonian
+## mapped_solve
+## radial_points
+## polar_solve
+##
+#-----------------------------------------------------------------------
+
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.linalg import eigh_tridiagonal
+from linearalgebra import eigen_solve
+from multigrid import ground_shift
+from quantum import get_potential
+
+# Maps stretch can do.
+COORDINATE_MAPS = ('uniform', 'sinh', 'tan')
+
+# Default strength of each map. The centre spacing is about beta/sinh(beta)
+# (sinh) and beta/tan(beta) (tan) times the uniform one.
+DEFAULT_BETA = {'uniform': 0.0, 'sinh': 6.0, 'tan': 1.5}
+
+#-----------------------------------------------------------------------
+## Function: stretch
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## The stretching map g with g(0) = 0 and g(+-1) = +-1.
+##----------------------------------------------------------------------
+## Input:
+## xi               uniform coordinates in [-1, 1]
+## mapping          'uniform', 'sinh' or 'tan'
+## beta             strength of the map, bigger packs more points around
+##                  0. tan needs beta < pi/2.
+##----------------------------------------------------------------------
+## Output:
+## g                mapped coordinates in [-1, 1]
+##----------------------------------------------------------------------
+def stretch(xi, mapping='sinh', beta=None):
+    if mapping not in COORDINATE_MAPS:
+        raise ValueError("Unknown coordinate map {}. Use one of {}.".format(mapping, COORDINATE_MAPS))
+    beta = DEFAULT_BETA[mapping] if beta is None else beta
+    if mapping == 'uniform' or beta == 0:
+        return np.asarray(xi, dtype=float)
+    if mapping == 'sinh':
+        return np.sinh(beta*xi)/np.sinh(beta)
+    if not 0 < beta < np.pi/2:
+        raise ValueError("The tan map needs 0 < beta < pi/2, got {}.".format(beta))
+    return np.tan(beta*xi)/np.tan(beta)
+
+#-----------------------------------------------------------------------
+## Class: MappedGrid
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Grid with stretched points, with walls at -L and L. It has the
+## coordinate attributes of Grid so create_potential and the plots work on
+## it unchanged. It has no single dx, so the kinetic energy comes from
+## create_mapped_hamiltonian instead of create_kinetic.
+##----------------------------------------------------------------------
+## Attributes:
+## L                grid goes from -L to L on both axes
+## N                number of unknowns on each axis
+## bc               always 'dirichlet'
+## periodic         always False
+## mapping, beta    the map and its strength
+## nodes            the N + 2 points on each axis including the walls
+## x_pts, y_pts     1D arrays of the N interior points on each axis
+## x, y             open grid of the coordinates, 1xN and Nx1
+## weights          length of the cell around each interior point, the
+##                  diagonal of the 1D mass matrix
+##----------------------------------------------------------------------
+class MappedGrid:
+
+    def __init__(self, L, N, mapping='sinh', beta=None):
+        self.L = L
+        self.N = N
+        self.bc = 'dirichlet'
+        self.periodic = False
+        self.mapping = mapping
+        self.beta = DEFAULT_BETA[mapping] if beta is None and mapping in DEFAULT_BETA else beta
+        # Same uniform xi points as Grid's interior points and walls.
+        self.nodes = L*stretch(np.linspace(-1, 1, N + 2), mapping, self.beta)
+        self.x_pts = self.nodes[1:-1]
+        self.y_pts = self.x_pts.copy()
+        self.x = self.x_pts[np.newaxis, :]
+        self.y = self.y_pts[:, np.newaxis]
+        h = np.diff(self.nodes)
+        self.weights = 0.5*(h[:-1] + h[1:])
+
+    def __repr__(self):
+        return "MappedGrid(L={}, N={}, mapping={!r}, beta={})".format(self.L, self.N, self.mapping, self.beta)
+
+#-----------------------------------------------------------------------
+## Function: create_mapped_grid
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Creates a grid with points packed around the origin.
+##----------------------------------------------------------------------
+## Input:
+## L                grid goes from -L to L
+## N                number of unknowns on each axis. Use an even N for
+##                  potentials singular at the origin so 0 is not a point.
+## mapping          'uniform', 'sinh' or 'tan'
+## beta             strength of the map (optional)
+##----------------------------------------------------------------------
+## Output:
+## grid             MappedGrid
+##----------------------------------------------------------------------
+def create_mapped_grid(L, N, mapping='sinh', beta=None):
+    grid = MappedGrid(L, N, mapping, beta)
+    return grid
+
+#-----------------------------------------------------------------------
+## Function: mapped_lap_1d
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Weak form of -d2/dx2 on uneven points with psi = 0 at the two ends.
+##----------------------------------------------------------------------
+## Input:
+## nodes            the N + 2 points including both walls
+##----------------------------------------------------------------------
+## Output:
+## S                NxN sparse stiffness matrix (positive definite)
+## w                length N diagonal of the lumped mass matrix
+##----------------------------------------------------------------------
+def mapped_lap_1d(nodes):
+    h = np.diff(nodes)
+    main = 1/h[:-1] + 1/h[1:]
+    off = -1/h[1:-1]
+    S = sparse.diags([off, main, off], [-1, 0, 1], format='csr')
+    w = 0.5*(h[:-1] + h[1:])
+    return S, w
+
+#-----------------------------------------------------------------------
+## Function: create_mapped_hamiltonian
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Hamiltonian and mass matrix of the generalized eigenproblem
+## H psi = E M psi on a MappedGrid.
+##----------------------------------------------------------------------
+## Input:
+## potential        potential energy matrix on the NxN grid
+## grid             MappedGrid
+##----------------------------------------------------------------------
+## Output:
+## H                sparse symmetric hamiltonian, K + M V
+## mass             N**2 diagonal of M, laid out like the columns of e_vec
+##----------------------------------------------------------------------
+def create_mapped_hamiltonian(potential, grid):
+    S, w = mapped_lap_1d(grid.nodes)
+    Wd = sparse.diags(w)
+    # Row index y and column index x like everywhere else, so x is the fast index.
+    K = 0.5*(sparse.kron(Wd, S) + sparse.kron(S, Wd))
+    mass = np.outer(w, w).ravel()
+    H = sparse.csr_matrix(K + sparse.diags(mass*np.asarray(potential).reshape(grid.N**2)))
+    return H, mass
+
+#-----------------------------------------------------------------------
+## Function: mapped_solve
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Solves H psi = E M psi for a diagonal M. With phi = M^1/2 psi it is the
+## ordinary symmetric problem M^-1/2 H M^-1/2 phi = E phi, which goes to
+## eigen_solve.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      sparse hamiltonian from create_mapped_hamiltonian
+## mass             diagonal of the mass matrix
+## states           number of e-values and e-vectors
+## method           eigen_solve strategy
+## stats            dict filled like in eigen_solve (optional)
+## kwargs           passed on to eigen_solve (sigma, v0, ...). Shift-invert
+##                  without a sigma shifts to just below the ground state.
+##----------------------------------------------------------------------
+## Output:
+## e_values         eigenvalues from smallest to largest
+## e_vec            eigenvectors psi on the grid points, one per column,
+##                  normalized so psi^T M psi = 1 (the integral of |psi|**2)
+##----------------------------------------------------------------------
+def mapped_solve(hamiltonian, mass, states, method='shift-invert', stats=None, **kwargs):
+    scale = 1/np.sqrt(mass)
+    D = sparse.diags(scale)
+    scaled = sparse.csr_matrix(D @ hamiltonian @ D)
+    # The smallest cells make the Gershgorin bound far too low, a shift that
+    # far below the spectrum makes shift-invert crawl.
+    if method == 'shift-invert' and kwargs.get('sigma') is None:
+        kwargs['sigma'] = ground_shift(scaled)
+    e_values, phi = eigen_solve(scaled, states, method=method, stats=stats, **kwargs)
+    # phi has unit norm, so psi = M^-1/2 phi is M-normalized.
+    return e_values, scale[:, None]*phi
+
+#-----------------------------------------------------------------------
+## Function: radial_points
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Points of a mapped radial grid on (0, R]. The first point is half a
+## (mapped) cell from the origin, so r = 0 is never a point, and the last
+## is the wall at R.
+##----------------------------------------------------------------------
+## Input:
+## R                radius of the disk
+## Nr               number of unknowns
+## mapping          'uniform', 'sinh' or 'tan'
+## beta             strength of the map (optional)
+##----------------------------------------------------------------------
+## Output:
+## r                Nr + 1 points, the last one the wall at R
+##----------------------------------------------------------------------
+def radial_points(R, Nr, mapping='sinh', beta=None):
+    s = (np.arange(1, Nr + 2) - 0.5)/(Nr + 0.5)
+    return R*stretch(s, mapping, beta)
+
+#-----------------------------------------------------------------------
+## Function: polar_solve
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Lowest states of a radially symmetric potential on a disk of radius R
+## with psi = 0 on the rim. For every angular momentum m the radial
+## equation -1/2 (1/r)(r R')' + (m**2/(2 r**2) + V) R = E R is discretized
+## in finite volume form (cells between the midpoints, the flux r R'
+## vanishing at the origin). This is a symmetric tridiagonal generalized
+## problem and is solved with eigh_tridiagonal after scaling. Levels with
+## m != 0 are doubly degenerate (+m and -m), both are listed.
+##----------------------------------------------------------------------
+## Input:
+## potential_inp    name of a registered radially symmetric potential
+## R                radius of the disk
+## Nr               number of radial unknowns
+## states           number of e-values
+## mapping          'uniform', 'sinh' or 'tan'
+## beta             strength of the map (optional)
+## m_max            highest |m| tried, defaults to states
+## stats            dict filled like in eigen_solve (optional)
+## params           parameters of the potential
+##----------------------------------------------------------------------
+## Output:
+## e_values         eigenvalues from smallest to largest
+## m                angular momentum of each state
+## radial           Nr x states array of R(r) of each state, normalized
+##                  so the integral of |psi|**2 over the disk is 1
+## r                the Nr radial points
+##----------------------------------------------------------------------
+def polar_solve(potential_inp, R, Nr, states, mapping='sinh', beta=None, m_max=None, stats=None, **params):
+    start = time.perf_counter()
+    potential = get_potential(potential_inp)
+    nodes = radial_points(R, Nr, mapping, beta)
+    r = nodes[:-1]
+    v = potential.evaluate(r, 0.0, R, **params)
+    # Along the diagonal the radius is the same, so a radial potential gives the same values.
+    # The points are kept as a column, two 1D arrays would be taken as the axes of a grid.
+    diagonal = (r/np.sqrt(2))[:, np.newaxis]
+    if not np.allclose(potential.evaluate(diagonal, diagonal, R, **params).ravel(), v):
+        raise ValueError("Potential {} is not radially symmetric, polar_solve cannot be used.".format(potential.name))
+
+    # Faces halfway between the points, the first one at the origin.
+    faces = np.concatenate([[0.0], 0.5*(nodes[:-1] + nodes[1:])])
+    w = 0.5*(faces[1:]**2 - faces[:-1]**2)
+    flux = faces[1:]/np.diff(nodes)
+    main = 0.5*(flux + np.concatenate([[0.0], flux[:-1]]))
+    off = -0.5*flux[:-1]
+    scale = 1/np.sqrt(w)
+
+    m_max = states if m_max is None else m_max
+    levels = []
+    for m in range(m_max + 1):
+        d = main*scale**2 + m**2/(2*r**2) + v
+        # Enough states per m that the combined lowest `states` are all there.
+        k = min(states, Nr)
+        e, u = eigh_tridiagonal(d, off*scale[:-1]*scale[1:], select='i', select_range=(0, k - 1))
+        # The angular part exp(i m phi)/sqrt(2 pi) is normalized on its own.
+        radial = scale[:, None]*u/np.sqrt(2*np.pi)
+        for j in range(k):
+            for _ in range(1 if m == 0 else 2):
+                levels.append((e[j], m, radial[:, j]))
+    levels.sort(key=lambda level: level[0])
+    levels = levels[:states]
+    # Labels in the order of +m, -m pairs.
+    labels, seen = [], {}
+    for e, m, _ in levels:
+        if m == 0:
+            labels.append(0)
+        else:
+            key = (e, m)
+            labels.append(m if key not in seen else -m)
+            seen[key] = True
+
+    if stats is not None:
+        stats.update(method='polar', iterations=0, matvecs=0, time=time.perf_counter() - start)
+    return (np.array([e for e, _, _ in levels]), np.array(labels),
+            np.column_stack([f for _, _, f in levels]), r)
@@ -0,0 +1,297 @@
+#-----------------------------------------------------------------------
+#Module: multigrid
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Coarse to fine solves. The low lying states are smooth, so a grid with
+## a quarter of the points already gets their shape right and costs a
+## sixteenth of the work. The problem is solved on N/4, the eigenvectors
+## are interpolated onto N/2 and used as the starting subspace there, and
+## again onto the target N. On the finer levels LOBPCG then only has to
+## fix the small differences between the grids instead of finding the
+## states from a random block, and the coarse eigenvalues tell where the
+## wanted part of the spectrum is.
+##
+## The preconditioner of the LOBPCG solves is (H - sigma*I)^-1 from one
+## sparse LU factorization, with sigma just below the coarse ground state
+## energy. That is the same factorization shift-invert ARPACK uses, but
+## LOBPCG applies it to the whole block at once and a good start needs
+## only a handful of iterations. With pyamg installed an algebraic
+## multigrid V-cycle can be used instead, which needs far less memory.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## coarse_levels
+## block_size
+## factorize_shifted
+## ground_shift
+## shift_invert_preconditioner
+## amg_preconditioner
+## coarse_to_fine_solve
+##
+#-----------------------------------------------------------------------
+
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, splu
+from linearalgebra import creategrid, eigen_solve, spectrum_lower_bound
+from quantum import create_potential, create_kinetic, create_hamiltonian
+from continuation import interpolate_evec
+
+# Algebraic multigrid is optional, the LU preconditioner needs only SciPy.
+try:
+    import pyamg
+except ImportError:
+    pyamg = None
+
+# Coarsest grid that is still worth solving on.
+MIN_COARSE_N = 16
+
+# Most extra vectors carried in the block on the fine levels. The states
+# just above the ones asked for slow LOBPCG down if they are not in it.
+GUARD_VECTORS = 4
+
+#-----------------------------------------------------------------------
+## Function: coarse_levels
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Grid sizes of the levels, coarsest first, ending with N itself.
+##----------------------------------------------------------------------
+## Input:
+## N                target number of points on each axis
+## factors          how much coarser each extra level is than N
+##----------------------------------------------------------------------
+## Output:
+## sizes            list of N on each level
+##----------------------------------------------------------------------
+def coarse_levels(N, factors=(4, 2)):
+    sizes = []
+    for f in sorted(factors, reverse=True):
+        # Every level has the parity of N so the centre of the box is a grid
+        # point on all of them or on none. The states of a potential that is
+        # singular there (hydrogen) differ completely between the two cases.
+        size = N//f + (N//f - N) % 2
+        if size >= MIN_COARSE_N:
+            sizes.append(size)
+    return sizes + [N]
+
+#-----------------------------------------------------------------------
+## Function: block_size
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Number of vectors to iterate on. LOBPCG converges at a rate set by the
+## gap between the last state in the block and the first one outside it,
+## so the block is cut at the biggest gap within GUARD_VECTORS states
+## past the ones wanted. Cutting through a degenerate pair is the worst
+## case, half of the pair would never converge.
+##----------------------------------------------------------------------
+## Input:
+## e_values         coarse eigenvalues, at least states + GUARD_VECTORS + 1
+## states           number of states wanted
+##----------------------------------------------------------------------
+## Output:
+## k                block size between states and states + GUARD_VECTORS
+##----------------------------------------------------------------------
+def block_size(e_values, states):
+    candidates = np.arange(states, min(states + GUARD_VECTORS, len(e_values) - 1) + 1)
+    if len(candidates) == 0:
+        return min(states, len(e_values))
+    gaps = e_values[candidates] - e_values[candidates - 1]
+    return int(candidates[np.argmax(gaps)])
+
+#-----------------------------------------------------------------------
+## Function: factorize_shifted
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Sparse LU factorization of H - sigma*I that also counts the eigenvalues
+## of H below sigma. Pivoting only on the diagonal with a symmetric
+## ordering makes it an LDL^T factorization in disguise, and by
+## Sylvester's law of inertia the number of negative pivots is the number
+## of eigenvalues below sigma.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      sparse real symmetric hamiltonian
+## sigma            shift
+##----------------------------------------------------------------------
+## Output:
+## lu               SuperLU factorization of H - sigma*I
+## below            number of eigenvalues of H below sigma
+##----------------------------------------------------------------------
+def factorize_shifted(hamiltonian, sigma):
+    shifted = sparse.csc_matrix(hamiltonian - sigma*sparse.identity(hamiltonian.shape[0]))
+    # The hamiltonian is structurally symmetric, ordering on A^T + A gives
+    # much less fill than the default column ordering.
+    lu = splu(shifted, permc_spec='MMD_AT_PLUS_A', diag_pivot_thresh=0.0, options=dict(SymmetricMode=True))
+    below = int(np.sum(lu.U.diagonal() < 0))
+    return lu, below
+
+#-----------------------------------------------------------------------
+## Function: ground_shift
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Finds a shift just below the ground state energy by bisection on the
+## eigenvalue count. Shift-invert with the Gershgorin bound as the shift
+## is very slow when the bound is far below the spectrum, e.g. for the
+## deep hydrogen potential.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      sparse real symmetric hamiltonian
+## steps            number of bisection steps
+##----------------------------------------------------------------------
+## Output:
+## sigma            shift with no eigenvalue below it
+##----------------------------------------------------------------------
+def ground_shift(hamiltonian, steps=10):
+    lo = spectrum_lower_bound(hamiltonian)
+    # The Rayleigh quotient of any vector is above the ground state energy.
+    v = np.ones(hamiltonian.shape[0])
+    hi = float(v @ (hamiltonian @ v))/(v @ v)
+    for _ in range(steps):
+        mid = 0.5*(lo + hi)
+        if factorize_shifted(hamiltonian, mid)[1] == 0:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+#-----------------------------------------------------------------------
+## Function: shift_invert_preconditioner
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Exact inverse of H - sigma*I from a sparse LU factorization. If the
+## guessed sigma turns out to be above some eigenvalue (the energies can
+## move a lot between grids for singular potentials) it is lowered until
+## H - sigma*I is positive definite, an indefinite preconditioner stalls
+## LOBPCG.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      sparse hamiltonian
+## sigma            guess for a shift below the lowest eigenvalue
+## step             how far to lower sigma the first time
+##----------------------------------------------------------------------
+## Output:
+## M                LinearOperator applying (H - sigma*I)^-1
+##----------------------------------------------------------------------
+def shift_invert_preconditioner(hamiltonian, sigma, step):
+    lu, below = factorize_shifted(hamiltonian, sigma)
+    while below > 0:
+        sigma -= step
+        step *= 2
+        lu, below = factorize_shifted(hamiltonian, sigma)
+    return LinearOperator(hamiltonian.shape, matvec=lu.solve, matmat=lu.solve, dtype=hamiltonian.dtype)
+
+#-----------------------------------------------------------------------
+## Function: amg_preconditioner
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Smoothed aggregation AMG V-cycle for H - shift*I, shifted by the
+## Gershgorin bound so it is positive definite.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      sparse hamiltonian
+##----------------------------------------------------------------------
+## Output:
+## M                LinearOperator applying one V-cycle
+##----------------------------------------------------------------------
+def amg_preconditioner(hamiltonian):
+    if pyamg is None:
+        raise ValueError("The 'amg' preconditioner needs pyamg. Install it or use preconditioner='shift-invert'.")
+    if not sparse.issparse(hamiltonian):
+        raise ValueError("The 'amg' preconditioner needs an assembled sparse Hamiltonian.")
+    shift = spectrum_lower_bound(hamiltonian) - 1
+    shifted = sparse.csr_matrix(hamiltonian - shift*sparse.identity(hamiltonian.shape[0]))
+    ml = pyamg.smoothed_aggregation_solver(shifted, symmetry='symmetric')
+    return ml.aspreconditioner(cycle='V')
+
+#-----------------------------------------------------------------------
+## Function: coarse_to_fine_solve
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Solves one problem by going up a ladder of grids, each level starting
+## from the interpolated eigenvectors of the level below.
+##----------------------------------------------------------------------
+## Input:
+## potential_inp    name of a registered potential
+## L                grid goes from -L to L
+## N                number of points on each axis of the target grid
+## states           number of e-values and e-vectors
+## factors          coarsening factors of the extra levels, (4, 2) solves
+##                  on N/4 and N/2 before N
+## coarse_method    eigen_solve strategy for the coarsest level
+## preconditioner   'shift-invert' or 'amg' for the LOBPCG solves. Matrix
+##                  free (spectral) hamiltonians always use eigen_solve's
+##                  default.
+## order            stencil order of the kinetic energy
+## bc               boundary condition of the grids
+## stats            dict filled with the total time, the stats of every
+##                  level and whether every LOBPCG level converged (optional)
+## params           parameters of the potential (optional)
+##----------------------------------------------------------------------
+## Output:
+## e_values         eigenvalues from smallest to largest
+## e_vec            eigenvectors on the target grid, one per column
+##----------------------------------------------------------------------
+def coarse_to_fine_solve(potential_inp, L, N, states, factors=(4, 2), coarse_method='shift-invert',
+                         preconditioner='shift-invert', order=2, bc='dirichlet', stats=None, params=None):
+    if preconditioner not in ('shift-invert', 'amg'):
+        raise ValueError("Unknown preconditioner {}. Use 'shift-invert' or 'amg'.".format(preconditioner))
+    if bc == 'absorbing':
+        raise ValueError("Coarse to fine solves use LOBPCG which needs a hermitian hamiltonian, not absorbing boundaries.")
+    start = time.perf_counter()
+
+    levels = []
+    prev_grid, prev_values, prev_vec = None, None, None
+    for level_N in coarse_levels(N, factors):
+        grid = creategrid(L, level_N, bc)
+        potential = create_potential(grid.x, grid.y, L, potential_inp, **(params or {}))
+        hamiltonian = create_hamiltonian(potential, create_kinetic(grid, order), grid)
+
+        level_stats = {}
+        if prev_vec is None:
+            # Nothing to start from on the coarsest level, it is cheap enough to
+            # solve directly. One state more than the biggest block is needed to
+            # see the gap above it.
+            k = min(states + GUARD_VECTORS + 1, level_N**2 - 2)
+            method, sigma = coarse_method, None
+            if not sparse.issparse(hamiltonian):
+                # The matrix free spectral operator cannot be factorized.
+                method = 'lobpcg'
+            elif method == 'shift-invert':
+                sigma = ground_shift(hamiltonian)
+            e_values, e_vec = eigen_solve(hamiltonian, k, method=method, sigma=sigma, stats=level_stats)
+        else:
+            k = block_size(prev_values, states)
+            M = None
+            if preconditioner == 'amg' and sparse.issparse(hamiltonian):
+                M = amg_preconditioner(hamiltonian)
+            elif sparse.issparse(hamiltonian):
+                # Half the width of the wanted band below the coarse ground state
+                # usually keeps H - sigma*I positive definite even though the
+                # energies move between grids.
+                step = 0.5*(prev_values[states - 1] - prev_values[0]) + 1e-3
+                M = shift_invert_preconditioner(hamiltonian, prev_values[0] - step, step)
+            v0 = interpolate_evec(prev_vec[:, :k], prev_grid, grid)
+            e_values, e_vec = eigen_solve(hamiltonian, k, method='lobpcg', v0=v0, stats=level_stats,
+                                          preconditioner=M)
+            # Keep the coarse values past the block, they still mark where the next gap is.
+            e_values = np.concatenate([e_values, prev_values[k:]])
+        levels.append(dict(level_stats, N=level_N))
+        prev_grid, prev_values, prev_vec = grid, e_values, e_vec
+
+    if stats is not None:
+        stats.update(method='coarse-to-fine', levels=levels,
+                     iterations=sum(level['iterations'] for level in levels),
+                     matvecs=sum(level['matvecs'] for level in levels),
+                     converged=all(level.get('converged', True) for level in levels),
+                     residual=max((level['residual'] for level in levels if 'residual' in level), default=None),
+                     time=time.perf_counter() - start)
+    return e_values[:states], e_vec[:, :states]
@@ -0,0 +1,289 @@
+#-----------------------------------------------------------------------
+#Module: observables
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Post-processing of a solved eigenvector block, done on the whole block
+## at once rather than one reshaped state at a time.
+##
+## Within a degenerate level every rotation of the eigenvectors is as good
+## as any other. ARPACK, LOBPCG and the cache can each hand back a
+## different one, so the densities of a degenerate state differ from run
+## to run. canonical_basis picks one basis per level, the same whatever
+## the solver started from. It diagonalizes the reflections x -> -x and
+## y -> -y, the swap x <-> y, and then x**2 and x, each restricted to the
+## states the previous operators left degenerate. For a potential with
+## the symmetry of the square this gives each state a sector of
+## symmetry.py (A1, B1, B2, A2 or E). The sign of each state is fixed by
+## its first large entry. The reflections are reflections of the grid
+## indices, so as in symmetry.py the labels mean something only on grids
+## symmetric about 0 (Dirichlet, not periodic). The basis is canonical on
+## every grid. The level the last wanted state falls in may go on past
+## it, so callers solve GUARD_STATES more and trim_states cuts the block
+## back after the rotation. It reports the level if even the guard states
+## do not reach its end.
+##
+## state_observables computes <x>, <y>, <x**2>, <y**2>, <r> and <r**2> of
+## every state with one matrix product of the densities against the
+## coordinates. It counts nodal domains with one labelling of the stacked
+## sign patterns.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## degenerate_clusters
+## probability_densities
+## canonical_basis
+## trim_states
+## symmetry_labels
+## nodal_domains
+## state_observables
+##
+#-----------------------------------------------------------------------
+
+import numpy as np
+from scipy import ndimage
+from scipy.linalg import eigh
+from linearalgebra import grid_axes
+
+# Relative gap below which two eigenvalues count as one degenerate level.
+DEGENERACY_TOL = 1e-6
+
+# Amplitudes below this fraction of the largest one count as zero when
+# nodal domains are counted, so rounding noise in the tails and on the
+# nodal lines does not make spurious domains.
+NODAL_TOL = 1e-6
+
+# States solved past the ones asked for, so the last level asked for is
+# whole unless it has more than this many partners beyond it.
+GUARD_STATES = 2
+
+# Sectors of symmetry.py by parity under x -> -x, y -> -y and x <-> y.
+SECTOR_LABELS = {(1, 1, 1): 'A1', (1, 1, -1): 'B1', (-1, -1, 1): 'B2', (-1, -1, -1): 'A2'}
+
+#-----------------------------------------------------------------------
+## Function: degenerate_clusters
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Groups sorted eigenvalues into degenerate levels.
+##----------------------------------------------------------------------
+## Input:
+## e_values         eigenvalues from smallest to largest
+## tol              relative gap below which two eigenvalues are the same
+##                  level
+##----------------------------------------------------------------------
+## Output:
+## clusters         list of index arrays, one per level
+##----------------------------------------------------------------------
+def degenerate_clusters(e_values, tol=DEGENERACY_TOL):
+    e_values = np.real(e_values)
+    if len(e_values) == 0:
+        return []
+    gaps = np.diff(e_values)
+    scale = np.maximum(np.maximum(np.abs(e_values[1:]), np.abs(e_values[:-1])), 1.0)
+    breaks = np.flatnonzero(gaps > tol*scale) + 1
+    return np.split(np.arange(len(e_values)), breaks)
+
+#-----------------------------------------------------------------------
+## Function: probability_densities
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Probability densities of all states at once.
+##----------------------------------------------------------------------
+## Input:
+## e_vec            eigenvectors, one per column
+## N                number of points on each axis
+##----------------------------------------------------------------------
+## Output:
+## densities        states x N x N array, densities[n] is |psi_n|**2
+##                  laid out like reshape_evec
+##----------------------------------------------------------------------
+def probability_densities(e_vec, N):
+    # Each column is a row-major NxN state, so the block is N x N x states.
+    return np.moveaxis((np.abs(e_vec)**2).reshape(N, N, -1), -1, 0)
+
+#-----------------------------------------------------------------------
+## Function: canonical_basis
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Rotates every degenerate level of an eigenvector block into its
+## canonical basis and fixes the sign of every state.
+##----------------------------------------------------------------------
+## Input:
+## e_values         eigenvalues from smallest to largest
+## e_vec            orthonormal eigenvectors, one per column
+## N                number of points on each axis
+## x                x coordinates, 1D axis, open grid or NxN array
+## y                y coordinates, same form as x
+## tol              relative gap below which eigenvalues are degenerate
+##----------------------------------------------------------------------
+## Output:
+## e_vec            the same states in the canonical basis (a new array)
+## clusters         the degenerate levels, from degenerate_clusters
+##----------------------------------------------------------------------
+def canonical_basis(e_values, e_vec, N, x, y, tol=DEGENERACY_TOL):
+    if np.iscomplexobj(e_vec):
+        raise ValueError("The canonical basis needs the orthonormal eigenvectors of a hermitian hamiltonian.")
+    x_pts, y_pts = grid_axes(x, y)
+    # Operators that split a level, all applied to a block of states at once.
+    # The coordinates act along the column (x) axis of each state.
+    x_weights = np.tile(x_pts, N)[:, None]
+    operators = [lambda B: B.reshape(N, N, -1)[:, ::-1].reshape(B.shape),
+                 lambda B: B.reshape(N, N, -1)[::-1, :].reshape(B.shape),
+                 lambda B: B.reshape(N, N, -1).transpose(1, 0, 2).reshape(B.shape),
+                 lambda B: x_weights**2*B,
+                 lambda B: x_weights*B]
+
+    e_vec = np.array(e_vec, dtype=float)
+    clusters = degenerate_clusters(e_values, tol)
+    for cluster in clusters:
+        groups = [cluster] if len(cluster) > 1 else []
+        for operator in operators:
+            split = []
+            for group in groups:
+                B = e_vec[:, group]
+                A = B.T @ operator(B)
+                w, U = eigh((A + A.T)/2)
+                e_vec[:, group] = B @ U
+                # States the operator does not tell apart stay together for the next one.
+                breaks = np.flatnonzero(np.diff(w) > 1e-8*max(np.max(np.abs(w)), 1.0)) + 1
+                split += [part for part in np.split(group, breaks) if len(part) > 1]
+            groups = split
+
+    # The first entry above half the largest is positive. Ties between mirror
+    # images of a large entry cannot flip it, the first of them always wins.
+    magnitudes = np.abs(e_vec)
+    first = np.argmax(magnitudes >= 0.5*magnitudes.max(axis=0), axis=0)
+    e_vec *= np.sign(e_vec[first, np.arange(e_vec.shape[1])])
+    return e_vec, clusters
+
+#-----------------------------------------------------------------------
+## Function: trim_states
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Cuts a block solved with GUARD_STATES extra states back to the states
+## asked for. Use it after canonical_basis.
+##----------------------------------------------------------------------
+## Input:
+## e_values         eigenvalues from smallest to largest
+## e_vec            eigenvectors, one per column
+## states           number of states to keep
+## clusters         the degenerate levels, from canonical_basis
+##----------------------------------------------------------------------
+## Output:
+## e_values         the first states eigenvalues
+## e_vec            the first states eigenvectors
+## cut              kept states of a level that reaches the end of the
+##                  solved block and may have partners past it, so their
+##                  basis is not canonical. Empty when every kept level
+##                  is whole.
+##----------------------------------------------------------------------
+def trim_states(e_values, e_vec, states, clusters):
+    cut = []
+    for cluster in clusters:
+        if cluster[0] < states and cluster[-1] == len(e_values) - 1:
+            cut = [int(n) for n in cluster if n < states]
+    return e_values[:states], e_vec[:, :states], cut
+
+#-----------------------------------------------------------------------
+## Function: symmetry_labels
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Sector of symmetry.py each state belongs to, from its parities under
+## x -> -x, y -> -y and x <-> y. Use it after canonical_basis, which
+## makes the states of a degenerate level parity states.
+##----------------------------------------------------------------------
+## Input:
+## e_vec            eigenvectors, one per column
+## N                number of points on each axis
+##----------------------------------------------------------------------
+## Output:
+## labels           list with 'A1', 'B1', 'B2', 'A2' or 'E' for every
+##                  state, or None where the state has no definite parity
+##                  (the potential is not symmetric)
+##----------------------------------------------------------------------
+def symmetry_labels(e_vec, N):
+    V = e_vec.reshape(N, N, -1)
+    norms = np.sum(np.abs(V)**2, axis=(0, 1))
+    parities = np.real([np.sum(V.conj()*V[:, ::-1], axis=(0, 1)),
+                        np.sum(V.conj()*V[::-1, :], axis=(0, 1)),
+                        np.sum(V.conj()*V.transpose(1, 0, 2), axis=(0, 1))])/norms
+    labels = []
+    for px, py, swap in np.round(parities, 6).T:
+        if abs(px) == 1 and abs(py) == 1 and px != py:
+            labels.append('E')
+        else:
+            labels.append(SECTOR_LABELS.get((px, py, swap)))
+    return labels
+
+#-----------------------------------------------------------------------
+## Function: nodal_domains
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Number of nodal domains (connected regions of one sign) of every
+## state. The states are stacked into one N x N x states volume and
+## labelled in one call. The structuring element only connects points
+## within the same state.
+##----------------------------------------------------------------------
+## Input:
+## e_vec            real eigenvectors, one per column
+## N                number of points on each axis
+## tol              amplitudes below tol times the largest of the state
+##                  count as zero
+##----------------------------------------------------------------------
+## Output:
+## domains          number of nodal domains of every state
+##----------------------------------------------------------------------
+def nodal_domains(e_vec, N, tol=NODAL_TOL):
+    V = np.real(e_vec).reshape(N, N, -1)
+    states = V.shape[2]
+    cutoff = tol*np.max(np.abs(V), axis=(0, 1))
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[:, :, 1] = ndimage.generate_binary_structure(2, 1)
+
+    domains = np.zeros(states, dtype=int)
+    plane = np.broadcast_to(np.arange(states), V.shape)
+    for sign in (1, -1):
+        labels, count = ndimage.label(sign*V > cutoff, structure=structure)
+        # Every label lies in one state, so counting the labels per state counts its domains.
+        state_of_label = np.zeros(count + 1, dtype=int)
+        state_of_label[labels.ravel()] = plane.ravel()
+        domains += np.bincount(state_of_label[1:], minlength=states)
+    return domains
+
+#-----------------------------------------------------------------------
+## Function: state_observables
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Expectation values of the position observables and the nodal domain
+## counts of every state in the block.
+##----------------------------------------------------------------------
+## Input:
+## e_vec            eigenvectors, one per column
+## N                number of points on each axis
+## x                x coordinates, 1D axis, open grid or NxN array
+## y                y coordinates, same form as x
+##----------------------------------------------------------------------
+## Output:
+## observables      dict of arrays with one entry per state: x, y, x2,
+##                  y2, r, r2 and nodal_domains
+##----------------------------------------------------------------------
+def state_observables(e_vec, N, x, y):
+    x_pts, y_pts = grid_axes(x, y)
+    X, Y = x_pts[None, :], y_pts[:, None]
+    R2 = X**2 + Y**2
+    names = ('x', 'y', 'x2', 'y2', 'r', 'r2')
+    # One column per observable, laid out like a state.
+    weights = np.stack([np.broadcast_to(w, (N, N)).ravel() for w in (X, Y, X**2, Y**2, np.sqrt(R2), R2)], axis=1)
+
+    densities = np.abs(e_vec)**2
+    values = (weights.T @ densities)/densities.sum(axis=0)
+    observables = dict(zip(names, values))
+    observables.update(nodal_domains=nodal_domains(e_vec, N))
+    return observables
@@ -0,0 +1,166 @@
+#-----------------------------------------------------------------------
+#Module: parallel
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Thread level parallelism inside one process. SciPy applies a sparse
+## matrix with one thread, but both its CSR kernel and large NumPy array
+## operations release the GIL. Splitting a matvec into blocks of rows and
+## running the blocks in a thread pool therefore uses several cores
+## without copying the matrix or the vectors. linearalgebra builds its
+## threaded operators on the helpers here.
+##
+## The BLAS and LAPACK calls of the eigensolvers (the orthogonalization in
+## ARPACK, the block products in LOBPCG) run in the BLAS library's own
+## thread pool. blas_threads sets its size while a solve runs. That needs
+## threadpoolctl. Without it the size can only be set before Python
+## starts, with OMP_NUM_THREADS / OPENBLAS_NUM_THREADS / MKL_NUM_THREADS.
+##
+## Set SCHRODINGER_THREADS to a number to make it the default for every
+## solve that does not set its own.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## default_threads
+## blas_threads
+## blas_info
+## row_chunks
+## thread_pool
+## parallel_map
+##
+#-----------------------------------------------------------------------
+
+import contextlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None
+
+# Environment variable with the default number of threads.
+THREADS_ENV = 'SCHRODINGER_THREADS'
+
+# Thread pools by size, kept so a matvec does not start new threads every time.
+_pools = {}
+
+# Threads do not survive a fork. A worker process forked from one that had
+# pools (batch.py's process pool) would wait on them forever, so it starts
+# without any.
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_pools.clear)
+
+#-----------------------------------------------------------------------
+## Function: default_threads
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Number of threads set in the environment.
+##----------------------------------------------------------------------
+## Output:
+## threads          value of SCHRODINGER_THREADS, or None if it is not set
+##----------------------------------------------------------------------
+def default_threads():
+    value = os.environ.get(THREADS_ENV)
+    if not value:
+        return None
+    threads = int(value)
+    if threads < 1:
+        raise ValueError("{} must be at least 1, got {}.".format(THREADS_ENV, value))
+    return threads
+
+#-----------------------------------------------------------------------
+## Function: blas_threads
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Context manager that limits the BLAS/LAPACK (and OpenMP) thread pools
+## to a number of threads inside a with block.
+##----------------------------------------------------------------------
+## Input:
+## threads          number of threads, None leaves the pools as they are
+##----------------------------------------------------------------------
+## Output:
+## context          context manager. It does nothing when threads is
+##                  None or threadpoolctl is not installed
+##----------------------------------------------------------------------
+def blas_threads(threads):
+    if threads is None or threadpoolctl is None:
+        return contextlib.nullcontext()
+    return threadpoolctl.threadpool_limits(limits=threads)
+
+#-----------------------------------------------------------------------
+## Function: blas_info
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## The BLAS and OpenMP libraries in use with their thread counts, stored
+## next to benchmark results.
+##----------------------------------------------------------------------
+## Output:
+## info             list of dicts from threadpoolctl, or None without it
+##----------------------------------------------------------------------
+def blas_info():
+    if threadpoolctl is None:
+        return None
+    return [dict(api=pool['user_api'], library=pool['internal_api'], version=pool.get('version'),
+                 threads=pool['num_threads']) for pool in threadpoolctl.threadpool_info()]
+
+#-----------------------------------------------------------------------
+## Function: row_chunks
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Splits n rows into contiguous blocks of nearly equal size.
+##----------------------------------------------------------------------
+## Input:
+## n                number of rows
+## chunks           number of blocks wanted
+##----------------------------------------------------------------------
+## Output:
+## bounds           list of (start, stop), at most n of them
+##----------------------------------------------------------------------
+def row_chunks(n, chunks):
+    edges = [round(i*n/chunks) for i in range(chunks + 1)]
+    return [(start, stop) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+#-----------------------------------------------------------------------
+## Function: thread_pool
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Shared pool of a given size, started the first time it is needed.
+##----------------------------------------------------------------------
+## Input:
+## threads          number of threads
+##----------------------------------------------------------------------
+## Output:
+## pool             ThreadPoolExecutor
+##----------------------------------------------------------------------
+def thread_pool(threads):
+    if threads not in _pools:
+        _pools[threads] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='matvec')
+    return _pools[threads]
+
+#-----------------------------------------------------------------------
+## Function: parallel_map
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Calls a function on every item in a thread pool. With one thread it is
+## a plain loop in the calling thread.
+##----------------------------------------------------------------------
+## Input:
+## function         function of one item
+## items            list of items
+## threads          number of threads
+##----------------------------------------------------------------------
+## Output:
+## results          list of the results in the order of items
+##----------------------------------------------------------------------
+def parallel_map(function, items, threads):
+    if threads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    # list() re-raises anything that went wrong in a thread.
+    return list(thread_pool(threads).map(function, items))
@@ -0,0 +1,389 @@
+#-----------------------------------------------------------------------
+#Module: potentials
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Registry of potentials. Every potential is an object with a name, a
+## function evaluating it on the grid and a dict of parameters with their
+## defaults, so create_potential, the batch sweeps and the cache work the
+## same for the built in potentials (registered in quantum.py), potentials
+## given as a formula and potentials tabulated in a .npy file.
+##
+## Evaluation is done in chunks of rows so a huge grid never needs more
+## than a chunk sized temporary per operation in the formula. Formulas
+## are evaluated with numexpr when it is installed, which needs no
+## temporaries at all. Formulas come from sweep files, so before either
+## evaluates them they are checked to be nothing but arithmetic on the
+## coordinates and parameters and calls of EXPRESSION_FUNCTIONS.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## Potential
+## ExpressionPotential
+## TabulatedPotential
+## evaluate_chunked
+## check_expression
+## register
+## get_potential
+## potential_names
+## define_potential
+##
+#-----------------------------------------------------------------------
+
+import ast
+import os
+
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+from linearalgebra import grid_axes
+
+# numexpr is optional, formulas fall back to NumPy.
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# Grid points evaluated at once. 2**20 doubles is 8 MB per temporary.
+CHUNK_POINTS = 2**20
+
+# NumPy functions a formula can use when numexpr is not installed, the
+# same set numexpr understands.
+EXPRESSION_FUNCTIONS = {name: getattr(np, name) for name in
+                        ('sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2', 'sinh', 'cosh',
+                         'tanh', 'exp', 'log', 'log10', 'sqrt', 'abs', 'where')}
+
+# Names the evaluation arguments use, no parameter can have them. A
+# formula also sees r.
+RESERVED_NAMES = ('x', 'y', 'L', '_chunk')
+
+# Syntax a formula may use: numbers, names, arithmetic, comparisons and
+# the & | ~ that numexpr uses for conditions in where().
+EXPRESSION_NODES = (ast.Expression, ast.Constant, ast.Name, ast.Load, ast.Call, ast.BinOp, ast.UnaryOp,
+                    ast.Compare, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.UAdd, ast.USub,
+                    ast.Invert, ast.BitAnd, ast.BitOr, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq)
+
+_registry = {}
+
+#-----------------------------------------------------------------------
+## Function: evaluate_chunked
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Evaluates function(x, y) on a grid a block of rows at a time, writing
+## into one preallocated output array.
+##----------------------------------------------------------------------
+## Input:
+## function         function of the x and y coordinate arrays
+## x, y             coordinates, an open grid (Grid.x and Grid.y), the 1D
+##                  axes or full NxN arrays
+## chunk            number of grid points per block
+##----------------------------------------------------------------------
+## Output:
+## v                array of the broadcast shape of x and y
+##----------------------------------------------------------------------
+def evaluate_chunked(function, x, y, chunk=CHUNK_POINTS):
+    x, y = np.asarray(x), np.asarray(y)
+    if x.ndim == 1 and y.ndim == 1:
+        # Two axes, open them up into a grid.
+        x, y = x[np.newaxis, :], y[:, np.newaxis]
+    shape = np.broadcast_shapes(x.shape, y.shape)
+    if len(shape) < 2:
+        return np.broadcast_to(function(x, y), shape).astype(float)
+
+    v = np.empty(shape)
+    rows = max(1, chunk//max(1, shape[1]))
+    for start in range(0, shape[0], rows):
+        block = slice(start, start + rows)
+        # Broadcast axes of length 1 are the same for every block.
+        xb = x[block] if x.shape[0] > 1 else x
+        yb = y[block] if y.shape[0] > 1 else y
+        v[block] = function(xb, yb)
+    return v
+
+#-----------------------------------------------------------------------
+## Function: check_expression
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Parses a formula and makes sure it can only compute a number. Emptying
+## __builtins__ for eval is not enough, attribute access alone reaches
+## every class in the interpreter, so anything but plain arithmetic,
+## comparisons, the given names and calls of EXPRESSION_FUNCTIONS is
+## rejected.
+##----------------------------------------------------------------------
+## Input:
+## expression       the formula
+## names            names the formula may use (coordinates, parameters)
+##----------------------------------------------------------------------
+## Output:
+## tree             the parsed ast.Expression
+##----------------------------------------------------------------------
+def check_expression(expression, names):
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise ValueError("Formula {!r} is not a valid expression: {}".format(expression, e.msg))
+    for node in ast.walk(tree):
+        if not isinstance(node, EXPRESSION_NODES):
+            raise ValueError("Formula {!r} may only use arithmetic, comparisons and the functions {}, not {}.".format(
+                expression, sorted(EXPRESSION_FUNCTIONS), type(node).__name__))
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, complex)):
+            raise ValueError("Formula {!r} may only contain numbers, not {!r}.".format(expression, node.value))
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in EXPRESSION_FUNCTIONS or node.keywords:
+                raise ValueError("Formula {!r} may only call the functions {} with plain arguments.".format(
+                    expression, sorted(EXPRESSION_FUNCTIONS)))
+        elif isinstance(node, ast.Name) and node.id not in names and node.id not in EXPRESSION_FUNCTIONS:
+            raise ValueError("Formula {!r} uses an unknown name {}. It can use {}.".format(
+                expression, node.id, sorted(names)))
+    return tree
+
+#-----------------------------------------------------------------------
+## Class: Potential
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## A named, parameterized potential.
+##----------------------------------------------------------------------
+## Input:
+## name             name it is registered under, e.g. 'O'
+## function         function(x, y, L, **params) giving V on the grid
+## defaults         dict of the parameters and their default values,
+##                  none of them named like the arguments in RESERVED_NAMES
+## separable        function(x_pts, y_pts, L, **params) giving the 1D
+##                  pieces (vx, vy) if V(x,y) = Vx(x) + Vy(y) (optional)
+## description      one line shown to the user
+##----------------------------------------------------------------------
+class Potential:
+
+    def __init__(self, name, function, defaults=None, separable=None, description=''):
+        self.name = name
+        self.function = function
+        self.defaults = dict(defaults or {})
+        reserved = sorted(set(self.defaults) & set(self.reserved_names()))
+        if reserved:
+            raise ValueError("Potential {} cannot have parameters named {}, those names are reserved.".format(name, reserved))
+        self.separable = separable
+        self.description = description
+
+    def reserved_names(self):
+        return RESERVED_NAMES
+
+    def parameters(self, **params):
+        unknown = set(params) - set(self.defaults)
+        if unknown:
+            raise ValueError("Potential {} has no parameters {}. It takes {}.".format(
+                self.name, sorted(unknown), sorted(self.defaults)))
+        return dict(self.defaults, **params)
+
+    def evaluate(self, x, y, L, *, _chunk=CHUNK_POINTS, **params):
+        # The block size is keyword only and named so it never shadows a parameter.
+        values = self.parameters(**params)
+        return evaluate_chunked(lambda xb, yb: self.function(xb, yb, L, **values), x, y, _chunk)
+
+    def split(self, x_pts, y_pts, L, **params):
+        if self.separable is None:
+            return None
+        return self.separable(x_pts, y_pts, L, **self.parameters(**params))
+
+    def fingerprint(self, **params):
+        # Everything the values depend on besides the grid, for cache keys.
+        return dict(name=self.name, **self.parameters(**params))
+
+    def __repr__(self):
+        return "{}({!r}, {})".format(type(self).__name__, self.name, self.defaults)
+
+#-----------------------------------------------------------------------
+## Class: ExpressionPotential
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Potential given as a formula in x, y, r = sqrt(x**2 + y**2), L and its
+## parameters, e.g. "a*(r - r0)**2" with defaults {"a": 1, "r0": 2}.
+##----------------------------------------------------------------------
+## Input:
+## name             name it is registered under
+## expression       the formula
+## defaults         dict of the parameters and their default values
+## description      one line shown to the user
+##----------------------------------------------------------------------
+class ExpressionPotential(Potential):
+
+    def __init__(self, name, expression, defaults=None, description=''):
+        self.expression = expression
+        super().__init__(name, self.formula, defaults, description=description or expression)
+        # Checked before numexpr or eval ever see it, then compiled once so
+        # evaluating it is just the arithmetic.
+        tree = check_expression(expression, set(self.defaults) | {'x', 'y', 'r', 'L'})
+        self.code = compile(tree, '<potential {}>'.format(name), 'eval')
+
+    def reserved_names(self):
+        return RESERVED_NAMES + ('r',)
+
+    def formula(self, x, y, L, **params):
+        names = dict(params, x=x, y=y, L=L)
+        if numexpr is not None:
+            if 'r' in self.code.co_names:
+                names['r'] = numexpr.evaluate('sqrt(x**2 + y**2)', local_dict=dict(x=x, y=y))
+            return numexpr.evaluate(self.expression, local_dict=names)
+        if 'r' in self.code.co_names:
+            names['r'] = np.sqrt(x**2 + y**2)
+        return eval(self.code, {'__builtins__': {}, **EXPRESSION_FUNCTIONS}, names)
+
+    def fingerprint(self, **params):
+        return dict(super().fingerprint(**params), expression=self.expression)
+
+#-----------------------------------------------------------------------
+## Class: TabulatedPotential
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Potential read from a 2D .npy table, e.g. from an external code. The
+## file is memory mapped so only the parts needed are read. Table entry
+## [i, j] is the value at y = y_i, x = x_j with the points evenly spaced
+## from -extent to extent on both axes. If the grid points are exactly the
+## table points the values are copied, otherwise they are interpolated
+## linearly, block by block. Outside the table the potential is `fill`.
+##----------------------------------------------------------------------
+## Input:
+## name             name it is registered under
+## path             .npy file holding the MxM table
+## extent           half width covered by the table
+## fill             value outside the table
+## description      one line shown to the user
+##----------------------------------------------------------------------
+class TabulatedPotential(Potential):
+
+    def __init__(self, name, path, extent, fill=0.0, description=''):
+        self.path = path
+        self.extent = extent
+        self.fill = fill
+        self.table = np.load(path, mmap_mode='r')
+        if self.table.ndim != 2 or self.table.shape[0] != self.table.shape[1]:
+            raise ValueError("Tabulated potential {} must be a square 2D array, got shape {}.".format(path, self.table.shape))
+        self.pts = np.linspace(-extent, extent, self.table.shape[0])
+        super().__init__(name, self.lookup, description=description or path)
+
+    def evaluate(self, x, y, L, *, _chunk=CHUNK_POINTS, **params):
+        self.parameters(**params)
+        x_pts, y_pts = grid_axes(x, y)
+        if len(x_pts) == len(self.pts) and np.allclose(x_pts, self.pts) and np.allclose(y_pts, self.pts):
+            return np.array(self.table, dtype=float)
+        return super().evaluate(x, y, L, _chunk=_chunk, **params)
+
+    def lookup(self, x, y, L):
+        interp = RegularGridInterpolator((self.pts, self.pts), self.table, bounds_error=False, fill_value=self.fill)
+        x, y = np.broadcast_arrays(x, y)
+        return interp(np.stack([y.ravel(), x.ravel()], axis=-1)).reshape(x.shape)
+
+    def fingerprint(self, **params):
+        # Hashing a huge table on every lookup would defeat the memory map, its
+        # size and modification time identify the version of the file instead.
+        stat = os.stat(self.path)
+        return dict(super().fingerprint(**params), path=os.path.abspath(self.path), extent=self.extent,
+                    fill=self.fill, size=stat.st_size, mtime=stat.st_mtime)
+
+    def __getstate__(self):
+        # Worker processes reopen the memory map instead of pickling the table.
+        state = dict(self.__dict__)
+        del state['table'], state['function']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.table = np.load(self.path, mmap_mode='r')
+        self.function = self.lookup
+
+#-----------------------------------------------------------------------
+## Function: register
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Adds a potential to the registry so it can be used by name everywhere.
+##----------------------------------------------------------------------
+## Input:
+## potential        Potential to add
+## replace          allow replacing a potential with the same name
+##----------------------------------------------------------------------
+## Output:
+## potential        the potential, so register can be used inline
+##----------------------------------------------------------------------
+def register(potential, replace=False):
+    if potential.name in _registry and not replace:
+        raise ValueError("A potential named {} is already registered.".format(potential.name))
+    _registry[potential.name] = potential
+    return potential
+
+#-----------------------------------------------------------------------
+## Function: get_potential
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Looks a potential up by name.
+##----------------------------------------------------------------------
+## Input:
+## name             registered name, or a Potential which is returned as is
+##----------------------------------------------------------------------
+## Output:
+## potential        the Potential
+##----------------------------------------------------------------------
+def get_potential(name):
+    if isinstance(name, Potential):
+        return name
+    if name not in _registry:
+        raise ValueError("Unknown potential {}. Registered potentials are {}.".format(name, potential_names()))
+    return _registry[name]
+
+#-----------------------------------------------------------------------
+## Function: potential_names
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Names of all registered potentials.
+##----------------------------------------------------------------------
+## Input:
+## N/A
+##----------------------------------------------------------------------
+## Output:
+## names            list of names in the order they were registered
+##----------------------------------------------------------------------
+def potential_names():
+    return list(_registry)
+
+#-----------------------------------------------------------------------
+## Function: define_potential
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Builds and registers a potential from a JSON style description, so
+## sweep files can define their own potentials:
+##   {"expression": "a*(r - r0)**2", "params": {"a": 1, "r0": 2}}
+##   {"file": "table.npy", "extent": 10, "fill": 0}
+## A name can be defined again only with the same description (e.g. in
+## every worker process of a sweep), so a definition never replaces a
+## built in potential or a different definition.
+##----------------------------------------------------------------------
+## Input:
+## name             name to register it under
+## spec             dict as above
+##----------------------------------------------------------------------
+## Output:
+## potential        the registered Potential
+##----------------------------------------------------------------------
+def define_potential(name, spec):
+    if name in _registry:
+        existing = _registry[name]
+        if getattr(existing, 'definition', None) is None:
+            raise ValueError("Potential {} is built in and cannot be redefined.".format(name))
+        if existing.definition != spec:
+            raise ValueError("Potential {} is already defined differently as {}.".format(name, existing.definition))
+        return existing
+    if 'expression' in spec:
+        potential = ExpressionPotential(name, spec['expression'], spec.get('params'), spec.get('description', ''))
+    elif 'file' in spec:
+        potential = TabulatedPotential(name, spec['file'], spec['extent'], spec.get('fill', 0.0),
+                                       spec.get('description', ''))
+    else:
+        raise ValueError("Potential {} needs either an 'expression' or a 'file'.".format(name))
+    potential.definition = dict(spec)
+    return register(potential)
@@ -0,0 +1,200 @@
+#-----------------------------------------------------------------------
+#Module: profiling
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Per stage instrumentation of the solve pipeline. Each stage (creategrid,
+## create_potential, create_kinetic, create_hamiltonian, eigen_solve,
+## rendering) is wrapped in stage(name), which records its wall time, the
+## resident memory before and after it and its peak resident memory, plus
+## anything the caller adds, e.g. the matvec count of eigen_solve's stats.
+##
+## The hook is off by default and stage() then costs nothing. main.py
+## switches it on when SCHRODINGER_PROFILE is set in the environment, a
+## sweep file with "profile": true switches it on in batch runs, and the
+## pipeline benchmark uses a Profiler directly.
+##
+## On Linux the peak is reset at the start of every stage (through
+## /proc/self/clear_refs) so it is the peak of that stage alone. Elsewhere
+## only the peak of the whole process so far is available, stages report
+## it with stage_peak False. Stages are not meant to be nested.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## memory_usage
+## reset_peak
+## Profiler
+## enable
+## disable
+## stage
+##
+#-----------------------------------------------------------------------
+
+import contextlib
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Environment variable that switches profiling on in main.py.
+PROFILE_ENV = 'SCHRODINGER_PROFILE'
+
+# Profiler of this process while the hook is on, None while it is off.
+_active = None
+
+#-----------------------------------------------------------------------
+## Function: memory_usage
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Current and peak resident memory of this process.
+##----------------------------------------------------------------------
+## Input:
+## N/A
+##----------------------------------------------------------------------
+## Output:
+## rss_mb           resident memory now in MB (None if unknown)
+## peak_rss_mb      peak resident memory since the last reset_peak (or
+##                  since the process started) in MB
+##----------------------------------------------------------------------
+def memory_usage():
+    rss, peak = None, None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1])/1024
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1])/1024
+    except OSError:
+        pass
+    if peak is None and resource is not None:
+        # ru_maxrss is in kB on Linux and in bytes on macOS, this is only reached off Linux.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024**2
+    return rss, peak
+
+#-----------------------------------------------------------------------
+## Function: reset_peak
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Resets the peak resident memory to the current one, where the kernel
+## allows it.
+##----------------------------------------------------------------------
+## Input:
+## N/A
+##----------------------------------------------------------------------
+## Output:
+## reset            True if the peak was reset
+##----------------------------------------------------------------------
+def reset_peak():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+#-----------------------------------------------------------------------
+## Class: Profiler
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Collects one record per stage. The records are plain dicts so they go
+## straight into JSON.
+##----------------------------------------------------------------------
+## Input:
+## N/A
+##----------------------------------------------------------------------
+class Profiler:
+
+    def __init__(self):
+        self.records = []
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        # The record is handed to the caller, who can add to it inside the with block.
+        record = dict(stage=name, **info)
+        stage_peak = reset_peak()
+        rss_before, _ = memory_usage()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - start
+            rss_after, peak = memory_usage()
+            record.update(time=elapsed, rss_before_mb=rss_before, rss_after_mb=rss_after,
+                          peak_rss_mb=peak, stage_peak=stage_peak)
+            self.records.append(record)
+
+    def total(self):
+        return sum(record['time'] for record in self.records)
+
+    def report(self):
+        lines = ["{:<20} {:>10} {:>12} {:>10}".format('stage', 'time s', 'peak RSS MB', 'matvecs')]
+        for record in self.records:
+            peak = record['peak_rss_mb']
+            lines.append("{:<20} {:10.4f} {:>12} {:>10}".format(
+                record['stage'], record['time'], '-' if peak is None else '{:.1f}'.format(peak),
+                record.get('matvecs', '-')))
+        lines.append("{:<20} {:10.4f}".format('total', self.total()))
+        return '\n'.join(lines)
+
+#-----------------------------------------------------------------------
+## Function: enable
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Switches the instrumentation hook on for this process.
+##----------------------------------------------------------------------
+## Input:
+## N/A
+##----------------------------------------------------------------------
+## Output:
+## profiler         the Profiler every stage() call now records into
+##----------------------------------------------------------------------
+def enable():
+    global _active
+    _active = Profiler()
+    return _active
+
+#-----------------------------------------------------------------------
+## Function: disable
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Switches the instrumentation hook off.
+##----------------------------------------------------------------------
+## Input:
+## N/A
+##----------------------------------------------------------------------
+## Output:
+## profiler         the Profiler that was recording, or None
+##----------------------------------------------------------------------
+def disable():
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+#-----------------------------------------------------------------------
+## Function: stage
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Context manager around one stage of the pipeline. Records into the
+## active Profiler if the hook is on and does nothing otherwise.
+##----------------------------------------------------------------------
+## Input:
+## name             name of the stage
+## info             extra entries for the record (e.g. N=200)
+##----------------------------------------------------------------------
+## Output:
+## record           dict the caller can add entries to, discarded if the
+##                  hook is off
+##----------------------------------------------------------------------
+def stage(name, **info):
+    if _active is None:
+        return contextlib.nullcontext({})
+    return _active.stage(name, **info)
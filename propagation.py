@@ -0,0 +1,259 @@
+#-----------------------------------------------------------------------
+#Module: propagation
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Time evolution i dpsi/dt = H psi of a wavepacket with the same
+## hamiltonian create_hamiltonian builds, without diagonalizing it. Three
+## propagators, all with advance(psi, steps):
+##   split-operator   Strang splitting exp(-iV dt/2) exp(-iT dt) exp(-iV dt/2).
+##                    The kinetic part is exact in the basis that
+##                    diagonalizes the Laplacian (sine transform with walls,
+##                    FFT on a periodic grid), so a step is two transforms
+##                    and three pointwise products. Error O(dt**2).
+##   crank-nicolson   (1 + i dt H/2) psi' = (1 - i dt H/2) psi. Unitary for
+##                    any dt, error O(dt**2). The left hand side is factorized
+##                    once with splu and every step is one matvec and two
+##                    triangular solves.
+##   krylov           exp(-i H t) psi with expm_multiply. Exact up to the
+##                    solver tolerance, so the snapshot stride is covered
+##                    in a single call instead of step by step.
+## On an absorbing grid the complex absorbing potential is included in all
+## three and the norm decays as the packet leaves the box.
+##
+## Snapshots are written to an eigenvector store (see eigenstore.py), one
+## per stride, with the time of each snapshot where an eigenvalue would
+## go. They can be read back and drawn like eigenvectors.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## gaussian_packet
+## SplitOperator
+## CrankNicolson
+## KrylovPropagator
+## make_propagator
+## propagate
+##
+#-----------------------------------------------------------------------
+
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.fft import dstn, fftn, ifftn
+from scipy.sparse.linalg import splu, expm_multiply
+from linearalgebra import stencil_symbol
+from quantum import create_kinetic, create_hamiltonian, absorbing_potential
+from eigenstore import EigenWriter
+
+# Names make_propagator takes.
+PROPAGATORS = ('split-operator', 'crank-nicolson', 'krylov')
+
+#-----------------------------------------------------------------------
+## Function: gaussian_packet
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Gaussian wavepacket exp(-|r - r0|**2/(4 sigma**2) + i k.r).
+##----------------------------------------------------------------------
+## Input:
+## grid             Grid from creategrid
+## x0, y0           centre of the packet
+## kx, ky           mean momentum
+## sigma            width of the packet (of |psi|**2)
+##----------------------------------------------------------------------
+## Output:
+## psi              N**2 complex vector of norm 1, laid out like a column
+##                  of e_vec
+##----------------------------------------------------------------------
+def gaussian_packet(grid, x0=0.0, y0=0.0, kx=0.0, ky=0.0, sigma=1.0):
+    # On the open grid every factor is 1D until the product.
+    psi = (np.exp(-(grid.y - y0)**2/(4*sigma**2) + 1j*ky*grid.y)
+           *np.exp(-(grid.x - x0)**2/(4*sigma**2) + 1j*kx*grid.x))
+    psi = psi.reshape(grid.N**2)
+    return psi/np.linalg.norm(psi)
+
+#-----------------------------------------------------------------------
+## Class: SplitOperator
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Split-operator FFT propagator. Consecutive half steps of the potential
+## are merged, so n steps cost n kinetic steps and n + 1 potential phases.
+##----------------------------------------------------------------------
+## Input:
+## potential        NxN potential energy matrix
+## grid             Grid from creategrid
+## dt               time step
+## order            kinetic energy order of create_kinetic, 2, 4, 6, 8 or
+##                  'spectral'
+##----------------------------------------------------------------------
+class SplitOperator:
+
+    def __init__(self, potential, grid, dt, order=2):
+        self.N = grid.N
+        self.dt = dt
+        self.periodic = grid.periodic
+        if grid.bc == 'absorbing':
+            potential = potential - 1j*absorbing_potential(grid)
+        self.full = np.exp(-1j*dt*potential)
+        self.half = np.exp(-0.5j*dt*potential)
+
+        # Same -1/(2 dx**2) in front of the laplacian as create_kinetic.
+        lam = -stencil_symbol(grid.N, order, grid.periodic)/(2*grid.dx**2)
+        self.kinetic = np.exp(-1j*dt*(lam[:, None] + lam[None, :]))
+
+    def kinetic_step(self, psi):
+        if self.periodic:
+            return ifftn(fftn(psi)*self.kinetic)
+        # With norm='ortho' the type 1 DST is its own inverse.
+        return dstn(dstn(psi, type=1, norm='ortho')*self.kinetic, type=1, norm='ortho')
+
+    def advance(self, psi, steps):
+        if steps == 0:
+            return psi
+        psi = np.asarray(psi, dtype=complex).reshape(self.N, self.N)*self.half
+        for n in range(steps):
+            psi = self.kinetic_step(psi)
+            psi *= self.full if n < steps - 1 else self.half
+        return psi.reshape(self.N**2)
+
+#-----------------------------------------------------------------------
+## Class: CrankNicolson
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Crank-Nicolson propagator. 1 + i dt H/2 is factorized once here and
+## the factorization is used for every step.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      sparse hamiltonian from create_hamiltonian
+## dt               time step
+##----------------------------------------------------------------------
+class CrankNicolson:
+
+    def __init__(self, hamiltonian, dt):
+        if not sparse.issparse(hamiltonian):
+            raise ValueError("Crank-Nicolson needs an assembled sparse Hamiltonian to factorize.")
+        self.dt = dt
+        identity = sparse.identity(hamiltonian.shape[0], dtype=complex)
+        self.explicit = sparse.csr_matrix(identity - 0.5j*dt*hamiltonian)
+        self.lu = splu(sparse.csc_matrix(identity + 0.5j*dt*hamiltonian))
+
+    def advance(self, psi, steps):
+        psi = np.asarray(psi, dtype=complex).ravel()
+        for _ in range(steps):
+            psi = self.lu.solve(self.explicit @ psi)
+        return psi
+
+#-----------------------------------------------------------------------
+## Class: KrylovPropagator
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Exact propagator exp(-i H t) from expm_multiply. advance covers all the
+## steps in one call.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      hamiltonian from create_hamiltonian
+## dt               time step
+##----------------------------------------------------------------------
+class KrylovPropagator:
+
+    def __init__(self, hamiltonian, dt):
+        if not sparse.issparse(hamiltonian):
+            raise ValueError("Krylov propagation needs an assembled sparse Hamiltonian.")
+        self.dt = dt
+        self.generator = sparse.csr_matrix(-1j*hamiltonian)
+
+    def advance(self, psi, steps):
+        psi = np.asarray(psi, dtype=complex).ravel()
+        if steps == 0:
+            return psi
+        return expm_multiply(self.generator*(steps*self.dt), psi)
+
+#-----------------------------------------------------------------------
+## Function: make_propagator
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Builds a propagator for a potential on a grid. Crank-Nicolson and
+## Krylov use the hamiltonian of create_hamiltonian, split-operator the
+## same potential and kinetic energy order.
+##----------------------------------------------------------------------
+## Input:
+## method           one of PROPAGATORS
+## potential        NxN potential energy matrix
+## grid             Grid from creategrid
+## dt               time step
+## order            finite difference order 2, 4, 6 or 8 (or 'spectral'
+##                  for split-operator)
+##----------------------------------------------------------------------
+## Output:
+## propagator       object with advance(psi, steps)
+##----------------------------------------------------------------------
+def make_propagator(method, potential, grid, dt, order=2):
+    if method == 'split-operator':
+        return SplitOperator(potential, grid, dt, order)
+    if method not in PROPAGATORS:
+        raise ValueError("Unknown propagator {}. Use one of {}.".format(method, PROPAGATORS))
+    hamiltonian = create_hamiltonian(potential, create_kinetic(grid, order), grid)
+    if method == 'crank-nicolson':
+        return CrankNicolson(hamiltonian, dt)
+    return KrylovPropagator(hamiltonian, dt)
+
+#-----------------------------------------------------------------------
+## Function: propagate
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Evolves a wavefunction for a number of steps, keeping a snapshot every
+## stride steps (and of the start).
+##----------------------------------------------------------------------
+## Input:
+## propagator       from make_propagator
+## psi0             starting N**2 vector (or NxN array)
+## steps            number of time steps
+## stride           steps between snapshots
+## path             eigenvector store the snapshots stream to, or None to
+##                  keep only the last state
+## metadata         dict of JSON serializable parameters for the store
+## stats            dict filled with steps, snapshots, time, steps per
+##                  second and the norm at every snapshot (optional)
+##----------------------------------------------------------------------
+## Output:
+## psi              N**2 vector at the final time
+##----------------------------------------------------------------------
+def propagate(propagator, psi0, steps, stride=1, path=None, metadata=None, stats=None):
+    if stride < 1:
+        raise ValueError("The snapshot stride must be at least 1 step.")
+    psi = np.asarray(psi0, dtype=complex).ravel()
+    N = int(round(np.sqrt(psi.size)))
+    dt = propagator.dt
+
+    # Snapshot k is at step k*stride, plus the last step if stride does not divide steps.
+    marks = list(range(0, steps + 1, stride))
+    if marks[-1] != steps:
+        marks.append(steps)
+    writer = None
+    if path is not None:
+        meta = dict(metadata or {}, kind='snapshots', dt=dt, stride=stride, steps=steps)
+        writer = EigenWriter(path, N, len(marks), meta, dtype=complex)
+        writer.write(0, 0.0, psi)
+
+    norms = [float(np.linalg.norm(psi))]
+    start = time.perf_counter()
+    for k in range(1, len(marks)):
+        psi = propagator.advance(psi, marks[k] - marks[k - 1])
+        norms.append(float(np.linalg.norm(psi)))
+        if writer is not None:
+            # The time goes where an eigenvalue would.
+            writer.write(k, marks[k]*dt, psi)
+    elapsed = time.perf_counter() - start
+    if writer is not None:
+        writer.close()
+
+    if stats is not None:
+        stats.update(propagator=type(propagator).__name__, steps=steps, snapshots=len(marks), time=elapsed,
+                     steps_per_second=steps/elapsed if elapsed > 0 else float('inf'), norms=norms)
+    return psi
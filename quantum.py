@@ -9,17 +9,21 @@
 ##
 ## Included functions:
 ## create_potential
+## separable_potential 
 ## oscillator 
 ## inf_well
 ## gaussian 
 ## hydrogen
+## absorbing_potential 
 ## create_kinetic
 ## create_hamiltonian 
+## create_hamiltonian_operator 
 ##
 #----------------------------------------------------------------------- 
 
 import numpy as np 
-from linearalgebra import create_2d_lap 
+from linearalgebra import create_2d_lap, StencilOperator 
+from potentials import Potential, register, get_potential, potential_names 
 from scipy import sparse 
 
 #-----------------------------------------------------------------------
@@ -28,37 +32,55 @@ from scipy import sparse
 ## By: Nathan Crawford
 ##
 ## Creates the potential energy matrix based off which potential the user 
-## selected. 
+## selected. The potentials are looked up in the registry of potentials.py, 
+## so anything registered there (the four below, formulas and tables) 
+## works the same. 
 ##----------------------------------------------------------------------
 ## Input:
-## x                points from -L to L on x axis
-## y                points from -L to L on y axis
+## x                points from -L to L on x axis, Grid.x (open grid), the 1D 
+##                  axis or a full NxN array 
+## y                points from -L to L on y axis, same form as x 
 ## L                length of the potential 
-## potential_inp    character representing the user input for which potential to use.
+## potential_inp    name of a registered potential (e.g. 'O') or a Potential 
+## params           parameters of the potential, e.g. width=0.3 for 'G'. 
+##                  Parameters not given keep their defaults. 
 ##----------------------------------------------------------------------
 ## Output: 
 ## potential        potential energy matrix   
 ##----------------------------------------------------------------------
-def create_potential(x, y, L, potential_inp):
+def create_potential(x, y, L, potential_inp, **params):
 
-    # Create potential energy matrix based off what the user inputted
-    
-    if(potential_inp == 'O'):
-        potential = oscillator(x, y) 
-    elif(potential_inp == 'I'): 
-        potential = inf_well(x, y) 
-    elif(potential_inp == 'G'): 
-        potential = gaussian(x, y, L) 
-    elif(potential_inp == 'H'): 
-        potential = hydrogen(x, y) 
-    
-    # Realistically the program shouldn't get here due to the checks in read_input but 
-    # this is a decent failsafe just in case.
-    else: 
-        print(" \n No potential input detected. Exiting program. \n") 
-        quit()
+    # Unknown names raise a ValueError. read_input already checks the name, 
+    # this is the failsafe for everything else calling in here. 
+    potential = get_potential(potential_inp).evaluate(x, y, L, **params) 
     return potential
 
+#-----------------------------------------------------------------------
+## Function: separable_potential 
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Gives the 1D pieces of a separable potential V(x,y) = Vx(x) + Vy(y) so 
+## separable_solve can be used instead of the full 2D solve. Each 
+## potential declares when it is registered whether it is separable. 
+##----------------------------------------------------------------------
+## Input:
+## grid             Grid from creategrid 
+## potential_inp    name of a registered potential or a Potential 
+## params           parameters of the potential 
+##----------------------------------------------------------------------
+## Output: 
+## vx, vy           1D potentials along x and y, or None if the potential 
+##                  is not separable 
+##----------------------------------------------------------------------
+def separable_potential(grid, potential_inp, **params): 
+
+    # The complex absorbing potential of an absorbing grid does not split 
+    # (it is largest in the corners), whatever the real potential does. 
+    if grid.bc == 'absorbing': 
+        return None 
+    return get_potential(potential_inp).split(grid.x_pts, grid.y_pts, grid.L, **params) 
+
 #-----------------------------------------------------------------------
 ## Function: oscillator
 #-----------------------------------------------------------------------
@@ -69,12 +91,16 @@ def create_potential(x, y, L, potential_inp):
 ## Input:
 ## x                points from -L to L on x axis
 ## y                points from -L to L on y axis
+## omega            angular frequency 
 ##----------------------------------------------------------------------
 ## Output: 
 ## v                potential energy matrix   
 ##----------------------------------------------------------------------
-def oscillator(x, y):
-    v = (x**2 + y**2)/2
+def oscillator(x, y, omega=1.0):
+    # On an open grid x**2 and y**2 are 1D, only the sum is NxN and the 
+    # scaling is done in place on it. 
+    v = x**2 + y**2 
+    v *= omega**2/2 
     return v 
 
 #-----------------------------------------------------------------------
@@ -106,12 +132,15 @@ def inf_well(x, y):
 ## x                points from -L to L on x axis
 ## y                points from -L to L on y axis 
 ## L                length and width of potential grid
+## width            width of the gaussian relative to L 
 ##----------------------------------------------------------------------
 ## Output: 
 ## v                potential energy matrix   
 ##----------------------------------------------------------------------
-def gaussian(x, y, L): 
-    v = np.exp(-0.5*((x/L)**2 + (y/L)**2)/(0.2**2)) 
+def gaussian(x, y, L, width=0.2): 
+    v = (x/L)**2 + (y/L)**2 
+    v *= -0.5/width**2 
+    v = np.exp(v, out=v) 
     return v  
 
 #-----------------------------------------------------------------------
@@ -124,33 +153,88 @@ def gaussian(x, y, L):
 ## Input:
 ## x                points from -L to L on x axis
 ## y                points from -L to L on y axis
+## softening        shift of r that keeps v finite at the origin 
 ##----------------------------------------------------------------------
 ## Output: 
 ## v                potential energy matrix   
 ##----------------------------------------------------------------------
-def hydrogen(x, y): 
+def hydrogen(x, y, softening=0.0002): 
     
-    # Shift slightly to account for divergence issue.  
-    v = -1/(np.sqrt(x**2 + y**2) + 0.0002) 
+    # Shift slightly to account for divergence issue. Everything after the 
+    # sum of squares is done in place on one NxN array. 
+    v = x**2 + y**2 
+    np.sqrt(v, out=v) 
+    v += softening 
+    np.divide(-1, v, out=v) 
     return v 
 
+# The built in potentials. The oscillator splits into x**2/2 + y**2/2 and the 
+# square well is 0 + 0, the gaussian and hydrogen potentials do not split. 
+register(Potential('O', lambda x, y, L, omega: oscillator(x, y, omega), dict(omega=1.0), 
+                   lambda x, y, L, omega: (oscillator(x, 0, omega), oscillator(0, y, omega)), 
+                   "harmonic oscillator")) 
+register(Potential('I', lambda x, y, L: inf_well(x, y), None, 
+                   lambda x, y, L: (inf_well(x, 1), inf_well(1, y)), 
+                   "infinite square well")) 
+register(Potential('G', gaussian, dict(width=0.2), description="gaussian bump")) 
+register(Potential('H', lambda x, y, L, softening: hydrogen(x, y, softening), dict(softening=0.0002), 
+                   description="hydrogen like")) 
+
+#-----------------------------------------------------------------------
+## Function: absorbing_potential
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Imaginary part of the potential for absorbing boundaries. It is zero in 
+## the middle of the box and rises quadratically inside a layer next to the 
+## walls, so a wave moving outwards is damped before it reaches the wall 
+## instead of reflecting off it. The hamiltonian gets V - i*W. 
+##----------------------------------------------------------------------
+## Input:
+## grid             Grid from creategrid 
+## strength         height of W at the walls 
+## width            thickness of the absorbing layer relative to L 
+##----------------------------------------------------------------------
+## Output: 
+## w                NxN absorbing potential (real, positive) 
+##----------------------------------------------------------------------
+def absorbing_potential(grid, strength=1.0, width=0.2): 
+    layer = width*grid.L 
+
+    # Depth into the layer along each axis, 0 in the middle and 1 at the wall. 
+    def depth(pts): 
+        return np.clip((np.abs(pts) - (grid.L - layer))/layer, 0, 1) 
+    # depth is 1D on the open grid, only w itself is NxN. 
+    w = depth(grid.x)**2 + depth(grid.y)**2 
+    w *= strength 
+    return w 
+
 #-----------------------------------------------------------------------
 ## Function: create_kinetic
 #-----------------------------------------------------------------------
 ## By: Nathan Crawford
 ##
 ## Creates kinetic energy operator matrix. Refer to README on how this is 
-## defined. 
+## defined. The laplacian is divided by dx**2 so the energies are in 
+## physical units (hbar = m = 1) and do not depend on N. 
 ##----------------------------------------------------------------------
 ## Input:
-## N                discretized points from -L to L. 
+## grid             Grid from creategrid 
+## order            finite difference order 2, 4, 6 or 8, or 'spectral' 
+##                  for the sine basis kinetic operator 
 ##----------------------------------------------------------------------
 ## Output: 
 ## T                kinetic energy matrix   
 ##----------------------------------------------------------------------
-def create_kinetic(N): 
-    T = create_2d_lap(N) 
-    T = -1/2 * T 
+def create_kinetic(grid, order=2): 
+    N = grid.N 
+    scale = -1/(2*grid.dx**2) 
+
+    # The sine basis operator is dense so it is only ever applied matrix free. 
+    if order == 'spectral': 
+        return StencilOperator(N, np.zeros((N, N)), scale, order, grid.periodic) 
+    T = create_2d_lap(N, order, grid.periodic) 
+    T = scale * T 
     return T 
 
 #-----------------------------------------------------------------------
@@ -158,22 +242,58 @@ def create_kinetic(N):
 #-----------------------------------------------------------------------
 ## By: Nathan Crawford
 ##
-## Creates hamiltonian operator matrix  
+## Creates hamiltonian operator matrix. On an absorbing grid the complex 
+## absorbing potential is added here.  
 ##----------------------------------------------------------------------
 ## Input:
-## potential                points from -L to L on x axis
-## kinetic                  points from -L to L on y axis 
-## N                        
+## potential                potential energy matrix on the NxN grid 
+## kinetic                  kinetic energy matrix from create_kinetic 
+## grid                     Grid from creategrid 
 ##----------------------------------------------------------------------
 ## Output: 
-## v                        discretized points from -L to L.  
+## H                        hamiltonian matrix 
 ##----------------------------------------------------------------------
-def create_hamiltonian(potential, kinetic, N): 
+def create_hamiltonian(potential, kinetic, grid): 
+    N = grid.N 
+    if grid.bc == 'absorbing': 
+        potential = potential - 1j*absorbing_potential(grid) 
     
     # v right now is an NxN grid but if you recall how we defined the problem in the 
     # README, the potential energy matrix is really just N**2 entries on the diagonal. 
     # Therefore, we reshape it before adding it to the kinetic energy. 
 
+    # A matrix free kinetic operator just takes the potential onto its diagonal. 
+    if isinstance(kinetic, StencilOperator): 
+        return StencilOperator(N, kinetic.potential + potential, kinetic.scale, kinetic.order, kinetic.periodic, 
+                               kinetic.threads) 
+
     v = sparse.diags(potential.reshape(N**2), (0)) 
     H = kinetic + v 
-    return H 
\ No newline at end of file
+    return H 
+
+#-----------------------------------------------------------------------
+## Function: create_hamiltonian_operator
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Creates the hamiltonian as a matrix free LinearOperator. It gives the 
+## same eigenpairs as create_hamiltonian but never builds the N**2 x N**2 
+## kinetic, potential or hamiltonian matrices. 
+##----------------------------------------------------------------------
+## Input:
+## potential                potential energy matrix on the NxN grid 
+## grid                     Grid from creategrid 
+## order                    stencil order 2, 4, 6, 8 or 'spectral' 
+## threads                  number of threads of a matvec 
+##----------------------------------------------------------------------
+## Output: 
+## H                        hamiltonian operator 
+##----------------------------------------------------------------------
+def create_hamiltonian_operator(potential, grid, order=2, threads=1): 
+
+    if grid.bc == 'absorbing': 
+        potential = potential - 1j*absorbing_potential(grid) 
+
+    # Same -1/(2 dx**2) in front of the laplacian as create_kinetic. 
+    H = StencilOperator(grid.N, potential, -1/(2*grid.dx**2), order, grid.periodic, threads) 
+    return H 
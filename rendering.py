@@ -0,0 +1,260 @@
+#-----------------------------------------------------------------------
+#Module: rendering
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Headless rendering. Instead of opening a window per state and waiting
+## for it to be closed, the plots are drawn with the Agg backend straight
+## into PNG or SVG files. Figures are built with matplotlib.figure.Figure
+## instead of pyplot so nothing depends on a display or on pyplot's global
+## state, and the work is done in a process pool so it runs while the
+## next problem is being solved. Large grids are block averaged down
+## before contouring, a contour plot cannot show more detail than its
+## pixels anyway.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## downsample
+## probability_density
+## render_potential
+## render_densities
+## render_case
+## Renderer
+##
+#-----------------------------------------------------------------------
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from eigenstore import EigenReader
+from linearalgebra import creategrid, grid_axes
+
+# Grids bigger than this on an axis are averaged down before contouring.
+MAX_PLOT_POINTS = 200
+
+# Output formats savefig is asked for.
+FORMATS = ('png', 'svg')
+
+#-----------------------------------------------------------------------
+## Function: downsample
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Averages NxN arrays over blocks of f x f points (and 1D axes over
+## blocks of f points) so at most max_points are left on each axis.
+## Averaging (instead of taking every f-th point) keeps narrow peaks of a
+## density from disappearing between samples.
+##----------------------------------------------------------------------
+## Input:
+## arrays           list of NxN arrays and length N axes on the same grid
+##                  (e.g. x_pts, y_pts, density)
+## max_points       largest number of points wanted on each axis
+##----------------------------------------------------------------------
+## Output:
+## arrays           list of the reduced arrays, unchanged if already small
+##----------------------------------------------------------------------
+def downsample(arrays, max_points=MAX_PLOT_POINTS):
+    N = arrays[0].shape[0]
+    f = math.ceil(N/max_points)
+    if f <= 1:
+        return arrays
+    # Points left over at the edge that do not fill a whole block are dropped.
+    M = N//f
+    return [a[:M*f].reshape(M, f).mean(axis=1) if a.ndim == 1 else
+            a[:M*f, :M*f].reshape(M, f, M, f).mean(axis=(1, 3)) for a in arrays]
+
+#-----------------------------------------------------------------------
+## Function: probability_density
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Probability density of one state on the NxN grid.
+##----------------------------------------------------------------------
+## Input:
+## e_vec            eigenvectors, one per column, or an EigenReader
+## n                index of the state
+## N                number of points on each axis
+##----------------------------------------------------------------------
+## Output:
+## density          NxN array |psi|**2
+##----------------------------------------------------------------------
+def probability_density(e_vec, n, N):
+    # Same layout as reshape_evec, abs so complex (absorbing) states work too.
+    if isinstance(e_vec, EigenReader):
+        # Only this one state is read from the store.
+        return np.abs(e_vec.state(n))**2
+    return np.abs(e_vec[:, n].reshape(N, N))**2
+
+#-----------------------------------------------------------------------
+## Function: render_potential
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Draws the contour plot of plot_potential into a file.
+##----------------------------------------------------------------------
+## Input:
+## path             output file, the extension picks PNG or SVG
+## v                potential energy matrix
+## x                x coordinates, 1D axis, open grid or NxN array
+## y                y coordinates, same form as x
+##----------------------------------------------------------------------
+## Output:
+## path             the file written
+##----------------------------------------------------------------------
+def render_potential(path, v, x, y):
+    # contourf takes the 1D axes directly, no NxN coordinate arrays needed.
+    x, y = grid_axes(x, y)
+    x, y, v = downsample([x, y, np.real(v)])
+    fig = Figure(figsize=(8, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    contour = ax.contourf(x, y, v, 100)
+    fig.colorbar(contour, ax=ax)
+    ax.set_title("Plot of V")
+    ax.set_xlabel(r'$X$')
+    ax.set_ylabel(r'$Y$')
+    fig.savefig(path)
+    return path
+
+#-----------------------------------------------------------------------
+## Function: render_densities
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Draws the probability densities of all states as one grid of contour
+## plots, one panel per state, into a single file.
+##----------------------------------------------------------------------
+## Input:
+## path             output file, the extension picks PNG or SVG
+## e_vec            eigenvectors of the Hamiltonian, or an EigenReader
+## x                x coordinates, 1D axis, open grid or NxN array
+## y                y coordinates, same form as x
+## states           number of states to draw
+## N                number of points on each axis
+## e_values         eigenvalues, shown in the panel titles (optional)
+## levels           number of contour levels
+##----------------------------------------------------------------------
+## Output:
+## path             the file written
+##----------------------------------------------------------------------
+def render_densities(path, e_vec, x, y, states, N, e_values=None, levels=300):
+    cols = math.ceil(math.sqrt(states))
+    rows = math.ceil(states/cols)
+    fig = Figure(figsize=(4*cols, 3.5*rows))
+    FigureCanvasAgg(fig)
+
+    x_small, y_small = downsample(list(grid_axes(x, y)))
+    for n in range(states):
+        ax = fig.add_subplot(rows, cols, n + 1)
+        density, = downsample([probability_density(e_vec, n, N)])
+        contour = ax.contourf(x_small, y_small, density, levels)
+        fig.colorbar(contour, ax=ax)
+        title = "State {}".format(n)
+        if e_values is not None:
+            title += ", E = {:.6g}".format(np.real(e_values[n]))
+        ax.set_title(title)
+        ax.set_xlabel(r'$X$')
+        ax.set_ylabel(r'$Y$')
+    fig.tight_layout()
+    fig.savefig(path)
+    return path
+
+#-----------------------------------------------------------------------
+## Function: render_case
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Renders the potential and the densities of a result file written by
+## batch.run_case. Only the file name is sent to the worker process, the
+## arrays are read there, so nothing big is pickled.
+##----------------------------------------------------------------------
+## Input:
+## result_path      .npz file from batch.run_case
+## fmt              'png' or 'svg'
+##----------------------------------------------------------------------
+## Output:
+## paths            list of the files written
+##----------------------------------------------------------------------
+def render_case(result_path, fmt='png'):
+    with np.load(result_path) as result:
+        e_values = result['e_values']
+        potential = result['potential']
+        L, N = float(result['L']), int(result['N'])
+        bc = str(result['bc']) if 'bc' in result else 'dirichlet'
+        # With a store the states are read one at a time while drawing.
+        e_vec = result['e_vec'] if 'e_vec' in result else EigenReader(str(result['store']))
+    grid = creategrid(L, N, bc)
+
+    stem = os.path.splitext(result_path)[0]
+    paths = [render_potential('{}_potential.{}'.format(stem, fmt), potential, grid.x_pts, grid.y_pts),
+             render_densities('{}_densities.{}'.format(stem, fmt), e_vec, grid.x_pts, grid.y_pts,
+                              len(e_values), N, e_values)]
+    if isinstance(e_vec, EigenReader):
+        e_vec.close()
+    return paths
+
+#-----------------------------------------------------------------------
+## Class: Renderer
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Background rendering queue. Every submit returns straight away and the
+## figure is drawn in a worker process, close() (or leaving a with block)
+## waits for everything still being drawn.
+##----------------------------------------------------------------------
+## Input:
+## output           directory the figures are written to
+## fmt              'png' or 'svg'
+## workers          number of rendering processes
+##----------------------------------------------------------------------
+class Renderer:
+
+    def __init__(self, output, fmt='png', workers=2):
+        if fmt not in FORMATS:
+            raise ValueError("Unknown image format {}. Use one of {}.".format(fmt, FORMATS))
+        os.makedirs(output, exist_ok=True)
+        self.output = output
+        self.fmt = fmt
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.futures = []
+
+    def path(self, name):
+        return os.path.join(self.output, '{}.{}'.format(name, self.fmt))
+
+    def submit(self, function, *args):
+        future = self.pool.submit(function, *args)
+        self.futures.append(future)
+        return future
+
+    def potential(self, name, v, x, y):
+        return self.submit(render_potential, self.path(name), v, x, y)
+
+    def densities(self, name, e_vec, x, y, states, N, e_values=None):
+        return self.submit(render_densities, self.path(name), e_vec, x, y, states, N, e_values)
+
+    def case(self, result_path):
+        return self.submit(render_case, result_path, self.fmt)
+
+    def close(self):
+        # result() re-raises anything that went wrong in a worker.
+        paths = []
+        for future in self.futures:
+            result = future.result()
+            paths += result if isinstance(result, list) else [result]
+        self.pool.shutdown()
+        self.futures = []
+        return paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.pool.shutdown(cancel_futures=True)
+        return False
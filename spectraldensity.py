@@ -0,0 +1,336 @@
+#-----------------------------------------------------------------------
+#Module: spectral density
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Density of states and number of states below an energy, estimated with
+## matvecs only. No eigenvectors are formed. Use it to find out how many
+## states lie below E before paying for an eigen_solve with states=k. The
+## cost is a few hundred matvecs per random vector, whatever the number
+## of states below E.
+##
+## Both methods estimate a trace Tr f(H) = sum_n f(E_n), where f is a
+## delta (density) or a step (count). The estimator averages z^T f(H) z
+## over random vectors z of +-1 entries, since the average of that is
+## the trace (Hutchinson).
+##   'kpm'      kernel polynomial method. H is scaled into [-1, 1] with the
+##              Gershgorin bounds. f is expanded in Chebyshev polynomials
+##              damped by the Jackson kernel, so there is no Gibbs ringing.
+##              The moments z^T T_m(H) z come from the three term
+##              recurrence at two moments per matvec. The energy resolution
+##              is about pi*(E_max - E_min)/(2*moments). Fine grids have a
+##              wide spectrum and need more moments.
+##   'lanczos'  stochastic Lanczos quadrature. Each z gets steps Lanczos
+##              steps, which give a small tridiagonal matrix. Its
+##              eigenvalues are the nodes of a Gauss quadrature of f, and
+##              the squared first components of its eigenvectors are the
+##              weights. The lowest nodes converge to the lowest
+##              eigenvalues first. Near the bottom of the spectrum it
+##              therefore separates levels far better than KPM for the
+##              same matvecs.
+## The statistical error of a count is about sqrt(2*count/vectors). It is
+## returned as the standard error over the random vectors.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## spectrum_bounds
+## random_vectors
+## jackson_kernel
+## chebyshev_moments
+## spectral_density
+## lanczos_quadrature
+## count_states
+##
+#-----------------------------------------------------------------------
+
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.linalg import eigh_tridiagonal
+from linearalgebra import StencilOperator, ThreadedMatrix, counted_operator, spectrum_lower_bound, spectrum_norm_bound
+
+# Methods count_states takes.
+DENSITY_METHODS = ('kpm', 'lanczos')
+
+# The spectrum is scaled into [-1 + EDGE/2, 1 - EDGE/2] so rounding in the
+# bounds never puts an eigenvalue outside the Chebyshev interval.
+EDGE = 0.01
+
+#-----------------------------------------------------------------------
+## Function: spectrum_bounds
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Interval holding every eigenvalue of a hermitian hamiltonian.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      sparse matrix, StencilOperator, ThreadedMatrix (use
+##                  threaded_operator for threaded matvecs) or
+##                  LinearOperator
+## bounds           (lower, upper) to use instead, needed for a general
+##                  LinearOperator whose entries are not known (optional)
+##----------------------------------------------------------------------
+## Output:
+## lower, upper     bounds on the spectrum
+##----------------------------------------------------------------------
+def spectrum_bounds(hamiltonian, bounds=None):
+    if np.issubdtype(hamiltonian.dtype, np.complexfloating):
+        raise ValueError("The density of states needs a hermitian hamiltonian, absorbing boundaries make it complex.")
+    if bounds is not None:
+        lower, upper = bounds
+    elif sparse.issparse(hamiltonian) or isinstance(hamiltonian, (StencilOperator, ThreadedMatrix)):
+        lower, upper = spectrum_lower_bound(hamiltonian), spectrum_norm_bound(hamiltonian)
+    else:
+        raise ValueError("Give the bounds of the spectrum for a hamiltonian that is neither sparse nor a StencilOperator.")
+    if not upper > lower:
+        raise ValueError("Upper bound {} of the spectrum is not above the lower bound {}.".format(upper, lower))
+    return float(lower), float(upper)
+
+#-----------------------------------------------------------------------
+## Function: random_vectors
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Block of random +-1 vectors. Of all the choices these give the trace
+## estimate with the smallest variance.
+##----------------------------------------------------------------------
+## Input:
+## n                length of each vector
+## vectors          number of vectors
+## seed             seed of the random generator
+##----------------------------------------------------------------------
+## Output:
+## Z                n x vectors array
+##----------------------------------------------------------------------
+def random_vectors(n, vectors, seed=0):
+    return np.random.default_rng(seed).choice([-1.0, 1.0], size=(n, vectors))
+
+#-----------------------------------------------------------------------
+## Function: jackson_kernel
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Jackson damping factors of a Chebyshev series. They turn the truncated
+## series into a positive one, so a density never goes negative and a
+## count only steps up.
+##----------------------------------------------------------------------
+## Input:
+## moments          number of moments
+##----------------------------------------------------------------------
+## Output:
+## g                damping factor of every moment
+##----------------------------------------------------------------------
+def jackson_kernel(moments):
+    m = np.arange(moments)
+    q = np.pi/(moments + 1)
+    return ((moments - m + 1)*np.cos(q*m) + np.sin(q*m)/np.tan(q))/(moments + 1)
+
+#-----------------------------------------------------------------------
+## Function: chebyshev_moments
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Moments z^T T_m(H~) z of the scaled hamiltonian H~ = (H - center)/half
+## for a block of random vectors. With T_2k = 2 T_k**2 - T_0 and
+## T_2k+1 = 2 T_k+1 T_k - T_1, each matvec gives two moments.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      hermitian sparse matrix or LinearOperator
+## moments          number of moments
+## vectors          number of random vectors
+## bounds           (lower, upper) of the spectrum (optional, see
+##                  spectrum_bounds)
+## seed             seed of the random vectors
+## stats            dict filled with matvecs and time (optional)
+##----------------------------------------------------------------------
+## Output:
+## mu               moments x vectors array
+## center, half     the scaling, E = center + half*x
+##----------------------------------------------------------------------
+def chebyshev_moments(hamiltonian, moments, vectors=10, bounds=None, seed=0, stats=None):
+    if moments < 2:
+        raise ValueError("At least 2 Chebyshev moments are needed, got {}.".format(moments))
+    lower, upper = spectrum_bounds(hamiltonian, bounds)
+    center = (upper + lower)/2
+    half = (upper - lower)/(2 - EDGE)
+
+    counts = {'matvecs': 0}
+    start = time.perf_counter()
+    op = counted_operator(hamiltonian, counts)
+    def scaled(V):
+        return (op.matmat(V) - center*V)/half
+
+    Z = random_vectors(hamiltonian.shape[0], vectors, seed)
+    mu = np.empty((moments, vectors))
+    prev, cur = Z, scaled(Z)
+    mu[0] = np.sum(Z*Z, axis=0)
+    mu[1] = np.sum(Z*cur, axis=0)
+    k = 1
+    while 2*k < moments:
+        # Here prev = T_k-1 z and cur = T_k z.
+        mu[2*k] = 2*np.sum(cur*cur, axis=0) - mu[0]
+        if 2*k + 1 < moments:
+            prev, cur = cur, 2*scaled(cur) - prev
+            mu[2*k + 1] = 2*np.sum(cur*prev, axis=0) - mu[1]
+        k += 1
+
+    if stats is not None:
+        stats.update(matvecs=counts['matvecs'], time=time.perf_counter() - start)
+    return mu, center, half
+
+#-----------------------------------------------------------------------
+## Function: spectral_density
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Density of states with the kernel polynomial method, in states per unit
+## of energy. Its integral over all energies is the number of unknowns.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      hermitian sparse matrix or LinearOperator
+## energies         energies to evaluate the density at
+## moments          number of Chebyshev moments
+## vectors          number of random vectors
+## bounds           (lower, upper) of the spectrum (optional, see
+##                  spectrum_bounds)
+## seed             seed of the random vectors
+## stats            dict filled with method, matvecs, time and the
+##                  resolution in energy (optional)
+##----------------------------------------------------------------------
+## Output:
+## density          density of states at every energy
+##----------------------------------------------------------------------
+def spectral_density(hamiltonian, energies, moments=400, vectors=10, bounds=None, seed=0, stats=None):
+    start = time.perf_counter()
+    solve_stats = {}
+    mu, center, half = chebyshev_moments(hamiltonian, moments, vectors, bounds, seed, solve_stats)
+    damped = jackson_kernel(moments)*mu.mean(axis=1)
+
+    x = (np.asarray(energies, dtype=float) - center)/half
+    inside = np.abs(x) < 1
+    theta = np.arccos(np.clip(x, -1, 1))
+    series = damped[0] + 2*np.tensordot(damped[1:], np.cos(np.multiply.outer(np.arange(1, moments), theta)), axes=1)
+    density = np.where(inside, series/(np.pi*half*np.sqrt(np.where(inside, 1 - x**2, 1))), 0.0)
+
+    if stats is not None:
+        stats.update(method='kpm', iterations=0, matvecs=solve_stats['matvecs'], time=time.perf_counter() - start,
+                     resolution=np.pi*half/moments)
+    return density
+
+#-----------------------------------------------------------------------
+## Function: lanczos_quadrature
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Gauss quadrature nodes and weights of the spectral measure seen from
+## each random vector, from steps Lanczos steps run on the whole block at
+## once. There is no reorthogonalization. Copies of converged Ritz values
+## that appear without it split the weight of their eigenvalue between
+## them, so the quadrature stays right.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      hermitian sparse matrix or LinearOperator
+## steps            number of Lanczos steps per vector
+## vectors          number of random vectors
+## seed             seed of the random vectors
+## stats            dict filled with matvecs and time (optional)
+##----------------------------------------------------------------------
+## Output:
+## nodes            vectors x steps array of quadrature nodes (energies)
+## weights          matching weights, each row sums to the number of
+##                  unknowns
+##----------------------------------------------------------------------
+def lanczos_quadrature(hamiltonian, steps, vectors=10, seed=0, stats=None):
+    if np.issubdtype(hamiltonian.dtype, np.complexfloating):
+        raise ValueError("Lanczos quadrature needs a hermitian hamiltonian, absorbing boundaries make it complex.")
+    n = hamiltonian.shape[0]
+    steps = min(steps, n)
+    counts = {'matvecs': 0}
+    start = time.perf_counter()
+    op = counted_operator(hamiltonian, counts)
+
+    Z = random_vectors(n, vectors, seed)
+    Q = Z/np.sqrt(n)
+    prev = np.zeros_like(Q)
+    alpha = np.empty((steps, vectors))
+    beta = np.zeros((steps, vectors))
+    for j in range(steps):
+        # prev is zero on the first step.
+        W = op.matmat(Q) - beta[j - 1]*prev
+        alpha[j] = np.sum(Q*W, axis=0)
+        W -= alpha[j]*Q
+        beta[j] = np.linalg.norm(W, axis=0)
+        # A breakdown means the Krylov space is invariant and the quadrature exact.
+        if np.min(beta[j]) < 1e-12*np.max(np.abs(alpha[:j + 1])):
+            steps = j + 1
+            break
+        prev, Q = Q, W/beta[j]
+
+    nodes = np.empty((vectors, steps))
+    weights = np.empty((vectors, steps))
+    for r in range(vectors):
+        theta, S = eigh_tridiagonal(alpha[:steps, r], beta[:steps - 1, r])
+        nodes[r] = theta
+        # |z|**2 = n for +-1 entries.
+        weights[r] = n*S[0]**2
+
+    if stats is not None:
+        stats.update(matvecs=counts['matvecs'], time=time.perf_counter() - start)
+    return nodes, weights
+
+#-----------------------------------------------------------------------
+## Function: count_states
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Estimated number of eigenvalues below each energy. Use it to size the
+## states of a full solve.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      hermitian sparse matrix or LinearOperator
+## energy           energy or array of energies
+## method           'kpm' or 'lanczos'
+## moments          number of Chebyshev moments ('kpm')
+## steps            number of Lanczos steps per vector ('lanczos')
+## vectors          number of random vectors
+## bounds           (lower, upper) of the spectrum for 'kpm' (optional,
+##                  see spectrum_bounds)
+## seed             seed of the random vectors
+## stats            dict filled with method, matvecs, time, the standard
+##                  error of the count and, for 'kpm', the resolution in
+##                  energy (optional)
+##----------------------------------------------------------------------
+## Output:
+## count            estimated number of states below energy, same shape
+##                  as energy
+##----------------------------------------------------------------------
+def count_states(hamiltonian, energy, method='kpm', moments=400, steps=100, vectors=10, bounds=None, seed=0,
+                 stats=None):
+    start = time.perf_counter()
+    energy = np.asarray(energy, dtype=float)
+    solve_stats = {}
+    if method == 'kpm':
+        mu, center, half = chebyshev_moments(hamiltonian, moments, vectors, bounds, seed, solve_stats)
+        # Chebyshev coefficients of the step 1 for x < e, with e = cos(theta).
+        theta = np.arccos(np.clip((energy - center)/half, -1, 1))
+        m = np.arange(1, moments)
+        coeffs = np.concatenate([(1 - theta/np.pi)[None],
+                                 -2*np.sin(np.multiply.outer(m, theta))/(np.pi*m.reshape((-1,) + (1,)*theta.ndim))])
+        # One count per random vector, the spread between them is the error.
+        samples = np.tensordot(jackson_kernel(moments)[:, None]*mu, coeffs, axes=([0], [0]))
+        extra = dict(resolution=np.pi*half/moments)
+    elif method == 'lanczos':
+        nodes, weights = lanczos_quadrature(hamiltonian, steps, vectors, seed, solve_stats)
+        below = nodes[:, :, None] < energy.reshape(1, 1, -1)
+        samples = np.sum(weights[:, :, None]*below, axis=1).reshape((vectors,) + energy.shape)
+        extra = dict(steps=nodes.shape[1])
+    else:
+        raise ValueError("Unknown density method {}. Use one of {}.".format(method, DENSITY_METHODS))
+
+    count = samples.mean(axis=0)
+    if stats is not None:
+        error = samples.std(axis=0, ddof=1)/np.sqrt(vectors) if vectors > 1 else np.full(energy.shape, np.nan)
+        stats.update(method=method, iterations=0, matvecs=solve_stats['matvecs'], time=time.perf_counter() - start,
+                     error=error, **extra)
+    return count
@@ -0,0 +1,258 @@
+#-----------------------------------------------------------------------
+#Module: symmetry
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Symmetry adapted solves. Every potential in quantum.py is unchanged by
+## x -> -x, y -> -y and x <-> y (the symmetry group of the square). The
+## hamiltonian then splits into independent blocks, one per symmetry
+## sector, each living on about an eighth (or a quarter) of the grid:
+##
+##   A1   even in x and y, symmetric under x <-> y
+##   B1   even in x and y, antisymmetric under x <-> y
+##   B2   odd in x and y, symmetric under x <-> y
+##   A2   odd in x and y, antisymmetric under x <-> y
+##   E    even in x and odd in y (quarter grid). Its partner, odd in x and
+##        even in y, has exactly the same energies and is just the
+##        transpose, so it is never solved.
+##
+## The sectors are solved independently (in parallel if asked) and the
+## spectra merged, with the eigenvectors unfolded back to the full NxN
+## grid so reshape_evec and the plots work as before.
+##
+## The reflections are reflections of the grid indices, which is only right
+## when the grid is symmetric about 0. That holds for Dirichlet and
+## absorbing grids but not for periodic ones.
+##----------------------------------------------------------------------
+##
+## Included functions:
+## check_symmetric
+## sector_basis
+## symmetry_sectors
+## solve_sector
+## symmetry_solve
+##
+#-----------------------------------------------------------------------
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import aslinearoperator
+from linearalgebra import eigen_solve
+
+# Sectors below this size are solved densely, ARPACK needs k < n anyway.
+DENSE_SIZE = 400
+
+#-----------------------------------------------------------------------
+## Function: check_symmetric
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Checks that a potential has the full symmetry of the square.
+##----------------------------------------------------------------------
+## Input:
+## potential        NxN potential energy matrix
+##----------------------------------------------------------------------
+## Output:
+## symmetric        True if V is even in x, even in y and symmetric under
+##                  x <-> y
+##----------------------------------------------------------------------
+def check_symmetric(potential):
+    scale = max(np.max(np.abs(potential)), 1.0)
+    tol = 1e-10*scale
+    return (np.allclose(potential, potential[:, ::-1], rtol=0, atol=tol)
+            and np.allclose(potential, potential[::-1, :], rtol=0, atol=tol)
+            and np.allclose(potential, potential.T, rtol=0, atol=tol))
+
+#-----------------------------------------------------------------------
+## Function: sector_basis
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Orthonormal basis of one symmetry sector. Each basis vector is the
+## symmetrized combination sum_g chi(g) e_g(r) of one representative grid
+## point r, with chi the character of the sector.
+##----------------------------------------------------------------------
+## Input:
+## N                discretized points from -L to L.
+## px, py           parity (+1 or -1) under x -> -x and y -> -y
+## swap             parity under x <-> y, or None to ignore the swap
+##----------------------------------------------------------------------
+## Output:
+## P                sparse N**2 x m matrix with orthonormal columns
+##----------------------------------------------------------------------
+def sector_basis(N, px, py, swap=None):
+    idx = np.arange(N**2).reshape(N, N)
+    # Row index is y and column index is x. Each entry is where the point goes.
+    images = [(idx, 1), (idx[:, ::-1], px), (idx[::-1, :], py), (idx[::-1, ::-1], px*py)]
+    if swap is not None:
+        images += [(image.T, swap*chi) for image, chi in images]
+
+    # Representatives: the lower left quadrant, and its lower triangle when
+    # the swap is used. Points on the symmetry lines give zero columns in the
+    # odd sectors, those are dropped below.
+    half = (N + 1)//2
+    i, j = np.meshgrid(np.arange(half), np.arange(half), indexing='ij')
+    keep = (j >= i) if swap is not None else np.ones_like(i, dtype=bool)
+    reps = idx[i[keep], j[keep]]
+
+    cols = np.arange(len(reps))
+    rows = np.concatenate([image.ravel()[reps] for image, _ in images])
+    vals = np.concatenate([chi*np.ones(len(reps)) for _, chi in images])
+    P = sparse.csc_matrix((vals, (rows, np.tile(cols, len(images)))), shape=(N**2, len(reps)))
+    P.eliminate_zeros()
+
+    norms = np.sqrt(np.asarray(P.multiply(P).sum(axis=0)).ravel())
+    nonzero = norms > 0
+    P = P[:, nonzero] @ sparse.diags(1/norms[nonzero])
+    return sparse.csc_matrix(P)
+
+#-----------------------------------------------------------------------
+## Function: symmetry_sectors
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## All the sectors that have to be solved.
+##----------------------------------------------------------------------
+## Input:
+## N                discretized points from -L to L.
+##----------------------------------------------------------------------
+## Output:
+## sectors          list of (name, P, degeneracy) tuples
+##----------------------------------------------------------------------
+def symmetry_sectors(N):
+    return [('A1', sector_basis(N, 1, 1, 1), 1),
+            ('B1', sector_basis(N, 1, 1, -1), 1),
+            ('B2', sector_basis(N, -1, -1, 1), 1),
+            ('A2', sector_basis(N, -1, -1, -1), 1),
+            ('E', sector_basis(N, 1, -1), 2)]
+
+#-----------------------------------------------------------------------
+## Function: solve_sector
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Solves the hamiltonian restricted to one sector.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      full hamiltonian (sparse matrix or LinearOperator)
+## P                sector basis from sector_basis
+## states           number of e-values and e-vectors wanted
+## method           eigen_solve strategy, 'arpack' is used instead when the
+##                  block cannot be factorized or is not hermitian
+## vectors          False returns the eigenvalues only
+##----------------------------------------------------------------------
+## Output:
+## e_values         sector eigenvalues
+## e_vec            sector eigenvectors in the reduced basis, None if
+##                  vectors is False
+## stats            solver stats
+##----------------------------------------------------------------------
+def solve_sector(hamiltonian, P, states, method, vectors=True):
+    m = P.shape[1]
+    k = min(states, m)
+    if k == 0:
+        return np.zeros(0), np.zeros((0, 0)), {}
+
+    stats = {}
+    if sparse.issparse(hamiltonian):
+        reduced = sparse.csr_matrix(P.T @ hamiltonian @ P)
+    else:
+        reduced = aslinearoperator(P.T) @ hamiltonian @ aslinearoperator(P)
+
+    if m <= max(DENSE_SIZE, 2*k + 2):
+        start = time.perf_counter()
+        dense = reduced.toarray() if sparse.issparse(reduced) else reduced @ np.identity(m)
+        if np.iscomplexobj(dense):
+            # Absorbing boundaries, the block is complex symmetric but not hermitian.
+            e_values, e_vec = np.linalg.eig(dense)
+            order = np.argsort(e_values.real)
+            e_values, e_vec = e_values[order], e_vec[:, order]
+        else:
+            e_values, e_vec = np.linalg.eigh(dense)
+        stats.update(method='dense', iterations=0, matvecs=0, time=time.perf_counter() - start)
+        return e_values[:k], e_vec[:, :k] if vectors else None, stats
+
+    # A reduced operator cannot be factorized for shift-invert, and LOBPCG needs a
+    # hermitian block. Plain ARPACK (eigs for a complex block) works for all of them.
+    cannot_factorize = method == 'shift-invert' and not sparse.issparse(reduced)
+    not_hermitian = method == 'lobpcg' and np.issubdtype(reduced.dtype, np.complexfloating)
+    if cannot_factorize or not_hermitian:
+        method = 'arpack'
+    e_values, e_vec = eigen_solve(reduced, k, method=method, stats=stats, vectors=vectors)
+    return e_values, e_vec, stats
+
+#-----------------------------------------------------------------------
+## Function: symmetry_solve
+#-----------------------------------------------------------------------
+## By: Nathan Crawford
+##
+## Symmetry adapted replacement for eigen_solve. Gives the same lowest
+## eigenpairs for potentials with the symmetry of the square.
+##----------------------------------------------------------------------
+## Input:
+## hamiltonian      full hamiltonian (sparse matrix or LinearOperator)
+## potential        NxN potential, used to check the symmetry
+## states           number of e-values and e-vectors
+## method           eigen_solve strategy for each sector
+## workers          number of processes to solve the sectors in, None
+##                  solves them one after another
+## stats            dict filled with the summed solver stats and whether
+##                  every sector converged (optional)
+## vectors          False returns the eigenvalues only
+##----------------------------------------------------------------------
+## Output:
+## e_values         eigenvalues from smallest to largest
+## e_vec            eigenvectors on the full grid, one per column, None if
+##                  vectors is False
+##----------------------------------------------------------------------
+def symmetry_solve(hamiltonian, potential, states, method='shift-invert', workers=None, stats=None, vectors=True):
+    if not check_symmetric(potential):
+        raise ValueError("Potential is not symmetric under x -> -x, y -> -y and x <-> y.")
+    start = time.perf_counter()
+    N = potential.shape[0]
+
+    sectors = symmetry_sectors(N)
+    # Every sector could hold all of the lowest states so each is asked for all
+    # of them. For E each level counts twice.
+    wanted = [states if degeneracy == 1 else (states + 1)//2 for _, _, degeneracy in sectors]
+    if workers is None:
+        results = [solve_sector(hamiltonian, P, k, method, vectors) for (_, P, _), k in zip(sectors, wanted)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(solve_sector, hamiltonian, P, k, method, vectors)
+                       for (_, P, _), k in zip(sectors, wanted)]
+            results = [future.result() for future in futures]
+
+    # Merge the spectra: (energy, sector, index in sector, transposed partner).
+    levels = []
+    for s, ((_, _, degeneracy), (values, _, _)) in enumerate(zip(sectors, results)):
+        for n, value in enumerate(values):
+            for partner in range(degeneracy):
+                levels.append((value, s, n, partner))
+    levels.sort(key=lambda level: level[0].real)
+    levels = levels[:states]
+
+    e_values = np.array([level[0] for level in levels])
+    e_vec = None
+    if vectors:
+        e_vec = np.empty((N**2, len(levels)), dtype=np.result_type(*[result[1] for result in results]))
+        for col, (_, s, n, partner) in enumerate(levels):
+            vec = sectors[s][1] @ results[s][1][:, n]
+            if partner:
+                # Odd in x and even in y: the transpose of the E state.
+                vec = vec.reshape(N, N).T.ravel()
+            e_vec[:, col] = vec
+
+    if stats is not None:
+        sector_stats = [result[2] for result in results]
+        stats.update(method='symmetry-' + method,
+                     iterations=sum(s.get('iterations', 0) for s in sector_stats),
+                     matvecs=sum(s.get('matvecs', 0) for s in sector_stats),
+                     time=time.perf_counter() - start,
+                     converged=all(s.get('converged', True) for s in sector_stats),
+                     residual=max((s['residual'] for s in sector_stats if 'residual' in s), default=None),
+                     sectors={name: P.shape[1] for name, P, _ in sectors})
+    return e_values, e_vec